@@ -0,0 +1,503 @@
+"""
+Script for generating new clinvar tables with the fields of population datasets (ExAC, gnomAD exomes, gnomAD genomes)
+added to each clinvar variant that's in them.
+
+The clinvar table is read once, and each of its variants is looked up in the sites VCFs of all the datasets given,
+side by side (see sites_vcf.py), or with --store, in the population store of each VCF (see population_store.py). With --position-filter, the variants whose position is definitely not in a VCF are skipped without reading it (see position_filter.py). The fields of each dataset are listed in its SOURCE_SPECS entry. It writes a table per
+dataset with the clinvar columns followed by the fields of the dataset (-o), and/or one combined table with the fields
+of every dataset, prefixed by its label (-c):
+
+    python add_population_fields.py -i clinvar_alleles.single.b37.tsv.gz \\
+        -e ExAC.r1.sites.vep.normalized.vcf.gz -ge gnomad.exomes.r2.0.1.sites.normalized.vcf.gz \\
+        -o 'clinvar_alleles_with_%(label)s.single.b37.tsv.gz'
+
+With -w, regions of the tabix-indexed clinvar table are looked up in that many processes, each with its own readers,
+and the outputs are concatenated in the order of the table.
+"""
+import argparse
+from collections import defaultdict, namedtuple, OrderedDict
+import gzip
+import itertools
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+from allele_key import pack_allele_key
+from bgzf import BgzfWriter
+from population_store import open_population_store
+from position_filter import FALSE_POSITIVE_RATE, open_position_filter, pack_position_key
+from sites_vcf import MAX_SCAN_DISTANCE, SortedSitesVcfReader, TabixSitesVcfReader
+from table_record import TableReader, TableWriter
+from tabix_regions import get_balanced_regions
+
+NEEDED_EXAC_FIELDS = [ 'Filter',  # whether the variant is PASS
+ 'AC', 'AC_Het', 'AC_Hom', 'AC_Adj', 'AN', 'AN_Adj', 'AF',
+ 'AC_AFR', 'AC_AMR', 'AC_EAS', 'AC_FIN', 'AC_NFE', 'AC_OTH', 'AC_SAS',
+ 'AN_AFR', 'AN_AMR', 'AN_EAS', 'AN_FIN', 'AN_NFE', 'AN_OTH', 'AN_SAS','DP',
+ 'Het_AFR', 'Het_AMR', 'Het_EAS', 'Het_FIN', 'Het_NFE', 'Het_OTH', 'Het_SAS',
+ 'Hom_AFR', 'Hom_AMR', 'Hom_EAS', 'Hom_FIN', 'Hom_NFE', 'Hom_OTH', 'Hom_SAS',
+ 'AC_MALE', 'AC_FEMALE', 'AN_MALE', 'AN_FEMALE', 'AC_CONSANGUINEOUS', 'AN_CONSANGUINEOUS', 'Hom_CONSANGUINEOUS',
+ 'AC_POPMAX', 'AN_POPMAX', 'POPMAX']
+
+NEEDED_GNOMAD_FIELDS = [ 'Filter',  # whether the variant is PASS
+ 'AC', 'AN', 'AF', 'DP','Hom',
+ 'AC_AFR', 'AC_AMR', 'AC_ASJ', 'AC_EAS', 'AC_SAS', 'AC_FIN', 'AC_NFE', 'AC_OTH',
+ 'AN_AFR', 'AN_AMR', 'AN_ASJ', 'AN_EAS', 'AN_SAS', 'AN_FIN', 'AN_NFE', 'AN_OTH',
+ 'AC_AFR', 'AF_AMR', 'AF_ASJ', 'AF_EAS', 'AF_SAS', 'AF_FIN', 'AF_NFE', 'AF_OTH',
+ 'AC_Male', 'AC_Female', 'AN_Male', 'AN_Female',
+ 'Hom_AFR', 'Hom_AMR', 'Hom_ASJ', 'Hom_EAS', 'Hom_SAS', 'Hom_FIN', 'Hom_NFE', 'Hom_OTH',
+ 'Hemi_AFR', 'Hemi_AMR', 'Hemi_ASJ', 'Hemi_EAS', 'Hemi_SAS', 'Hemi_FIN', 'Hemi_NFE', 'Hemi_OTH',
+ 'Hom_Male', 'Hom_Female',
+ 'AS_RF', 'AS_FilterStatus',
+ 'AC_POPMAX', 'AN_POPMAX', 'AF_POPMAX', 'POPMAX',
+]
+
+# name: the name of the dataset in the warnings
+# counts_suffix: the suffix of the names of its counts, eg. clinvar_variants_with_no_matching_position_in_exac
+# variant_url: link to the browser page of a variant
+# fields: the INFO fields to add to the clinvar table, and 'Filter' for the FILTER column
+# require_all_fields: whether a row that lacks some of the fields is an error, or gets '' for them
+SourceSpec = namedtuple('SourceSpec', ['name', 'counts_suffix', 'variant_url', 'fields', 'require_all_fields'])
+
+SOURCE_SPECS = OrderedDict([
+    ('gnomad_genomes', SourceSpec('gnomAD', 'gnomad', 'http://gnomad.broadinstitute.org/variant/', NEEDED_GNOMAD_FIELDS, False)),
+    ('gnomad_exomes', SourceSpec('gnomAD', 'gnomad', 'http://gnomad.broadinstitute.org/variant/', NEEDED_GNOMAD_FIELDS, False)),
+    ('exac_v1', SourceSpec('ExAC', 'exac', 'http://exac.broadinstitute.org/variant/', NEEDED_EXAC_FIELDS, True)),
+])
+
+CLINVAR_CHUNK_SIZE = 10000  # the clinvar variants are looked up this many at a time
+REGIONS_PER_WORKER = 4  # with --workers, the clinvar table is split into this many regions per worker
+
+
+class PopulationSource(object):
+    """Looks up clinvar variants in the sites VCF of a dataset, and counts how they match.
+
+    Args:
+      label: key of the dataset in SOURCE_SPECS (eg. 'exac_v1')
+      sites_vcf: A sites_vcf reader of the dataset's vcf, decomposed / normalized with vt
+      position_filter: position_filter.PositionFilter of the vcf. The variants whose position isn't in it are counted
+        as having no matching position without reading the vcf.
+    """
+
+    def __init__(self, label, sites_vcf, position_filter=None):
+        self.label = label
+        self.spec = SOURCE_SPECS[label]
+        self.sites_vcf = sites_vcf
+        self.position_filter = position_filter
+        self.fields_set = set(self.spec.fields)
+        self.empty_column_values = [''] * len(self.spec.fields)
+        self.counts = defaultdict(int)
+        self.skipped_lookups = 0
+
+    def get_column_values(self, chrom, pos, ref, alt):
+        """Retrieves the vcf row corresponding to the given chrom, pos, ref, alt, and extracts the column values listed in the fields of the dataset
+
+        Args:
+          chrom: chromosome (eg. '1')
+          pos: the minrepped clinvar variant position
+          ref: the minrepped clinvar ref allele
+          alt: the minrepped clinvar alt allele
+
+        Return:
+          A list of the values of the fields, or of '' if the variant isn't in the dataset
+        """
+
+        if chrom == 'MT':
+            return self.empty_column_values
+
+        spec = self.spec
+        counts = self.counts
+        counts['total_clinvar_variants'] += 1
+
+        # retrieve the variant - there can be more than 1 vcf record at a position
+        vcf_alleles = []
+        for vcf_row_fields in self.sites_vcf.get_rows(chrom, pos):
+            vcf_ref_allele = vcf_row_fields[3]
+            vcf_alt_allele = vcf_row_fields[4]
+            if "," in vcf_alt_allele:
+                raise Exception("Found multiallelic variant: %s. Expecting an %s VCF that has been decomposed / normalized with vt." % ("-".join(vcf_row_fields[0:5]), spec.name))
+
+            if ref == vcf_ref_allele and alt == vcf_alt_allele:
+                counts['clinvar_variants_with_matching_position_and_matching_allele'] += 1
+                break
+            vcf_alleles.append((vcf_ref_allele, vcf_alt_allele))
+        else:
+            self.count_mismatch(chrom, pos, ref, alt, vcf_alleles)
+            return self.empty_column_values
+
+        filter_value = vcf_row_fields[6]
+        info_fields = [('Filter', filter_value)] + [tuple(kv.split('=')) for kv in vcf_row_fields[7].split(';')]
+        info_fields = dict(kv for kv in info_fields if kv[0] in self.fields_set)
+        if spec.require_all_fields:
+            try:
+                return [info_fields[k] for k in spec.fields]
+            except KeyError, e:
+                raise ValueError("ERROR: unable to parse INFO fields in row: %s.  %s" % (vcf_row_fields, e))
+        return [info_fields.get(k, '') for k in spec.fields]
+
+    def get_column_values_of_alleles(self, alleles):
+        """Return the get_column_values of a list of (chrom, pos, ref, alt)"""
+
+        if self.position_filter is None:
+            return [self.get_column_values(chrom, pos, ref, alt) for chrom, pos, ref, alt in alleles]
+
+        maybe_in_vcf = self.position_filter.contains(
+            np.array([pack_position_key(chrom, pos) for chrom, pos, ref, alt in alleles], dtype=np.int64))
+        column_values = []
+        for (chrom, pos, ref, alt), lookup in zip(alleles, maybe_in_vcf.tolist()):
+            if lookup or chrom == 'MT':
+                column_values.append(self.get_column_values(chrom, pos, ref, alt))
+                continue
+            self.counts['total_clinvar_variants'] += 1
+            self.count_mismatch(chrom, pos, ref, alt, [])
+            self.skipped_lookups += 1
+            column_values.append(self.empty_column_values)
+        return column_values
+
+    def count_mismatch(self, chrom, pos, ref, alt, vcf_alleles):
+        """Count, and warn about, a clinvar variant that isn't in the dataset
+
+        Args:
+          vcf_alleles: the (ref, alt) of the vcf records at the position of the variant, in the order of the vcf
+        """
+
+        spec = self.spec
+        counts = self.counts
+        suffix = spec.counts_suffix
+        if not vcf_alleles:
+            counts['clinvar_variants_with_no_matching_position_in_' + suffix] += 1
+            return
+
+        vcf_ref_allele, vcf_alt_allele = vcf_alleles[-1]
+        if len(ref) + len(alt) + len(vcf_ref_allele) + len(vcf_alt_allele) > 4:
+            counts['clinvar_indel_with_no_matching_allele_in_' + suffix] += 1
+        elif ref != vcf_ref_allele and alt != vcf_alt_allele:
+            counts['clinvar_snp_with_mismatching_ref_and_alt_allele_in_' + suffix] += 1
+        elif ref != vcf_ref_allele:
+            counts['clinvar_snp_with_mismatching_ref_allele_in_' + suffix] += 1
+        elif alt != vcf_alt_allele:
+            counts['clinvar_snp_with_mismatching_alt_allele_in_' + suffix] += 1
+        else:
+            counts['clinvar_snp_with_unknown_mismatch'] += 1
+
+        sys.stderr.write("WARNING: %s variant %s:%s (%s%s-%s-%s-%s) - %s alleles (%s:%s %s>%s) mismatch the clinvar allele (%s:%s %s>%s)\n" % (spec.name, chrom, pos, spec.variant_url, chrom, pos, vcf_ref_allele, vcf_alt_allele, spec.name, chrom, pos, vcf_ref_allele, ",".join(vcf_alt for vcf_ref, vcf_alt in vcf_alleles), chrom, pos, ref, alt))
+
+    def get_read_counts(self):
+        """Return the counts of what was read to look up the variants, as a dict"""
+        return {'rows_read': self.sites_vcf.rows_read, 'seeks': self.sites_vcf.seeks,
+                'skipped_lookups': self.skipped_lookups}
+
+    def add_counts(self, counts, read_counts):
+        """Add the counts and get_read_counts of another source of the same dataset, e.g. of a region of the clinvar
+        table looked up in another process"""
+        for k, v in counts.items():
+            self.counts[k] += v
+        self.sites_vcf.rows_read += read_counts['rows_read']
+        self.sites_vcf.seeks += read_counts['seeks']
+        self.skipped_lookups += read_counts['skipped_lookups']
+
+    def write_counts(self, outfile):
+        for k, v in self.counts.items():
+            outfile.write("%30s: %s\n" % (k, v))
+        outfile.write("Read %d %s rows with %d seeks\n" % (self.sites_vcf.rows_read, self.spec.name, self.sites_vcf.seeks))
+        position_filter = self.position_filter
+        if position_filter is not None:
+            # the variants at a position that isn't in the vcf, but that passed the filter
+            false_positives = self.counts['clinvar_variants_with_no_matching_position_in_' + self.spec.counts_suffix] - self.skipped_lookups
+            outfile.write("Skipped %d of %d lookups with the position filter of %d positions (%.1f MB, %d hashes, "
+                          "expected false positive rate %.4f, observed %.4f)\n" % (
+                              self.skipped_lookups, self.counts['total_clinvar_variants'], position_filter.key_count,
+                              position_filter.bits.nbytes / 2.0**20, position_filter.hash_count,
+                              position_filter.get_false_positive_rate(),
+                              float(false_positives) / max(1, false_positives + self.skipped_lookups)))
+
+
+class StorePopulationSource(PopulationSource):
+    """Looks up clinvar variants in the population store of a dataset, with the same values and counts as in its VCF.
+
+    Args:
+      label: key of the dataset in SOURCE_SPECS (eg. 'exac_v1')
+      store: population_store.PopulationStore of the dataset's vcf
+    """
+
+    def __init__(self, label, store):
+        PopulationSource.__init__(self, label, None)
+        self.store = store
+        missing_fields = self.fields_set - set(store.fields)
+        if missing_fields:
+            raise ValueError("The %s store doesn't have the fields: %s" % (label, ", ".join(sorted(missing_fields))))
+        self.store_fields = [field for i, field in enumerate(self.spec.fields) if field not in self.spec.fields[:i]]
+        self.field_indices = [self.store_fields.index(field) for field in self.spec.fields]
+        self.lookups = 0
+
+    def get_column_values_of_alleles(self, alleles):
+        store = self.store
+        keys = np.array([pack_allele_key(chrom, pos, ref, alt) for chrom, pos, ref, alt in alleles], dtype=np.int64)
+        rows = store.lookup(keys)
+        found_rows = rows[rows >= 0]
+        self.lookups += len(alleles)
+
+        # the values of the found rows, by field
+        found_refs = iter(store.ref.get(found_rows))
+        found_alts = iter(store.alt.get(found_rows))
+        found_values = iter(zip(*[store.get_column(field, found_rows) for field in self.store_fields]))
+
+        spec = self.spec
+        counts = self.counts
+        column_values = []
+        for (chrom, pos, ref, alt), row in zip(alleles, rows.tolist()):
+            if row >= 0:
+                vcf_ref_allele, vcf_alt_allele, values = next(found_refs), next(found_alts), next(found_values)
+            if chrom == 'MT':
+                column_values.append(self.empty_column_values)
+                continue
+            counts['total_clinvar_variants'] += 1
+
+            # hashed keys of different alleles could be the same
+            if row >= 0 and ref == vcf_ref_allele and alt == vcf_alt_allele:
+                counts['clinvar_variants_with_matching_position_and_matching_allele'] += 1
+                values = [values[i] for i in self.field_indices]
+                if None in values and spec.require_all_fields:
+                    raise ValueError("ERROR: unable to parse INFO fields of %s:%s %s>%s. Missing: %s" % (
+                        chrom, pos, ref, alt, [field for field, value in zip(spec.fields, values) if value is None]))
+                column_values.append([value if value is not None else '' for value in values])
+            else:
+                self.count_mismatch(chrom, pos, ref, alt, store.get_alleles_at(chrom, pos))
+                column_values.append(self.empty_column_values)
+        return column_values
+
+    def get_read_counts(self):
+        return {'lookups': self.lookups}
+
+    def add_counts(self, counts, read_counts):
+        for k, v in counts.items():
+            self.counts[k] += v
+        self.lookups += read_counts['lookups']
+
+    def write_counts(self, outfile):
+        for k, v in self.counts.items():
+            outfile.write("%30s: %s\n" % (k, v))
+        outfile.write("Looked up %d variants in the %s store of %d rows\n" % (self.lookups, self.label, len(self.store)))
+
+
+def open_output(path):
+    return BgzfWriter(open(path, 'wb')) if path.endswith('.gz') else open(path, 'w')
+
+
+def open_sources(source_vcfs, store=False, tabix_fetch=False, max_scan_distance=MAX_SCAN_DISTANCE,
+                 position_filter=False, false_positive_rate=FALSE_POSITIVE_RATE):
+    """Return a PopulationSource for each (label, sites VCF path) in source_vcfs.
+
+    Args:
+      store: Look up the variants in the population store of each VCF, building it if it's missing or out of date
+      tabix_fetch: Look up each variant with a tabix fetch instead of reading through the VCFs
+      max_scan_distance: see SortedSitesVcfReader
+      position_filter: Skip the variants whose position isn't in the position filter of the VCF, building it if it's
+        missing or out of date. Not used with store.
+      false_positive_rate: of the position filters
+    """
+
+    import pysam
+
+    sources = []
+    for label, path in source_vcfs:
+        if store:
+            sources.append(StorePopulationSource(label, open_population_store(path, SOURCE_SPECS[label].fields)))
+            continue
+        tabix_file = pysam.TabixFile(path)
+        sites_vcf = TabixSitesVcfReader(tabix_file) if tabix_fetch else SortedSitesVcfReader(tabix_file, max_scan_distance)
+        sources.append(PopulationSource(label, sites_vcf, open_position_filter(path, false_positive_rate)[0]
+                                        if position_filter else None))
+    return sources
+
+
+def write_headers(column_names, sources, source_outputs, combined_output=None):
+    """Write the header line of each output: the clinvar columns followed by the fields of its dataset(s)"""
+
+    for source, output in zip(sources, source_outputs):
+        if output is not None:
+            TableWriter(output, column_names + source.spec.fields)
+    if combined_output is not None:
+        TableWriter(combined_output, column_names + [
+            '%s_%s' % (source.label, field) for source in sources for field in source.spec.fields])
+
+
+def add_population_fields(clinvar_f, sources, source_outputs, combined_output=None):
+    """Read the clinvar table once, and write the fields of each dataset to its output and/or the combined output.
+
+    Args:
+      clinvar_f: Input file stream of the clinvar table, sorted by chrom and pos for the sorted sites_vcf reader
+      sources: List of PopulationSource
+      source_outputs: List of the output file stream of each source, or None for the sources without one
+      combined_output: Output file stream of the combined table, or None
+
+    Return:
+      The number of clinvar variants
+    """
+
+    clinvar_reader = TableReader(clinvar_f)
+    write_headers(clinvar_reader.column_names, sources, source_outputs, combined_output)
+    return annotate_clinvar_records(clinvar_reader, sources, source_outputs, combined_output)
+
+
+def annotate_clinvar_records(clinvar_records, sources, source_outputs, combined_output=None):
+    """Like add_population_fields, but for the records of a clinvar table, and without the header lines"""
+
+    count = 0
+    clinvar_records = iter(clinvar_records)
+    while True:
+        chunk = list(itertools.islice(clinvar_records, CLINVAR_CHUNK_SIZE))
+        if not chunk:
+            break
+        count += len(chunk)
+        alleles = [(record.chrom, int(record.pos), record.ref, record.alt) for record in chunk]
+        source_column_values = [source.get_column_values_of_alleles(alleles) for source in sources]
+        for i, clinvar_record in enumerate(chunk):
+            combined_fields = list(clinvar_record.fields)
+            for column_values, output in zip(source_column_values, source_outputs):
+                if output is not None:
+                    output.write('\t'.join(clinvar_record.fields + column_values[i]) + '\n')
+                combined_fields += column_values[i]
+            if combined_output is not None:
+                combined_output.write('\t'.join(combined_fields) + '\n')
+    return count
+
+
+def _annotate_region(args):
+    """Worker for add_population_fields_in_parallel: add the fields of the datasets to the clinvar variants of a
+    region of the tabix-indexed clinvar table, and write the rows of each output to a BGZF part.
+
+    Return:
+        (number of clinvar variants, [(counts, read counts) of each source])
+    """
+
+    import pysam
+
+    clinvar_table, (chrom, start, end), header, source_vcfs, source_options, part_paths = args
+    sources = open_sources(source_vcfs, **source_options)
+    parts = [BgzfWriter(open(part_path, 'wb')) if part_path else None for part_path in part_paths]
+    table = pysam.TabixFile(clinvar_table)
+    clinvar_reader = TableReader(itertools.chain([header], (line + '\n' for line in table.fetch(chrom, start, end))))
+    count = annotate_clinvar_records(clinvar_reader, sources, parts[:len(sources)], parts[len(sources)])
+    table.close()
+    for part in parts:
+        if part is not None:
+            part.close()
+    return count, [(dict(source.counts), source.get_read_counts()) for source in sources]
+
+
+def add_population_fields_in_parallel(clinvar_table, source_vcfs, source_outputs, combined_output, workers,
+                                      tmp_dir=None, **source_options):
+    """Like add_population_fields, but regions of a bgzipped, tabix-indexed clinvar table, of about the same size,
+    are looked up in parallel (see tabix_regions.py), and the BGZF parts of each output are concatenated in the order
+    of the table.
+
+    Args:
+      clinvar_table: Path of the clinvar table, indexed with tabix -S 1 -s 1 -b 2 -e 2
+      source_vcfs: List of the (label, sites VCF path) of each dataset
+      source_outputs: List of the BgzfWriter of each dataset, or None for the datasets without one
+      combined_output: BgzfWriter of the combined table, or None
+      workers: Number of processes
+      tmp_dir: Directory for the parts. Default: the system's temp dir
+      source_options: Options of open_sources
+
+    Return:
+      (number of clinvar variants, list of the PopulationSource of each dataset, with the counts of all the regions)
+    """
+
+    with gzip.open(clinvar_table) as clinvar_f:
+        header = next(clinvar_f)
+    # the stores are built, if needed, before the workers open them
+    sources = open_sources(source_vcfs, **source_options)
+    write_headers(header.rstrip('\n').split('\t'), sources, source_outputs, combined_output)
+
+    outputs = list(source_outputs) + [combined_output]
+    regions = get_balanced_regions(clinvar_table + '.tbi', workers * REGIONS_PER_WORKER)
+    tmp_dir = tempfile.mkdtemp(prefix='add_population_fields_', dir=tmp_dir)
+    pool = multiprocessing.Pool(workers)
+    try:
+        tasks = [(clinvar_table, region, header, source_vcfs, source_options,
+                  [os.path.join(tmp_dir, 'part_%d_%d.bgz' % (i, j)) if output is not None else None
+                   for j, output in enumerate(outputs)]) for i, region in enumerate(regions)]
+        count = 0
+        for task, (region_count, region_counts) in zip(tasks, pool.imap(_annotate_region, tasks)):
+            for output, part_path in zip(outputs, task[-1]):
+                if output is not None:
+                    output.append_file(part_path)
+                    os.remove(part_path)
+            count += region_count
+            for source, (counts, read_counts) in zip(sources, region_counts):
+                source.add_counts(counts, read_counts)
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(tmp_dir)
+    return count, sources
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Add the fields of population datasets to a clinvar table, reading it once.')
+    p.add_argument("-i", "--clinvar-table", help="Clinvar .tsv", required=True)
+    p.add_argument("-e", "--exac-sites-vcf", help="ExAC sites VCF")
+    p.add_argument("-ge", "--gnomad-exomes-vcf", help="gnomAD exomes sites VCF")
+    p.add_argument("-gg", "--gnomad-genomes-vcf", help="gnomAD genomes sites VCF")
+    p.add_argument("-o", "--output", help="Output path of the table of each dataset, with %%(label)s for its label (%s). "
+                   "Written as BGZF if it ends with .gz" % ", ".join(SOURCE_SPECS))
+    p.add_argument("-c", "--combined-output", help="Output path of the table with the fields of all the datasets")
+    p.add_argument("--tabix", action="store_true", help="Index the .gz outputs with tabix")
+    p.add_argument("--tabix-fetch", action="store_true", help="Look up each clinvar variant with a tabix fetch instead of reading through the VCFs. Faster when the clinvar table is small or isn't sorted.")
+    p.add_argument("--max-scan-distance", type=int, default=MAX_SCAN_DISTANCE, help="When the next clinvar variant is more than this many bp past the last row read from a VCF, seek to it instead of reading through the rows in between. Default: %(default)s")
+    p.add_argument("--store", action="store_true", help="Look up the variants in the population store of each VCF (see population_store.py), instead of reading through the VCFs. The store is built next to the VCF if it doesn't exist or is out of date.")
+    p.add_argument("--position-filter", action="store_true", help="Skip the variants whose position is definitely not in a VCF, with a Bloom filter of its positions (see position_filter.py), instead of looking them up. Most useful with --tabix-fetch. The filter is built next to the VCF if it doesn't exist or is out of date.")
+    p.add_argument("--false-positive-rate", type=float, default=FALSE_POSITIVE_RATE, help="With --position-filter: the false positive rate of the filters. Default: %(default)s")
+    p.add_argument("-w", "--workers", type=int, default=1, help="Number of processes to look up regions of the clinvar table with in parallel. The clinvar table must be bgzipped and tabix-indexed, and the outputs are written as BGZF.")
+    p.add_argument("-T", "--tmp-dir", help="With --workers: directory for the parts. Default: the system's temp dir")
+    args = p.parse_args()
+
+    import pysam
+
+    vcf_paths = {'exac_v1': args.exac_sites_vcf, 'gnomad_exomes': args.gnomad_exomes_vcf, 'gnomad_genomes': args.gnomad_genomes_vcf}
+    labels = [label for label in SOURCE_SPECS if vcf_paths[label]]
+    if not labels:
+        p.error("At least one of -e, -ge or -gg is required")
+    if not args.output and not args.combined_output:
+        p.error("At least one of -o or -c is required")
+    if args.store and args.position_filter:
+        p.error("--position-filter can't be used with --store, whose lookups don't read the VCFs")
+
+    source_vcfs = [(label, vcf_paths[label]) for label in labels]
+    source_options = {'store': args.store, 'tabix_fetch': args.tabix_fetch, 'max_scan_distance': args.max_scan_distance,
+                      'position_filter': args.position_filter, 'false_positive_rate': args.false_positive_rate}
+    output_paths = [args.output % {'label': label} if args.output else None for label in labels]
+    output_paths.append(args.combined_output)
+
+    if args.workers > 1:
+        if not os.path.isfile(args.clinvar_table + '.tbi'):
+            p.error("--workers requires a tabix index of the clinvar table: %s.tbi" % args.clinvar_table)
+        if not all(path.endswith('.gz') for path in output_paths if path):
+            p.error("--workers requires .gz outputs")
+        outputs = [open_output(path) if path else None for path in output_paths]
+        count, sources = add_population_fields_in_parallel(args.clinvar_table, source_vcfs, outputs[:-1], outputs[-1],
+                                                           args.workers, tmp_dir=args.tmp_dir, **source_options)
+    else:
+        sources = open_sources(source_vcfs, **source_options)
+        outputs = [open_output(path) if path else None for path in output_paths]
+        clinvar_f = gzip.open(args.clinvar_table) if args.clinvar_table.endswith('.gz') else open(args.clinvar_table)
+        count = add_population_fields(clinvar_f, sources, outputs[:-1], outputs[-1])
+    for output in outputs:
+        if output is not None:
+            output.close()
+
+    sys.stderr.write("Added the fields of %s to %d clinvar variants\n" % (", ".join(labels), count))
+    for source in sources:
+        sys.stderr.write("%s:\n" % source.label)
+        source.write_counts(sys.stderr)
+
+    if args.tabix:
+        for path in output_paths:
+            if path and path.endswith('.gz'):
+                pysam.tabix_index(path, seq_col=0, start_col=1, end_col=1, line_skip=1, force=True)
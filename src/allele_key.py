@@ -0,0 +1,91 @@
+"""Pack the chrom, pos, ref and alt of an allele into one integer key that fits in a signed 64-bit int, so that
+alleles can be compared, hashed, sorted and stored (e.g. in arrays) as plain integers instead of tuples of strings.
+
+Alleles on the chromosomes of sort_table.CHROMOSOME_ORDER, at positions below 2**28, with at most 7 ref and 7 alt
+bases and 12 bases in total, all of them A, C, G or T, have a packed key >= 0:
+
+    bits 58-62  chromosome, in natural order (1..22, X, Y, MT)
+    bits 30-57  pos
+    bits 27-29  length of ref
+    bits 24-26  length of alt
+    bits 0-23   ref + alt, 2 bits per base, left-aligned
+
+so that two alleles have the same packed key if and only if they are the same, and packed keys sort by chromosome,
+then pos. That covers SNVs and most short indels. Any other allele gets a hashed key < 0, from the md5 of its chrom,
+pos, ref and alt, which is the same in every process and on every platform. Two different alleles have a 2**-63
+chance of having the same hashed key.
+"""
+
+import hashlib
+import string
+
+from sort_table import CHROMOSOME_ORDER
+
+CHROMOSOME_CODES = {chrom: i for i, chrom in enumerate(CHROMOSOME_ORDER)}
+BASE_DIGITS = string.maketrans('ACGT', '0123')  # the bases as base-4 digits
+
+POS_BITS = 28
+ALLELE_LENGTH_BITS = 3
+MAX_ALLELE_LENGTH = 2**ALLELE_LENGTH_BITS - 1
+MAX_PACKED_BASES = 12
+
+CHROM_SHIFT = POS_BITS + 2 * ALLELE_LENGTH_BITS + 2 * MAX_PACKED_BASES
+POS_SHIFT = 2 * ALLELE_LENGTH_BITS + 2 * MAX_PACKED_BASES
+REF_LENGTH_SHIFT = ALLELE_LENGTH_BITS + 2 * MAX_PACKED_BASES
+ALT_LENGTH_SHIFT = 2 * MAX_PACKED_BASES
+
+assert CHROM_SHIFT + 5 == 63 and len(CHROMOSOME_ORDER) <= 2**5
+
+
+def pack_allele_key(chrom, pos, ref, alt):
+    """Return the key of an allele (see module docstring).
+
+    Args:
+        chrom, pos, ref, alt: The allele. pos may be an int or a string.
+    """
+
+    chrom_code = CHROMOSOME_CODES.get(chrom)
+    pos = int(pos)
+    bases = ref + alt
+    if (chrom_code is not None and 0 <= pos < 2**POS_BITS and len(ref) <= MAX_ALLELE_LENGTH and
+            len(alt) <= MAX_ALLELE_LENGTH and len(bases) <= MAX_PACKED_BASES):
+        digits = bases.translate(BASE_DIGITS)
+        if not digits.strip('0123'):
+            return (chrom_code << CHROM_SHIFT | pos << POS_SHIFT | len(ref) << REF_LENGTH_SHIFT |
+                    len(alt) << ALT_LENGTH_SHIFT | int(digits + '0' * (MAX_PACKED_BASES - len(bases)), 4))
+
+    return hash_allele_key(chrom, pos, ref, alt)
+
+
+def hash_allele_key(chrom, pos, ref, alt):
+    """Return the hashed key of an allele, which is < 0"""
+
+    digest = hashlib.md5('%s:%s:%s:%s' % (chrom, pos, ref, alt)).hexdigest()
+    return -1 - (int(digest[:16], 16) >> 1)
+
+
+def is_packed_allele_key(key):
+    return key >= 0
+
+
+def unpack_allele_key(key):
+    """Return the (chrom, pos, ref, alt) of a packed key, with an int pos, or None if the key is hashed"""
+
+    if key < 0:
+        return None
+    chrom = CHROMOSOME_ORDER[key >> CHROM_SHIFT]
+    pos = key >> POS_SHIFT & (2**POS_BITS - 1)
+    ref_length = key >> REF_LENGTH_SHIFT & MAX_ALLELE_LENGTH
+    alt_length = key >> ALT_LENGTH_SHIFT & MAX_ALLELE_LENGTH
+    bases_bits = key & (2**(2 * MAX_PACKED_BASES) - 1)
+    bases = ''.join('ACGT'[bases_bits >> 2 * (MAX_PACKED_BASES - 1 - i) & 3] for i in range(ref_length + alt_length))
+    return chrom, pos, bases[:ref_length], bases[ref_length:]
+
+
+def format_allele_key(key):
+    """Return chrom-pos-ref-alt for a packed key, or the hex digits of a hashed key"""
+
+    allele = unpack_allele_key(key)
+    if allele is None:
+        return 'hashed:%016x' % (-1 - key)
+    return '%s-%d-%s-%s' % allele
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+"""Benchmarks for the pipeline stages. Each subcommand times the alternative implementations of a stage on the
+same input and prints their throughput, eg.
+
+    python benchmark.py parse -x ClinVarFullRelease_00-latest.xml.gz
+"""
+
+import sys
+import time
+import argparse
+import itertools
+import subprocess
+import tempfile
+from collections import defaultdict
+from StringIO import StringIO
+
+import parse_clinvar_xml
+import normalize_variants
+import group_by_allele
+import table_record
+
+
+def print_result(name, count, unit, seconds):
+    """Print one line of benchmark results to stderr (the stages print their own messages to stdout)"""
+    rate = count / seconds if seconds > 0 else float('inf')
+    sys.stderr.write("%-30s %10d %s in %8.2f sec - %10.1f %s/sec\n" % (name, count, unit, seconds, rate, unit))
+
+
+def benchmark_parse(args):
+    """Time parse_clinvar_set with each engine and each way of collecting the nodes of a ClinVarSet
+    (see parse_clinvar_xml.ENGINES and walk_clinvar_set_nodes)"""
+
+    runs = [
+        ('etree, findall', 'etree', parse_clinvar_xml.find_clinvar_set_nodes),
+        ('etree, single walk', 'etree', parse_clinvar_xml.walk_clinvar_set_nodes),
+    ]
+    if 'lxml' in parse_clinvar_xml.ENGINES:
+        runs.append(('lxml, xpath', 'lxml', parse_clinvar_xml.xpath_clinvar_set_nodes))
+
+    for name, engine, collect_nodes in runs:
+        for i in range(args.repeat):
+            skipped_counter = defaultdict(int)
+            count = 0
+            start = time.time()
+            handle = parse_clinvar_xml.get_handle(args.xml_path)
+            for elem in parse_clinvar_xml.iter_clinvar_sets(handle, engine=engine):
+                parse_clinvar_xml.parse_clinvar_set(elem, parse_clinvar_xml.GENOME_BUILDS, skipped_counter,
+                                                    collect_nodes=collect_nodes)
+                count += 1
+                if args.limit and count >= args.limit:
+                    break
+            handle.close()
+            print_result(name, count, 'records', time.time() - start)
+
+
+class NullOutput(object):
+    def write(self, data):
+        pass
+
+    def writelines(self, lines):
+        for line in lines:
+            pass
+
+
+def benchmark_normalize(args):
+    """Time normalize_variants.normalize_table with and without caching windows of the reference, and optionally an
+    external normalization command (eg. the normalize.py that master.py used to download) on the same table. The
+    output of the external command is then compared with the output of normalize_variants (see
+    compare_normalized_tables)."""
+
+    with open(args.table) as table:
+        lines = list(itertools.islice(table, args.limit + 1 if args.limit else None))
+    count = len(lines) - 1
+
+    runs = [('mmap, window cache', normalize_variants.REFERENCE_MAX_WINDOWS), ('mmap, no cache', 0)]
+    for name, max_windows in runs:
+        for i in range(args.repeat):
+            start = time.time()
+            reference = normalize_variants.ReferenceGenome(args.reference, max_windows=max_windows)
+            skipped_counter = defaultdict(int)
+            normalize_variants.normalize_table(iter(lines), NullOutput(), reference, skipped_counter)
+            reference.close()
+            print_result(name, count, 'rows', time.time() - start)
+
+    if args.command:
+        command_output = tempfile.TemporaryFile()
+        command_errors = tempfile.TemporaryFile()
+        for i in range(args.repeat):
+            start = time.time()
+            command_output.seek(0)
+            command_output.truncate()
+            command_errors.seek(0)
+            command_errors.truncate()
+            process = subprocess.Popen(args.command, shell=True, stdin=subprocess.PIPE, stdout=command_output,
+                                       stderr=command_errors)
+            process.communicate(''.join(lines))
+            if process.returncode:
+                command_errors.seek(0)
+                sys.stderr.write(command_errors.read())
+                raise subprocess.CalledProcessError(process.returncode, args.command)
+            print_result(args.command[:30], count, 'rows', time.time() - start)
+
+        output = StringIO()
+        reference = normalize_variants.ReferenceGenome(args.reference)
+        skipped_counter = defaultdict(int)
+        normalize_variants.normalize_table(iter(lines), output, reference, skipped_counter)
+        reference.close()
+        command_output.seek(0)
+        command_errors.seek(0)
+        sys.stderr.write("normalize_variants dropped: %s\n" % (
+            ', '.join('%d %s' % (v, k) for k, v in sorted(skipped_counter.items())) or 'none'))
+        sys.stderr.write("%s printed:\n%s" % (args.command[:30], command_errors.read()))
+        compare_normalized_tables(output.getvalue().splitlines(True), list(command_output))
+
+
+def compare_normalized_tables(lines, other_lines, max_examples=10):
+    """Print to stderr how two normalized versions of a table differ: the rows that only one of them has, by chrom,
+    pos, ref and alt, and the rows whose other columns differ.
+
+    Return:
+        The number of rows that aren't in both tables
+    """
+
+    def get_rows(lines):
+        rows = defaultdict(list)
+        for line in lines[1:]:
+            if line.strip():
+                fields = line.rstrip('\n').split('\t')
+                rows[tuple(fields[:4])].append(fields[4:])
+        return rows
+
+    if lines[:1] != other_lines[:1]:
+        sys.stderr.write("The headers differ:\n  %s  %s" % (''.join(lines[:1]), ''.join(other_lines[:1])))
+    rows = get_rows(lines)
+    other_rows = get_rows(other_lines)
+    only_in_rows = sorted(set(rows) - set(other_rows))
+    only_in_other_rows = sorted(set(other_rows) - set(rows))
+    different_rows = sorted(key for key in set(rows) & set(other_rows) if sorted(rows[key]) != sorted(other_rows[key]))
+    sys.stderr.write("%d rows, %d rows from the command. Variants only in normalize_variants: %d, only in the "
+                     "command: %d, with different rows: %d\n" % (
+                         sum(map(len, rows.values())), sum(map(len, other_rows.values())), len(only_in_rows),
+                         len(only_in_other_rows), len(different_rows)))
+    for name, keys in (('only in normalize_variants', only_in_rows), ('only in the command', only_in_other_rows),
+                       ('with different rows', different_rows)):
+        for key in keys[:max_examples]:
+            sys.stderr.write("  %s: %s\n" % (name, ' '.join(key)))
+    return len(only_in_rows) + len(only_in_other_rows) + len(different_rows)
+
+
+def benchmark_group(args):
+    """Time group_by_allele and group_unsorted_by_allele (in memory) on a sorted allele-trait table, eg.
+    clinvar_allele_trait_pairs.single.b37.tsv.gz"""
+
+    handle = parse_clinvar_xml.get_handle(args.table)
+    lines = list(itertools.islice(handle, args.limit + 1 if args.limit else None))
+    handle.close()
+
+    runs = [
+        ('group_by_allele', group_by_allele.group_by_allele),
+        ('group_unsorted_by_allele', group_by_allele.group_unsorted_by_allele),
+    ]
+    for name, group in runs:
+        for i in range(args.repeat):
+            start = time.time()
+            group(iter(lines), NullOutput())
+            print_result(name, len(lines) - 1, 'rows', time.time() - start)
+
+
+def read_rows_as_dicts(lines):
+    """The way the stages used to read a table: a dict(zip(header, fields)) per row"""
+
+    header = lines[0].rstrip('\n').split('\t')
+    for line in lines[1:]:
+        yield dict(zip(header, line.rstrip('\n').split('\t')))
+
+
+def benchmark_records(args):
+    """Time reading a table and accessing the chrom, pos, ref and alt of each row with a dict per row, and with
+    table_record.TableReader, and print the size of the object that each makes per row, on top of its fields"""
+
+    handle = parse_clinvar_xml.get_handle(args.table)
+    lines = list(itertools.islice(handle, args.limit + 1 if args.limit else None))
+    handle.close()
+    count = len(lines) - 1
+
+    runs = [
+        ('dict per row', read_rows_as_dicts),
+        ('TableReader records', lambda lines: iter(table_record.TableReader(iter(lines)))),
+    ]
+    for name, read_rows in runs:
+        row_size = sys.getsizeof(next(read_rows(lines))) if count else 0
+        for i in range(args.repeat):
+            start = time.time()
+            for row in read_rows(lines):
+                row['chrom'], row['pos'], row['ref'], row['alt']
+            print_result(name, count, 'rows', time.time() - start)
+        sys.stderr.write("%-30s %10d bytes per row\n" % (name, row_size))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark pipeline stages.')
+    subparsers = parser.add_subparsers(dest='stage')
+
+    parse_parser = subparsers.add_parser('parse', help='parse_clinvar_xml.py: records/sec of parsing ClinVarSets')
+    parse_parser.add_argument('-x', '--xml-path', required=True, help='ClinVar XML (may be gzipped)')
+    parse_parser.add_argument('-n', '--limit', type=int, help='only parse the first LIMIT ClinVarSets')
+    parse_parser.add_argument('-r', '--repeat', type=int, default=1, help='repeat each run REPEAT times')
+    parse_parser.set_defaults(run=benchmark_parse)
+
+    normalize_parser = subparsers.add_parser('normalize', help='normalize_variants.py: rows/sec of normalizing a '
+                                                               'table, eg. clinvar_table_raw.single.b37.tsv')
+    normalize_parser.add_argument('-t', '--table', required=True, help='Uncompressed table from parse_clinvar_xml.py')
+    normalize_parser.add_argument('-R', '--reference', required=True, help='Reference genome FASTA')
+    normalize_parser.add_argument('-n', '--limit', type=int, help='only normalize the first LIMIT rows')
+    normalize_parser.add_argument('-r', '--repeat', type=int, default=1, help='repeat each run REPEAT times')
+    normalize_parser.add_argument('-c', '--command',
+                                  help='Also time this shell command, which reads the whole table from stdin and writes '
+                                       'the normalized table to stdout, eg. "python normalize.py -R '
+                                       'human_g1k_v37.fasta", and compare its output with normalize_variants')
+    normalize_parser.set_defaults(run=benchmark_normalize)
+
+    group_parser = subparsers.add_parser('group', help='group_by_allele.py: rows/sec of grouping an allele-trait '
+                                                       'table, eg. clinvar_allele_trait_pairs.single.b37.tsv.gz')
+    group_parser.add_argument('-t', '--table', required=True, help='Sorted allele-trait table (may be gzipped)')
+    group_parser.add_argument('-n', '--limit', type=int, help='only group the first LIMIT rows')
+    group_parser.add_argument('-r', '--repeat', type=int, default=1, help='repeat each run REPEAT times')
+    group_parser.set_defaults(run=benchmark_group)
+
+    records_parser = subparsers.add_parser('records', help='table_record.py: rows/sec and bytes per row of reading '
+                                                           'a table, eg. clinvar_alleles.single.b37.tsv.gz')
+    records_parser.add_argument('-t', '--table', required=True, help='Tab-delimited table (may be gzipped)')
+    records_parser.add_argument('-n', '--limit', type=int, help='only read the first LIMIT rows')
+    records_parser.add_argument('-r', '--repeat', type=int, default=1, help='repeat each run REPEAT times')
+    records_parser.set_defaults(run=benchmark_records)
+
+    args = parser.parse_args()
+    args.run(args)
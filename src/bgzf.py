@@ -0,0 +1,197 @@
+"""Reading and writing BGZF files.
+
+BGZF is the blocked gzip format of bgzip, tabix and samtools (see section 4.1 of the SAM spec): a series of gzip
+members that each hold at most 64 KB of data, so it can be decompressed starting at any block. It is a valid gzip
+file, so gunzip, zcat and gzip.open read it like any other.
+
+A position in a BGZF file is a virtual offset: the offset of the block in the compressed file in the upper 48 bits,
+and the offset within the uncompressed block in the lower 16 bits.
+"""
+
+import struct
+import zlib
+
+BGZF_BLOCK_SIZE = 0xff00  # max number of uncompressed bytes per block, as in bgzip
+
+BGZF_HEADER = struct.Struct('<BBBBIBBHBBHH')  # gzip header with the BC extra subfield that holds the block size
+
+# empty block that marks the end of a BGZF file
+BGZF_EOF = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+
+
+def make_virtual_offset(block_offset, within_block_offset):
+    return (block_offset << 16) | within_block_offset
+
+
+def split_virtual_offset(virtual_offset):
+    """Return the (block offset, offset within the block) of a virtual offset"""
+    return virtual_offset >> 16, virtual_offset & 0xffff
+
+
+def compress_block(data, level=6):
+    """Return the BGZF block that holds data (at most BGZF_BLOCK_SIZE bytes)"""
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    header = BGZF_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(compressed) + 25)
+    return header + compressed + struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+
+
+class BgzfWriter(object):
+    """Write a BGZF file to an open binary file handle (which can be a pipe, eg. stdout)"""
+
+    def __init__(self, handle, level=6):
+        self.handle = handle
+        self.level = level
+        self.block_offset = 0  # offset in the compressed file of the block that is being filled
+        self.buffer = []
+        self.buffered = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= BGZF_BLOCK_SIZE:
+            data = b''.join(self.buffer)
+            i = 0
+            while len(data) - i >= BGZF_BLOCK_SIZE:
+                self._write_block(data[i:i + BGZF_BLOCK_SIZE])
+                i += BGZF_BLOCK_SIZE
+            self.buffer = [data[i:]]
+            self.buffered = len(data) - i
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def tell(self):
+        """Return the virtual offset of the next byte that will be written"""
+        return make_virtual_offset(self.block_offset, self.buffered)
+
+    def flush(self):
+        """Write the buffered data as a block, so the next write starts a new block"""
+        if self.buffered:
+            self._write_block(b''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+        self.handle.flush()
+
+    def close(self):
+        self.flush()
+        self.handle.write(BGZF_EOF)
+        self.handle.close()
+
+    def append_file(self, path, chunk_size=2**20):
+        """Append the blocks of the BGZF file at path (eg. a part written by another process), without
+        recompressing them. The file's EOF block is dropped."""
+
+        self.flush()
+        with open(path, 'rb') as part:
+            part.seek(0, 2)
+            size = part.tell()
+            part.seek(max(size - len(BGZF_EOF), 0))
+            if part.read() == BGZF_EOF:
+                size -= len(BGZF_EOF)
+            part.seek(0)
+            remaining = size
+            while remaining > 0:
+                data = part.read(min(chunk_size, remaining))
+                if not data:
+                    break
+                self.handle.write(data)
+                remaining -= len(data)
+        self.block_offset += size - remaining
+
+    def _write_block(self, data):
+        block = compress_block(data, self.level)
+        self.handle.write(block)
+        self.block_offset += len(block)
+
+
+class BgzfReader(object):
+    """Read a BGZF file from any virtual offset"""
+
+    def __init__(self, path):
+        self.handle = open(path, 'rb')
+        self.block_offset = 0
+        self.next_block_offset = 0
+        self.data = b''
+        self.pos = 0  # offset in self.data
+        self._load_block(0)
+
+    def seek(self, virtual_offset):
+        block_offset, within_block_offset = split_virtual_offset(virtual_offset)
+        if block_offset != self.block_offset:
+            self._load_block(block_offset)
+        if within_block_offset > len(self.data):
+            raise ValueError("Invalid virtual offset %s: block %s only has %s bytes" % (
+                virtual_offset, block_offset, len(self.data)))
+        self.pos = within_block_offset
+
+    def tell(self):
+        """Return the virtual offset of the next byte that will be read"""
+        if self.pos == len(self.data) and self.data:
+            return make_virtual_offset(self.next_block_offset, 0)
+        return make_virtual_offset(self.block_offset, self.pos)
+
+    def read(self, size=-1):
+        chunks = []
+        while size != 0:
+            if self.pos == len(self.data):
+                if not self._load_block(self.next_block_offset):
+                    break
+                continue
+            end = len(self.data) if size < 0 else min(len(self.data), self.pos + size)
+            chunks.append(self.data[self.pos:end])
+            if size > 0:
+                size -= end - self.pos
+            self.pos = end
+        return b''.join(chunks)
+
+    def readline(self):
+        chunks = []
+        while True:
+            if self.pos == len(self.data):
+                if not self._load_block(self.next_block_offset):
+                    break
+                continue
+            i = self.data.find(b'\n', self.pos)
+            end = len(self.data) if i < 0 else i + 1
+            chunks.append(self.data[self.pos:end])
+            self.pos = end
+            if i >= 0:
+                break
+        return b''.join(chunks)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+    def close(self):
+        self.handle.close()
+
+    def _load_block(self, block_offset):
+        """Decompress the block at block_offset. Return False at the end of the file."""
+
+        self.handle.seek(block_offset)
+        header = self.handle.read(BGZF_HEADER.size)
+        if not header:
+            self.block_offset = self.next_block_offset = block_offset
+            self.data = b''
+            self.pos = 0
+            return False
+
+        if len(header) < BGZF_HEADER.size:
+            raise IOError("Truncated BGZF block at offset %s" % block_offset)
+        id1, id2, cm, flags, mtime, xfl, os, xlen, si1, si2, slen, bsize = BGZF_HEADER.unpack(header)
+        if (id1, id2, flags & 4, xlen, si1, si2, slen) != (31, 139, 4, 6, 66, 67, 2):
+            raise IOError("Not a BGZF block at offset %s" % block_offset)
+
+        compressed = self.handle.read(bsize + 1 - BGZF_HEADER.size)
+        self.block_offset = block_offset
+        self.next_block_offset = block_offset + bsize + 1
+        self.data = zlib.decompress(compressed[:-8], -15)
+        self.pos = 0
+        return True
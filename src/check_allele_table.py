@@ -8,6 +8,8 @@ import os
 
 from pprint import pprint
 
+from table_record import TableReader
+
 p = argparse.ArgumentParser(description="Basic consistency checks on the final clinvar table")
 p.add_argument("alleles_table_path")
 args = p.parse_args()
@@ -19,16 +21,12 @@ if not os.path.isfile(alleles_table_path):
 CHROMS = list(map(str, range(1, 23))) + ['X', 'Y', 'MT']
 
 f = gzip.open(alleles_table_path) if alleles_table_path.endswith('gz') else open(alleles_table_path)
-header = next(f).strip('\n').split('\t')
-#print(header)
-#print(next(f).strip('\n').split('\t'))
+reader = TableReader(f)
 counter = 0
 errors_counter = 0
-for i, line in enumerate(f):
+for i, record in enumerate(reader):
     counter += 1
-    #print(line.strip('\n').split('\t'))
 
-    record = dict(zip(header, line.strip('\n').split('\t')))
     try:
         assert record['chrom'] in CHROMS, 'Unexpected "chrom" column value: ' + record['chrom']
         assert int(record['pos']) > 0 and int(record['pos']) < 3*10**8, 'Unexpected "pos" column value: ' + record['pos']
@@ -49,7 +47,7 @@ for i, line in enumerate(f):
         print("====================================")
         print("ERROR in %s - line %s: " % (alleles_table_path, i))
         print(e)
-        pprint(record)
+        pprint(dict(record.as_dict()))
         errors_counter += 1
 
 assert ("multi" in alleles_table_path and counter > 100) or ("single" in alleles_table_path and counter > 10000), 'Table %s has only %s records' % (alleles_table_path, counter)
@@ -1,6 +1,8 @@
 import sys
 import pandas as pd
 
+from allele_key import pack_allele_key, format_allele_key
+
 """
 Rudimentary differ for clinvar_alleles.tsv.gz
 
@@ -14,12 +16,34 @@ print "comparing A: {} and B: {}".format(sys.argv[1], sys.argv[2])
 sep = "#" * 25
 
 print sep
-INDEX = ['chrom', 'pos', 'ref', 'alt', 'allele_id']
-df_a = pd.read_csv(sys.argv[1], sep="\t", compression='gzip',
-                   index_col=False).sort_values(INDEX).set_index(INDEX)
+# the rows are identified by their packed allele key (see allele_key.py) and allele_id, so that the rows of A and B
+# are matched by comparing integers
+LOCATION = ['chrom', 'pos', 'ref', 'alt']
+INDEX = ['allele_key', 'allele_id']
+hashed_allele_names = {}  # the chrom-pos-ref-alt of the hashed keys, which can't be unpacked
+
+
+def read_clinvar_alleles(path):
+    df = pd.read_csv(path, sep="\t", compression='gzip', index_col=False)
+    allele_keys = []
+    for chrom, pos, ref, alt in zip(df.chrom, df.pos, df.ref, df.alt):
+        allele_key = pack_allele_key(str(chrom), pos, str(ref), str(alt))
+        if allele_key < 0:
+            hashed_allele_names[allele_key] = "{}-{}-{}-{}".format(chrom, pos, ref, alt)
+        allele_keys.append(allele_key)
+    df['allele_key'] = allele_keys
+    return df.drop(LOCATION, axis=1).sort_values(INDEX).set_index(INDEX)
+
+
+def format_index(ix):
+    allele_key, allele_id = ix
+    allele_name = hashed_allele_names.get(allele_key) or format_allele_key(allele_key)
+    return "({}, {})".format(allele_name, allele_id)
+
+
+df_a = read_clinvar_alleles(sys.argv[1])
 print "A: {} rows".format(df_a.shape[0])
-df_b = pd.read_csv(sys.argv[2], sep="\t", compression='gzip',
-                   index_col=False).sort_values(INDEX).set_index(INDEX)
+df_b = read_clinvar_alleles(sys.argv[2])
 print "B: {} rows".format(df_b.shape[0])
 rows_a = set(df_a.index)
 rows_b = set(df_b.index)
@@ -27,10 +51,10 @@ common_rows = sorted(rows_a & rows_b)
 print "{} rows in common".format(len(common_rows))
 rows_a_not_b = list(rows_a - rows_b)
 print "{} rows in A but not B, e.g.: {}".format(
-    len(rows_a_not_b), ", ".join(map(str, rows_a_not_b[:5])))
+    len(rows_a_not_b), ", ".join(map(format_index, rows_a_not_b[:5])))
 rows_b_not_a = list(rows_b - rows_a)
 print "{} rows in B but not A, e.g.: {}".format(
-    len(rows_b_not_a), ", ".join(map(str, rows_b_not_a[:5])))
+    len(rows_b_not_a), ", ".join(map(format_index, rows_b_not_a[:5])))
 print sep
 
 cols_a = set(df_a.columns)
@@ -61,7 +85,7 @@ for col in common_columns:
         for ix, is_match in matches.iteritems():
             if not is_match:
                 print "\t{}: '{}' vs '{}'".format(
-                    ix, df_a.loc[ix][col].values, df_b.loc[ix][col].values)
+                    format_index(ix), df_a.loc[ix][col].values, df_b.loc[ix][col].values)
                 showed += 1
                 if showed >= 5:
                     break
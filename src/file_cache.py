@@ -0,0 +1,114 @@
+"""Helpers of the files that are built once from a large input and kept next to it, so that the next runs reuse them:
+the variant summary indexes (variant_summary_index.py), the population stores (population_store.py) and the position
+filters (position_filter.py).
+
+Each of them records the md5 checksum, size and mtime of its input, and is rebuilt when the checksum changes. The
+checksum is only computed when the size or mtime of the input changed, and when only the mtime changed, the new one is
+saved, so checking an up-to-date file is quick, even after its input was touched or downloaded again. They are written
+to a temp file or directory next to their final path, and renamed at the end, so that a reader never sees a partial
+one and concurrent builders don't write into each other's.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from array import array
+
+INT64 = 'l'
+UINT32 = 'I'
+
+assert array(INT64).itemsize == 8 and array(UINT32).itemsize == 4
+
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def get_file_checksum(path, chunk_size=2**20):
+    """Return the md5 hex digest of a file"""
+
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def check_file(path, size, mtime, checksum):
+    """Check whether a file still has the content that had this size, mtime and checksum.
+
+    Return:
+        (whether it has, its new mtime if only its mtime changed, or None). The caller saves the new mtime, so that
+        the checksum isn't computed again by the next checks.
+    """
+
+    stat = os.stat(path)
+    if stat.st_size == size and stat.st_mtime == mtime:
+        return True, None
+    # the file was touched, e.g. downloaded again. It's only stale if its content changed.
+    if stat.st_size == size and get_file_checksum(path) == checksum:
+        return True, stat.st_mtime
+    return False, None
+
+
+def make_temp_file(path):
+    """Create a temp file in the directory of path, with the permissions of a file created by open.
+
+    Return:
+        (open file descriptor, path of the temp file)
+    """
+
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                    dir=os.path.dirname(os.path.abspath(path)))
+    os.chmod(tmp_path, 0o666 & ~UMASK)  # mkstemp makes the file private
+    return fd, tmp_path
+
+
+def make_temp_dir(path):
+    """Create a temp directory in the directory of path, with the permissions of a directory created by os.mkdir, and
+    return its path"""
+
+    tmp_path = tempfile.mkdtemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                dir=os.path.dirname(os.path.abspath(path)))
+    os.chmod(tmp_path, 0o777 & ~UMASK)
+    return tmp_path
+
+
+def write_json(path, data):
+    """Write a .json file to a temp file that is renamed over it, so that a reader never sees a partial one"""
+
+    fd, tmp_path = make_temp_file(path)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=1)
+        os.rename(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def to_bytes(values):
+    """Return the little-endian uint32 bytes of a list of ints"""
+
+    values = array(UINT32, values)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tostring()
+
+
+def from_bytes(data):
+    """Return the array of uint32 of little-endian bytes"""
+
+    values = array(UINT32)
+    values.fromstring(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def to_numpy(values, dtype):
+    """Return a numpy array of the contents of an array.array or a string, without copying them"""
+
+    import numpy as np  # only the population stores and filters need numpy
+    return np.frombuffer(values, dtype=dtype) if len(values) else np.zeros(0, dtype=dtype)
@@ -1,7 +1,11 @@
-import sys
+import argparse
+import os
 import re
 import gzip
 
+from bgzf import BgzfReader
+from index_clinvar_xml import ID_COLUMNS, get_index_path, lookup_clinvar_sets, read_clinvar_xml
+
 """
 Helper script to grab some variations by their ID from the master XML for
 testing purposes.
@@ -10,54 +14,98 @@ Usage:
         <ClinVarFullRelease.xml.gz> \
         <comma-separated list of variation IDs> \
         <out.xml.gz>
-"""
 
-in_xml = sys.argv[1]  # e.g. ClinVarFullRelease.xml.gz
-interesting_variations = set(sys.argv[2].split(","))
-# ^ comma-separated list of interesting variation IDs, e.g. 187175,188901
-out_xml = sys.argv[3]  # where to write, e.g. interesting.xml.gz
+If the XML was indexed with index_clinvar_xml.py (<ClinVarFullRelease.xml.gz>.cvi exists), the ClinVarSets are
+looked up in the index and read straight from the XML, and they can also be looked up by RCV accession or allele ID
+(--id-type rcv or --id-type allele). Otherwise, the whole XML is scanned for the variation IDs.
+"""
 
 variations_id_regex = re.compile(r'ID="(\d+)"')
 
-# input file could be gzipped or not, output file will have same status
-if in_xml.endswith(".gz"):
-    in_f = gzip.open(in_xml)
-    if not out_xml.endswith(".gz"):
-        out_xml += ".gz"
-    out_f = gzip.open(out_xml, 'w')
-else:
-    in_f = open(in_xml)
-    assert not out_xml.endswith(".gz")
-    out_f = open(out_xml, 'w')
-
-in_clinvarset = False
-interesting = False
-clinvarset = []
-out_f.write(next(in_f))  # <?xml>
-out_f.write(next(in_f))  # <RelaseSet>
-out_f.write("\n")
-
-for line in in_f:
-    if line.startswith("<ClinVarSet"):
-        in_clinvarset = True
-    elif line.startswith("</ClinVarSet>"):
-        if interesting:
-            out_f.write("".join(clinvarset))
-            out_f.write(line)
-            out_f.write("\n")
-        clinvarset = []
-        in_clinvarset = False
-        interesting = False
-        continue
+
+def grab_by_scanning(in_f, out_f, interesting_variations):
+    """Scan the whole XML and write the ClinVarSets whose MeasureSet ID is one of interesting_variations"""
+
+    in_clinvarset = False
+    interesting = False
+    clinvarset = []
+    out_f.write(next(in_f))  # <?xml>
+    out_f.write(next(in_f))  # <RelaseSet>
+    out_f.write("\n")
+
+    for line in in_f:
+        if line.startswith("<ClinVarSet"):
+            in_clinvarset = True
+        elif line.startswith("</ClinVarSet>"):
+            if interesting:
+                out_f.write("".join(clinvarset))
+                out_f.write(line)
+                out_f.write("\n")
+            clinvarset = []
+            in_clinvarset = False
+            interesting = False
+            continue
+        else:
+            if line.startswith("    <MeasureSet"):
+                m = variations_id_regex.search(line)
+                interesting = (interesting or
+                               (m and m.group(1) in interesting_variations))
+        if in_clinvarset:
+            clinvarset.append(line)
+
+    out_f.write("</ReleaseSet>\n")
+
+
+def grab_from_index(in_xml, index_path, out_f, id_type, interesting_ids):
+    """Look up the ClinVarSets with the given IDs in the index, and write them in the same format as
+    grab_by_scanning"""
+
+    reader = BgzfReader(in_xml)
+    out_f.write(reader.readline())  # <?xml>
+    out_f.write(reader.readline())  # <RelaseSet>
+    out_f.write("\n")
+
+    for virtual_offset, length in lookup_clinvar_sets(index_path, id_type, interesting_ids):
+        out_f.write(read_clinvar_xml(reader, virtual_offset, length))
+        out_f.write("\n\n")
+
+    out_f.write("</ReleaseSet>\n")
+    reader.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Grab some ClinVarSets by ID from the ClinVar XML dump')
+    parser.add_argument('in_xml', help='e.g. ClinVarFullRelease.xml.gz')
+    parser.add_argument('ids', help='comma-separated list of interesting IDs, e.g. 187175,188901')
+    parser.add_argument('out_xml', help='where to write, e.g. interesting.xml.gz')
+    parser.add_argument('--id-type', choices=sorted(ID_COLUMNS), default='variation',
+                        help='Type of the IDs. Only variation IDs can be grabbed without an index.')
+    parser.add_argument('--index', help='Index made by index_clinvar_xml.py. Default: <in_xml>.cvi, if it exists')
+    args = parser.parse_args()
+
+    in_xml = args.in_xml
+    interesting_ids = set(args.ids.split(","))
+    out_xml = args.out_xml
+    index_path = args.index
+    if index_path is None and os.path.isfile(get_index_path(in_xml)):
+        index_path = get_index_path(in_xml)
+    if index_path is None and args.id_type != 'variation':
+        parser.error("--id-type %s requires an index of %s, see index_clinvar_xml.py" % (args.id_type, in_xml))
+
+    # input file could be gzipped or not, output file will have same status
+    if in_xml.endswith(".gz"):
+        if not out_xml.endswith(".gz"):
+            out_xml += ".gz"
+        out_f = gzip.open(out_xml, 'w')
     else:
-        if line.startswith("    <MeasureSet"):
-            m = variations_id_regex.search(line)
-            interesting = (interesting or
-                           (m and m.group(1) in interesting_variations))
-    if in_clinvarset:
-        clinvarset.append(line)
+        assert not out_xml.endswith(".gz")
+        out_f = open(out_xml, 'w')
 
-out_f.write("</ReleaseSet>\n")
+    if index_path is not None:
+        grab_from_index(in_xml, index_path, out_f, args.id_type, interesting_ids)
+    else:
+        in_f = gzip.open(in_xml) if in_xml.endswith(".gz") else open(in_xml)
+        grab_by_scanning(in_f, out_f, interesting_ids)
+        in_f.close()
 
-in_f.close()
-out_f.close()
+    out_f.close()
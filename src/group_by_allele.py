@@ -2,11 +2,38 @@
 
 import argparse
 import gzip
+import heapq
+import multiprocessing
+import os
+import shutil
 import sys
+import tempfile
 
+from allele_key import pack_allele_key
+from bgzf import BgzfWriter
+from join_variant_summary_with_clinvar_alleles import FINAL_HEADER, JoinedOutput
 from parse_clinvar_xml import HEADER
+from sort_table import get_chromosome_sort_key
+from variant_summary_index import open_variant_summary_index
 # recommended usage:
 # ./group_by_allele.py < clinvar_combined.tsv > clinvar_alleles.tsv
+# or, if the input isn't sorted:
+# ./group_by_allele.py --unsorted < clinvar_table.tsv > clinvar_alleles.tsv
+# or, to also join the variant summary and make the final, indexed clinvar_alleles table in the same pass:
+# ./group_by_allele.py -i clinvar_allele_trait_pairs.tsv.gz -S variant_summary.txt.gz -g GRCh37 --tabix \
+#     -o clinvar_alleles.tsv.gz
+
+
+LOCATION_COLUMNS = ['chrom', 'pos', 'ref', 'alt']
+COUNT_COLUMNS = ['pathogenic', 'likely_pathogenic', 'uncertain_significance', 'likely_benign', 'benign']
+# columns that may have ;-separated lists of values, which are concatenated
+LIST_COLUMNS = [column_name for column_name in HEADER
+                if column_name not in LOCATION_COLUMNS and column_name not in COUNT_COLUMNS]
+
+GROUP_MEMORY_MB = 1024  # default memory cap of group_unsorted_by_allele
+GROUP_BUCKETS = 64  # number of buckets that group_unsorted_by_allele partitions the rows into when they don't fit
+MAX_PARTITION_DEPTH = 3  # buckets that don't fit are partitioned again, up to this depth
+LINE_OVERHEAD = 100  # approximate number of bytes that python uses for a line on top of its characters
 
 
 def group_by_allele(infile, outfile):
@@ -19,29 +46,306 @@ def group_by_allele(infile, outfile):
 
     header = next(infile)
     outfile.write(header)
-    column_names = header.strip('\n').split('\t')
+    if not group_sorted_lines(infile, outfile, *get_column_indices(header)):
+        raise ValueError("%s has 0 records" % infile)
+
+
+def group_sorted_lines(lines, outfile, location_indices, count_indices, list_indices):
+    """Merge the consecutive lines of each allele, and write the merged lines to outfile.
 
-    last_data = None
+    Return:
+        The number of lines read
+    """
+
+    rows = []  # the rows of the current allele, as tuples of fields
     last_unique_id = None
     counter = 0
-
-    for line in infile:
-        data = dict(zip(column_names, line.strip('\n').split('\t')))
-        unique_id = '_'.join([data['chrom'], str(data['pos']), data['ref'], data['alt']])
-        if unique_id == last_unique_id:
-            data = group_alleles(last_data, data)
-        elif last_data is not None:
-            # note that using a comprehension instead of just data.values() preserves column order
-            # the next line (data) is not duplicated as the current line(last_data) then just print last_data
-            outfile.write('\t'.join([last_data[colname] for colname in column_names])+'\n')
-        last_data = data
-        last_unique_id = unique_id
+    for line in lines:
+        row = tuple(line.strip('\n').split('\t'))
+        unique_id = tuple([row[i] for i in location_indices])
+        if unique_id != last_unique_id:
+            if rows:
+                outfile.write(merge_allele_rows(rows, count_indices, list_indices))
+            rows = []
+            last_unique_id = unique_id
+        rows.append(row)
         counter += 1
 
-    if last_data is not None:
-        outfile.write('\t'.join([last_data[colname] for colname in column_names])+'\n')
+    if rows:
+        outfile.write(merge_allele_rows(rows, count_indices, list_indices))
+    return counter
+
+
+def _group_chromosome(args):
+    """Worker for group_by_allele_in_parallel: group the lines of a chromosome of a tabix-indexed table, and write
+    them to a BGZF part. If a variant summary is given, the grouped lines are joined with it (see JoinedOutput).
+
+    Return:
+        (number of lines read, number of lines written)
+    """
+
+    import pysam
+
+    path, chrom, part_path, header, column_indices, variant_summary_table, genome_build_id = args
+    table = pysam.TabixFile(path)
+    output = part = BgzfWriter(open(part_path, 'wb'))
+    if variant_summary_table is not None:
+        variant_summary = open_variant_summary_index(variant_summary_table, genome_build_id)
+        output = JoinedOutput(part, variant_summary, header.rstrip('\n').split('\t'))
+    counter = group_sorted_lines((line + '\n' for line in table.fetch(chrom)), output, *column_indices)
+    part.close()
+    table.close()
+    if variant_summary_table is not None:
+        variant_summary.close()
+        return counter, output.rows_written
+    return counter, None
+
+
+def group_by_allele_in_parallel(path, output, workers, tmp_dir=None, variant_summary_table=None,
+                                genome_build_id=None):
+    """Like group_by_allele, but the chromosomes of a bgzipped, tabix-indexed table are grouped in parallel, and
+    the BGZF parts are concatenated in the order of the table.
+
+    Args:
+        path: Path of the sorted clinvar_table_sorted.tsv.gz, indexed with tabix -S 1 -s 1 -b 2 -e 2
+        output: BgzfWriter to write to.
+        workers: Number of processes
+        tmp_dir: Directory for the parts. Default: the system's temp dir
+        variant_summary_table, genome_build_id: If given, the grouped alleles are joined with the variant summary
+            of that assembly as they are written (see join_variant_summary_with_clinvar_alleles.py)
+
+    Return:
+        The number of lines written by the join, or None without a variant summary
+    """
+
+    import pysam
+
+    with gzip.open(path) as infile:
+        header = next(infile)
+    if variant_summary_table is not None:
+        # make sure the index of the variant summary is up to date before the workers open it
+        open_variant_summary_index(variant_summary_table, genome_build_id).close()
+        output.write('\t'.join(FINAL_HEADER) + '\n')
     else:
-        raise ValueError("%s has 0 records" % infile)
+        output.write(header)
+    column_indices = get_column_indices(header)
+
+    table = pysam.TabixFile(path)
+    chroms = list(table.contigs)  # in the order of the table
+    table.close()
+
+    tmp_dir = tempfile.mkdtemp(prefix='group_by_allele_', dir=tmp_dir)
+    pool = multiprocessing.Pool(workers)
+    try:
+        tasks = [(path, chrom, os.path.join(tmp_dir, 'part_%d.bgz' % i), header, column_indices,
+                  variant_summary_table, genome_build_id) for i, chrom in enumerate(chroms)]
+        counter = 0
+        rows_written = 0
+        for task, (part_counter, part_rows_written) in zip(tasks, pool.imap(_group_chromosome, tasks)):
+            output.append_file(task[2])
+            os.remove(task[2])
+            counter += part_counter
+            rows_written += part_rows_written or 0
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(tmp_dir)
+
+    if not counter:
+        raise ValueError("%s has 0 records" % path)
+    return rows_written if variant_summary_table is not None else None
+
+
+def get_column_indices(header):
+    """Return the indices of the (LOCATION_COLUMNS, COUNT_COLUMNS, LIST_COLUMNS) in a header line"""
+
+    column_names = header.strip('\n').split('\t')
+    return tuple([column_names.index(column_name) for column_name in column_names_list]
+                 for column_names_list in (LOCATION_COLUMNS, COUNT_COLUMNS, LIST_COLUMNS))
+
+
+def group_unsorted_by_allele(infile, outfile, memory_mb=GROUP_MEMORY_MB, buckets=GROUP_BUCKETS, tmp_dir=None):
+    """Make an unsorted clinvar_table.tsv file unique on CHROM POS REF ALT, and write it sorted by CHROM (1-22, X, Y,
+    MT), POS, REF, ALT.
+
+    The rows are grouped in memory. If they take more than memory_mb, they are hash-partitioned by allele into
+    buckets on disk instead, and each bucket is grouped in memory and spilled as a sorted run, and the runs are
+    merged. The rows of an allele are merged in lexicographic order, so the output is the same as that of
+    group_by_allele on the output of sort_table.py.
+
+    Args:
+        infile: Input file stream for reading clinvar_table.tsv
+        outfile: Output file stream to write to.
+        memory_mb: Number of MB of rows to group in memory
+        buckets: Number of buckets to partition the rows into when they take more than memory_mb
+        tmp_dir: Directory for the buckets and runs. Default: the system's temp dir
+    """
+
+    header = next(infile)
+    outfile.write(header)
+    location_indices, count_indices, list_indices = get_column_indices(header)
+    memory_budget = memory_mb * 2**20
+
+    tmp_dir = tempfile.mkdtemp(prefix='group_by_allele_', dir=tmp_dir)
+    try:
+        alleles = {}
+        buffered = 0
+        bucket_paths = None
+        for line in infile:
+            if bucket_paths is not None:
+                bucket_files[get_bucket(get_allele_key(line, location_indices), 0, buckets)].write(line)
+                continue
+
+            alleles.setdefault(get_allele_key(line, location_indices), []).append(line)
+            buffered += len(line) + LINE_OVERHEAD
+            if buffered > memory_budget:
+                # switch to partitioning the rows into buckets on disk
+                bucket_paths = [os.path.join(tmp_dir, 'bucket_%d.tsv' % i) for i in range(buckets)]
+                bucket_files = [open(path, 'wb') for path in bucket_paths]
+                for key, lines in alleles.iteritems():
+                    bucket_files[get_bucket(key, 0, buckets)].writelines(lines)
+                alleles = None
+
+        if bucket_paths is None:
+            outfile.writelines(iter_sorted_allele_lines(alleles, location_indices, count_indices, list_indices))
+            return
+
+        for bucket_file in bucket_files:
+            bucket_file.close()
+        run_paths = []
+        for bucket_path in bucket_paths:
+            run_paths += group_bucket(bucket_path, location_indices, count_indices, list_indices, memory_budget,
+                                      buckets, depth=1)
+
+        runs = [iter_run(path, location_indices) for path in run_paths]
+        for key, line in heapq.merge(*runs):
+            outfile.write(line)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def get_allele_location(line, location_indices):
+    """Return the (chrom, pos, ref, alt) of a line"""
+
+    fields = line.split('\t')
+    return tuple([fields[i].rstrip('\n') for i in location_indices])
+
+
+def get_allele_key(line, location_indices):
+    """Return the packed allele key of a line (see allele_key.py), which takes a lot less memory than its location"""
+
+    return pack_allele_key(*get_allele_location(line, location_indices))
+
+
+def get_allele_sort_key(allele_location):
+    chrom, pos, ref, alt = allele_location
+    return get_chromosome_sort_key(chrom), int(pos), ref, alt
+
+
+def get_bucket(allele_key, depth, buckets):
+    """Return the bucket of an allele key at a depth of partitioning. The keys are salted with the depth, so that the
+    alleles of a bucket are spread over the buckets of the next depth."""
+
+    return hash((depth, allele_key)) % buckets
+
+
+def iter_sorted_allele_lines(alleles, location_indices, count_indices, list_indices):
+    """Merge the rows of each allele, and yield the merged lines in sorted order.
+
+    Args:
+        alleles: dict that maps each allele key to the list of its lines
+    """
+
+    def get_sort_key(lines):
+        return get_allele_sort_key(get_allele_location(lines[0], location_indices))
+
+    for lines in sorted(alleles.itervalues(), key=get_sort_key):
+        rows = [tuple(line.strip('\n').split('\t')) for line in sorted(lines)]
+        yield merge_allele_rows(rows, count_indices, list_indices)
+
+
+def group_bucket(bucket_path, location_indices, count_indices, list_indices, memory_budget, buckets, depth):
+    """Group the rows of a bucket of group_unsorted_by_allele, and write the merged lines to a sorted run. If the
+    bucket is too big to group in memory, partition it again.
+
+    Return:
+        The list of paths of the runs
+    """
+
+    if os.path.getsize(bucket_path) > memory_budget and depth < MAX_PARTITION_DEPTH:
+        sub_bucket_paths = ['%s_%d' % (bucket_path, i) for i in range(buckets)]
+        sub_bucket_files = [open(path, 'wb') for path in sub_bucket_paths]
+        with open(bucket_path, 'rb') as bucket:
+            for line in bucket:
+                sub_bucket_files[get_bucket(get_allele_key(line, location_indices), depth, buckets)].write(line)
+        for sub_bucket_file in sub_bucket_files:
+            sub_bucket_file.close()
+        os.remove(bucket_path)
+
+        run_paths = []
+        for sub_bucket_path in sub_bucket_paths:
+            run_paths += group_bucket(sub_bucket_path, location_indices, count_indices, list_indices,
+                                      memory_budget, buckets, depth + 1)
+        return run_paths
+
+    alleles = {}
+    with open(bucket_path, 'rb') as bucket:
+        for line in bucket:
+            alleles.setdefault(get_allele_key(line, location_indices), []).append(line)
+    os.remove(bucket_path)
+    if not alleles:
+        return []
+
+    run_path = bucket_path + '.run'
+    with open(run_path, 'wb') as run:
+        run.writelines(iter_sorted_allele_lines(alleles, location_indices, count_indices, list_indices))
+    return [run_path]
+
+
+def iter_run(path, location_indices):
+    """Yield the (sort key, line) of each line of a sorted run"""
+
+    with open(path, 'rb') as run:
+        for line in run:
+            yield get_allele_sort_key(get_allele_location(line, location_indices)), line
+
+
+def ordered_union(value_lists):
+    """Return the ;-separated non-empty values of value_lists, without duplicates, in the order they first appear"""
+
+    seen = set()
+    values = []
+    for value_list in value_lists:
+        for value in value_list.split(';'):
+            if value and value not in seen:
+                seen.add(value)
+                values.append(value)
+    return ';'.join(values)
+
+
+def merge_allele_rows(rows, count_indices, list_indices):
+    """Merge the rows of an allele into one line, like group_alleles does for pairs of rows.
+
+    Args:
+        rows: List of the rows of the allele, as tuples of fields
+        count_indices: Indices of the COUNT_COLUMNS, which are added up
+        list_indices: Indices of the LIST_COLUMNS, whose values are concatenated and deduplicated
+
+    Return:
+        The merged line. If there's only one row, it's returned unchanged.
+    """
+
+    if len(rows) == 1:
+        return '\t'.join(rows[0]) + '\n'
+
+    merged = list(rows[0])
+    for i in list_indices:
+        merged[i] = ordered_union([row[i] for row in rows])
+    for i in count_indices:
+        merged[i] = str(sum([int(row[i]) for row in rows]))
+
+    return '\t'.join(merged) + '\n'
+
 
 def group_alleles(data1, data2):
     """Group two variants with same genomic coordinates.
@@ -58,21 +362,10 @@ def group_alleles(data1, data2):
 
     # 'pathogenic', 'benign', 'conflicted', 'gold_stars',
     # concatenate columns that may have lists of values
-    loc_column = ['chrom','pos','ref','alt']
-    num_field = ['pathogenic', 'likely_pathogenic','uncertain_significance','likely_benign', 'benign']
-    info_column = [x for x in HEADER if x not in loc_column and x not in num_field]
-
-    for column_name in info_column:
-        all_non_empty_values = filter(lambda s: s, data1[column_name].split(';') + data2[column_name].split(';'))
-        # deduplicate values, while preserving order
-        deduplicated_values = []
-        for value in all_non_empty_values:
-            if value not in deduplicated_values:
-                deduplicated_values.append(value)
-
-        combined_data[column_name] = ';'.join(deduplicated_values)
+    for column_name in LIST_COLUMNS:
+        combined_data[column_name] = ordered_union([data1[column_name], data2[column_name]])
 
-    for column_name in num_field:
+    for column_name in COUNT_COLUMNS:
         combined_data[column_name]=str(int(data1[column_name])+int(data2[column_name]))
 
     return combined_data
@@ -81,14 +374,74 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='De-duplicate the output from parse_clinvar_xml.py')
     parser.add_argument('-i', '--infile', type=argparse.FileType('r'), default=sys.stdin)
     parser.add_argument('-o', '--outfile', type=argparse.FileType('w'), default=sys.stdout)
+    parser.add_argument('-u', '--unsorted', action='store_true',
+                        help='The input is not sorted. Group it with a hash table, partitioned into buckets on disk if '
+                             'it doesn\'t fit in --memory-mb, and sort the output.')
+    parser.add_argument('-m', '--memory-mb', type=int, default=GROUP_MEMORY_MB,
+                        help='With --unsorted: memory cap for the rows that are grouped in memory')
+    parser.add_argument('--buckets', type=int, default=GROUP_BUCKETS,
+                        help='With --unsorted: number of buckets to partition the rows into if they don\'t fit')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Number of processes to group the chromosomes with in parallel. The input must be '
+                             'bgzipped and tabix-indexed, and the output is written as BGZF to --outfile.')
+    parser.add_argument('-T', '--tmp-dir', help='With --unsorted or --workers: directory for the buckets or parts. '
+                                                'Default: the system\'s temp dir')
+    parser.add_argument('-S', '--variant-summary', help='variant_summary.txt.gz to join the grouped alleles with, '
+                                                        'see join_variant_summary_with_clinvar_alleles.py')
+    parser.add_argument('-g', '--genome-build', help='With --variant-summary: the assembly, e.g. GRCh37')
+    parser.add_argument('--tabix', action='store_true',
+                        help='Index the output with tabix. It must be sorted, and written to a .gz --outfile.')
     args = parser.parse_args()
 
-    if args.infile.name.endswith(".gz"):
+    if args.variant_summary and not args.genome_build:
+        parser.error("--variant-summary requires --genome-build")
+    if args.tabix and not args.outfile.name.endswith('.gz'):
+        parser.error("--tabix requires a .gz --outfile")
+
+    outfile_path = args.outfile.name
+    rows_written = None
+    if args.workers > 1:
+        if args.unsorted:
+            parser.error("--workers can't be used with --unsorted")
+        if not os.path.isfile(args.infile.name + '.tbi'):
+            parser.error("--workers requires a tabix index of the input: %s.tbi" % args.infile.name)
+        if args.outfile is sys.stdout:
+            parser.error("--workers requires --outfile")
         args.infile.close()
-        args.infile = gzip.open(args.infile.name)
-    
-    if args.outfile.name.endswith(".gz"):
         args.outfile.close()
-        args.outfile = gzip.open(args.outfile.name, 'w')
-    
-    group_by_allele(args.infile, args.outfile)
+
+        output = BgzfWriter(open(args.outfile.name, 'wb'))
+        rows_written = group_by_allele_in_parallel(args.infile.name, output, args.workers, tmp_dir=args.tmp_dir,
+                                                   variant_summary_table=args.variant_summary,
+                                                   genome_build_id=args.genome_build)
+        output.close()
+    else:
+        if args.infile.name.endswith(".gz"):
+            args.infile.close()
+            args.infile = gzip.open(args.infile.name)
+
+        if args.outfile.name.endswith(".gz"):
+            args.outfile.close()
+            args.outfile = BgzfWriter(open(args.outfile.name, 'wb'))
+
+        output = args.outfile
+        if args.variant_summary:
+            variant_summary = open_variant_summary_index(args.variant_summary, args.genome_build)
+            output = JoinedOutput(args.outfile, variant_summary)
+
+        if args.unsorted:
+            group_unsorted_by_allele(args.infile, output, memory_mb=args.memory_mb, buckets=args.buckets,
+                                     tmp_dir=args.tmp_dir)
+        else:
+            group_by_allele(args.infile, output)
+        args.outfile.close()
+
+        if args.variant_summary:
+            variant_summary.close()
+            rows_written = output.rows_written
+
+    if rows_written is not None:
+        sys.stderr.write("Joined %d rows with the variant summary\n" % rows_written)
+    if args.tabix:
+        import pysam
+        pysam.tabix_index(outfile_path, seq_col=0, start_col=1, end_col=1, line_skip=1, force=True)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+"""Make a random-access copy of the ClinVar XML dump, and an index of the ClinVarSets in it.
+
+ClinVarFullRelease_00-latest.xml.gz is a single gzip stream, so it can only be read from the start. This
+recompresses it as BGZF (see bgzf.py), which gzip, zcat and parse_clinvar_xml.py still read as usual, and writes
+the position and IDs of each ClinVarSet to a tab-delimited index next to it (<output>.cvi). With the index, any
+ClinVarSet can be read without decompressing the ones before it, eg. by the parse_clinvar_xml.py workers, or looked
+up by its RCV accession, variation ID or allele ID (see grab_interesting_variations.py).
+
+    python index_clinvar_xml.py -x ClinVarFullRelease_00-latest.xml.gz -o ClinVarFullRelease_00-latest.bgz.xml.gz
+"""
+
+import argparse
+import re
+import sys
+
+from bgzf import BgzfWriter
+from parse_clinvar_xml import CLINVAR_SET_START, CLINVAR_SET_END, RCV_ACCESSION_REGEX, ACC_ATTRIBUTE_REGEX, \
+    get_handle
+
+# virtual_offset: BGZF virtual offset of the '<ClinVarSet' tag
+# offset, length: offset in the uncompressed XML and length in bytes of the ClinVarSet element
+# rcv: accession of the ReferenceClinVarAssertion
+# variation_ids, allele_ids: comma-separated IDs of the MeasureSets and Measures of the ReferenceClinVarAssertion
+INDEX_HEADER = ['virtual_offset', 'offset', 'length', 'rcv', 'variation_ids', 'allele_ids']
+
+# the index columns that ClinVarSets can be looked up by
+ID_COLUMNS = {'rcv': 'rcv', 'variation': 'variation_ids', 'allele': 'allele_ids'}
+
+REFERENCE_ASSERTION_REGEX = re.compile(br'<ReferenceClinVarAssertion[\s>].*?</ReferenceClinVarAssertion>', re.DOTALL)
+MEASURE_SET_ID_REGEX = re.compile(br'<MeasureSet\s[^>]*\bID="([^"]*)"')
+MEASURE_ID_REGEX = re.compile(br'<Measure\s[^>]*\bID="([^"]*)"')
+
+
+def get_index_path(xml_path):
+    return xml_path + '.cvi'
+
+
+def get_indexed_xml_path(index_path):
+    if not index_path.endswith('.cvi'):
+        raise ValueError("Unexpected ClinVar XML index file name: %s. Expected <xml>.cvi" % index_path)
+    return index_path[:-len('.cvi')]
+
+
+def split_clinvar_xml(handle, block_size=2**22):
+    """Split a ClinVar XML stream into the ClinVarSet elements and the text in between.
+
+    Args:
+        handle: Open input file handle for reading the XML data
+        block_size: Number of bytes to read from handle at a time
+
+    Yield:
+        (is_clinvar_set, data) tuples, whose data add up to the whole stream
+    """
+
+    data = b''
+    start = 0  # offset in data of the piece that's currently being read
+    in_clinvar_set = False
+    pos = 0  # offset in data where the next search starts
+    while True:
+        if not in_clinvar_set:
+            i = data.find(CLINVAR_SET_START, pos)
+            if i >= 0:
+                if i > start:
+                    yield False, data[start:i]
+                start = pos = i
+                in_clinvar_set = True
+                continue
+            pos = max(pos, len(data) - len(CLINVAR_SET_START) + 1)
+        else:
+            i = data.find(CLINVAR_SET_END, pos)
+            if i >= 0:
+                pos = i + len(CLINVAR_SET_END)
+                yield True, data[start:pos]
+                start = pos
+                in_clinvar_set = False
+                continue
+            pos = max(pos, len(data) - len(CLINVAR_SET_END) + 1)
+
+        block = handle.read(block_size)
+        if not block:
+            break
+
+        # drop the data that has already been yielded
+        data = data[start:] + block
+        pos -= start
+        start = 0
+
+    if start < len(data):
+        yield False, data[start:]
+
+
+def get_clinvar_set_ids(clinvar_set):
+    """Return the (rcv accession, variation ids, allele ids) of the XML of a ClinVarSet"""
+
+    match = RCV_ACCESSION_REGEX.search(clinvar_set)
+    acc = ACC_ATTRIBUTE_REGEX.search(match.group(0)) if match is not None else None
+    reference_assertion = REFERENCE_ASSERTION_REGEX.search(clinvar_set)
+    reference_assertion = reference_assertion.group(0) if reference_assertion is not None else b''
+
+    return (acc.group(1) if acc is not None else b'',
+            MEASURE_SET_ID_REGEX.findall(reference_assertion),
+            MEASURE_ID_REGEX.findall(reference_assertion))
+
+
+def index_clinvar_xml(handle, output, index):
+    """Copy a ClinVar XML stream to a BGZF file, and write the index of its ClinVarSets.
+
+    Args:
+        handle: Open input file handle for reading the XML data
+        output: BgzfWriter
+        index: Open output file handle for the index
+
+    Return:
+        The number of ClinVarSets
+    """
+
+    index.write('\t'.join(INDEX_HEADER) + '\n')
+    count = 0
+    offset = 0
+    for is_clinvar_set, data in split_clinvar_xml(handle):
+        if is_clinvar_set:
+            rcv, variation_ids, allele_ids = get_clinvar_set_ids(data)
+            index.write('%d\t%d\t%d\t%s\t%s\t%s\n' % (
+                output.tell(), offset, len(data), rcv, ','.join(variation_ids), ','.join(allele_ids)))
+            count += 1
+        output.write(data)
+        offset += len(data)
+
+    return count
+
+
+def iter_clinvar_xml_index(index_path):
+    """Yield the (virtual_offset, offset, length) of each ClinVarSet in an index"""
+
+    with open(index_path) as index:
+        header = next(index).rstrip('\n').split('\t')
+        if header[:len(INDEX_HEADER)] != INDEX_HEADER:
+            raise ValueError("Unexpected header in %s: %s" % (index_path, header))
+        for line in index:
+            fields = line.rstrip('\n').split('\t')
+            yield int(fields[0]), int(fields[1]), int(fields[2])
+
+
+def iter_clinvar_xml_index_shards(index_path, shard_size=500):
+    """Group the ClinVarSets of an index into shards of shard_size consecutive ClinVarSets.
+
+    Yield:
+        (virtual_offset, length) of each shard: the shard starts at virtual_offset, and ends length bytes
+        further in the uncompressed XML, at the end of its last ClinVarSet
+    """
+
+    first = last = None
+    count = 0
+    for entry in iter_clinvar_xml_index(index_path):
+        if first is None:
+            first = entry
+        last = entry
+        count += 1
+        if count == shard_size:
+            yield first[0], last[1] + last[2] - first[1]
+            first = None
+            count = 0
+
+    if first is not None:
+        yield first[0], last[1] + last[2] - first[1]
+
+
+def lookup_clinvar_sets(index_path, id_type, ids):
+    """Look up ClinVarSets by ID in one pass over the index.
+
+    Args:
+        index_path: Path of the index
+        id_type: 'rcv', 'variation' or 'allele' (see ID_COLUMNS)
+        ids: Collection of IDs
+
+    Return:
+        A list of the (virtual_offset, length) of the matching ClinVarSets, in the order of the XML
+    """
+
+    ids = set(ids)
+    with open(index_path) as index:
+        header = next(index).rstrip('\n').split('\t')
+        if header[:len(INDEX_HEADER)] != INDEX_HEADER:
+            raise ValueError("Unexpected header in %s: %s" % (index_path, header))
+        column = header.index(ID_COLUMNS[id_type])
+
+        matches = []
+        for line in index:
+            fields = line.rstrip('\n').split('\t')
+            if any(value in ids for value in fields[column].split(',')):
+                matches.append((int(fields[0]), int(fields[2])))
+
+    return matches
+
+
+def read_clinvar_xml(reader, virtual_offset, length):
+    """Read length bytes of the uncompressed XML from a BgzfReader, starting at virtual_offset"""
+
+    reader.seek(virtual_offset)
+    return reader.read(length)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Make a BGZF copy of the ClinVar XML dump with an index of its '
+                                                 'ClinVarSets.')
+    parser.add_argument('-x', '--xml', dest='xml_path', required=True, help='Path to the ClinVar XML dump')
+    parser.add_argument('-o', '--output', required=True,
+                        help='Path of the BGZF copy of the XML. The index is written to OUTPUT.cvi')
+    args = parser.parse_args()
+
+    output = BgzfWriter(open(args.output, 'wb'))
+    with open(get_index_path(args.output), 'w') as index:
+        count = index_clinvar_xml(get_handle(args.xml_path), output, index)
+    output.close()
+
+    sys.stderr.write("Indexed %d ClinVarSets\n" % count)
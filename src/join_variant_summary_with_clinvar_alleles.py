@@ -1,86 +1,167 @@
 #!/usr/bin/env python
+import gzip
 import sys
-import pandas as pd
 
+from bgzf import BgzfWriter
 from parse_clinvar_xml import HEADER
 
 FINAL_HEADER = HEADER + ['gold_stars', 'conflicted']
 
+# the columns of clinvar_alleles that are replaced by the values from the variant summary
+VARIANT_SUMMARY_COLUMNS = ['clinical_significance', 'review_status', 'last_evaluated']
+
+# map review_status to gold starts:
+GOLD_STAR_MAP = {
+    'no assertion provided': '0',
+    'no assertion for the individual variant': '0',
+    'no assertion criteria provided': '0',
+    'criteria provided, single submitter': '1',
+    'criteria provided, conflicting interpretations': '1',
+    'criteria provided, multiple submitters, no conflicts': '2',
+    'reviewed by expert panel': '3',
+    'practice guideline': '4',
+    '-': '-'
+}
+
+
+def read_variant_summary_by_build(variant_summary_table, genome_build_ids=("GRCh37", "GRCh38")):
+    """Read the (clinical_significance, review_status, last_evaluated) of each allele of several assemblies from
+    variant_summary.txt.gz, in one pass that only keeps those columns.
+
+    Return:
+        dict that maps each genome build id to a dict that maps each allele_id to the list of its distinct
+        (clinical_significance, review_status, last_evaluated) tuples, in the order of the file. Most alleles have
+        one, but the alleles on alternative loci such as PAR are listed more than once, which would be problematic for
+        rare cases like translocation.
+    """
+
+    variant_summaries = {genome_build_id: {} for genome_build_id in genome_build_ids}
+    values = {}  # to share the strings of the (few distinct) significances and review statuses between alleles
+    with gzip.open(variant_summary_table) as infile:
+        # use lowercase names and replace . with _ in column names, and rename the first column to allele_id:
+        column_names = [col.lower().replace(".", "_") for col in next(infile).rstrip('\n').split('\t')]
+        column_names[0] = 'allele_id'
+        allele_id_index = 0
+        assembly_index = column_names.index('assembly')
+        value_indices = [column_names.index(col) for col in ('clinicalsignificance', 'reviewstatus', 'lastevaluated')]
+
+        for line in infile:
+            fields = line.rstrip('\n').split('\t')
+            variant_summary = variant_summaries.get(fields[assembly_index])
+            if variant_summary is None:
+                continue
+            value = tuple([values.setdefault(fields[i], fields[i]) for i in value_indices])
+            allele_values = variant_summary.setdefault(fields[allele_id_index], [])
+            if value not in allele_values:
+                allele_values.append(value)
+
+    return variant_summaries
+
+
+def read_variant_summary(variant_summary_table, genome_build_id="GRCh37"):
+    """Read the variant summary of one assembly, see read_variant_summary_by_build"""
+
+    return read_variant_summary_by_build(variant_summary_table, [genome_build_id])[genome_build_id]
+
+
+def get_gold_stars(review_status):
+    return GOLD_STAR_MAP.get(review_status, '')
+
+
+def is_conflicted(clinical_significance):
+    """The use of expressions on clinical significance on ClinVar aggregate records (RCV)
+    https://www.ncbi.nlm.nih.gov/clinvar/docs/clinsig/#conflicts : conflicted = 1 if using "conflicting" """
+    return '1' if 'onflicting' in clinical_significance.lower() else '0'
+
+
+class JoinedOutput(object):
+    """File-like object that joins each clinvar_alleles line written to it with the variant summary, and writes it to
+    outfile with the clinical_significance, review_status and last_evaluated of its allele_id in the variant summary,
+    and the gold_stars and conflicted columns. Lines whose allele_id is not in the variant summary are dropped, and
+    lines whose allele_id is in it more than once are written once for each. This lets group_by_allele.py join its
+    output as it writes it.
+
+    Args:
+        outfile: Output file stream to write to.
+        variant_summary: dict from read_variant_summary, or a variant_summary_index.VariantSummaryIndex
+        column_names: The columns of the lines. If None, the first line written is the header, and FINAL_HEADER is
+            written instead.
+    """
+
+    def __init__(self, outfile, variant_summary, column_names=None):
+        self.outfile = outfile
+        self.variant_summary = variant_summary
+        self.rows_read = self.rows_written = 0
+        self.column_indices = None
+        if column_names is not None:
+            self._set_column_names(column_names)
+
+    def _set_column_names(self, column_names):
+        self.column_indices = [column_names.index(col) for col in HEADER]
+        self.allele_id_index = column_names.index('allele_id')
+        self.value_positions = [HEADER.index(col) for col in VARIANT_SUMMARY_COLUMNS]
+
+    def write(self, line):
+        if self.column_indices is None:
+            self._set_column_names(line.rstrip('\n').split('\t'))
+            self.outfile.write('\t'.join(FINAL_HEADER) + '\n')
+            return
+
+        fields = line.rstrip('\n').split('\t')
+        self.rows_read += 1
+        allele_values = self.variant_summary.get(fields[self.allele_id_index])
+        if not allele_values:
+            return
+
+        row = [fields[i] for i in self.column_indices]
+        clinical_significance_position, review_status_position, last_evaluated_position = self.value_positions
+        for clinical_significance, review_status, last_evaluated in allele_values:
+            row[clinical_significance_position] = clinical_significance
+            row[review_status_position] = review_status
+            row[last_evaluated_position] = last_evaluated
+            self.outfile.write('\t'.join(row + [get_gold_stars(review_status), is_conflicted(clinical_significance)])
+                               + '\n')
+            self.rows_written += 1
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+
+def join_clinvar_alleles(infile, outfile, variant_summary):
+    """Stream the rows of a clinvar_alleles table through a JoinedOutput. The output is in the same order as the
+    input.
+
+    Args:
+        infile: Input file stream for reading clinvar_alleles_grouped.tsv
+        outfile: Output file stream to write to.
+        variant_summary: dict from read_variant_summary, or a variant_summary_index.VariantSummaryIndex
+
+    Return:
+        (number of rows read, number of rows written)
+    """
+
+    output = JoinedOutput(outfile, variant_summary)
+    output.writelines(infile)
+    return output.rows_read, output.rows_written
+
 
 def join_variant_summary_with_clinvar_alleles(
-        variant_summary_table, clinvar_alleles_table,
+        variant_summary_table, clinvar_alleles_table, outfile,
         genome_build_id="GRCh37"):
-    variant_summary = pd.read_csv(variant_summary_table, sep="\t",
-                                  index_col=False, compression="gzip",low_memory=False)
-    print "variant_summary raw", variant_summary.shape
-
-    clinvar_alleles = pd.read_csv(clinvar_alleles_table, sep="\t",
-                                  index_col=False, compression="gzip",low_memory=False)
-    print "clinvar_alleles raw", clinvar_alleles.shape
-
-    # use lowercase names and replace . with _ in column names:
-    variant_summary = variant_summary.rename(columns=dict(
-        (col, col.lower().replace(".", "_"))
-        for col in variant_summary.columns))
-    # rename first column to allele_id:
-    variant_summary = variant_summary.rename(
-        columns={variant_summary.columns[0]: "allele_id"})
-
-    # extract relevant columns for the correct assembly and
-    # rename clinicalsignificance, reviewstatus, lastevaluated:
-    variant_summary = variant_summary[
-        variant_summary['assembly'] == genome_build_id]
-    variant_summary = variant_summary[
-        ['allele_id', 'clinicalsignificance', 'reviewstatus','lastevaluated']]
-    variant_summary = variant_summary.rename(
-        columns={'clinicalsignificance': 'clinical_significance',
-                 'reviewstatus': 'review_status',
-                 'lastevaluated':'last_evaluated'})
-
-    # remove the duplicated records in variant summary due to alternative loci such as PAR but would be problematic for rare cases like translocation
-    variant_summary=variant_summary.drop_duplicates()
-    print "variant_summary after filter", variant_summary.shape
-
-    # remove clinical_significance and review_status from clinvar_alleles:
-    clinvar_alleles = clinvar_alleles.drop(
-        ['clinical_significance', 'review_status','last_evaluated'], axis=1)
-
-    # pandas is sensitive to some rows having allele_id joined on ;, causing
-    # an object dtype, with some entries being ints and others strs
-    clinvar_alleles['allele_id'] = clinvar_alleles['allele_id'].astype(str)
-    variant_summary['allele_id'] = variant_summary['allele_id'].astype(str)
-
-    print "clinvar_alleles after filter", clinvar_alleles.shape
-
-    # join the two tables on allele_id:
-    df = pd.merge(clinvar_alleles, variant_summary,
-                  on='allele_id', how='inner')
-    print "merged raw", df.shape
-
-    # map review_status to gold starts:
-    gold_star_map = {
-        'no assertion provided': 0,
-        'no assertion for the individual variant': 0,
-        'no assertion criteria provided': 0,
-        'criteria provided, single submitter': 1,
-        'criteria provided, conflicting interpretations': 1,
-        'criteria provided, multiple submitters, no conflicts': 2,
-        'reviewed by expert panel': 3,
-        'practice guideline': 4,
-        '-':'-'
-    }
-    df['gold_stars'] = df.review_status.map(gold_star_map)
-
-    # The use of expressions on clinical significance on ClinVar aggregate records (RCV) https://www.ncbi.nlm.nih.gov/clinvar/docs/clinsig/#conflicts
-    # conflicted = 1 if using "conflicting"
-    df['conflicted'] = df['clinical_significance'].str.contains(
-        "onflicting", case=False).astype(int)
-
-    # reorder columns just in case
-    df = df.ix[:, FINAL_HEADER]
-    print "merged final", df.shape
-
-    return df
+    """Join a clinvar_alleles table with the variant summary of an assembly, through its index (see
+    variant_summary_index.py), which is built first if it doesn't exist or is out of date."""
+
+    from variant_summary_index import open_variant_summary_index
+
+    variant_summary = open_variant_summary_index(variant_summary_table, genome_build_id)
+    print "variant_summary alleles", len(variant_summary)
+
+    with gzip.open(clinvar_alleles_table) as infile:
+        rows_read, rows_written = join_clinvar_alleles(infile, outfile, variant_summary)
+    variant_summary.close()
+    print "clinvar_alleles rows", rows_read
+    print "merged rows", rows_written
 
 
 if __name__ == "__main__":
@@ -96,7 +177,8 @@ if __name__ == "__main__":
     out_name = sys.argv[3]
     genome_build_id = sys.argv[4]
     assert out_name.endswith('.gz'), ("Provide a filename with .gz extension "
-                                      "as the output will be gzipped")
-    df = join_variant_summary_with_clinvar_alleles(
-        variant_summary_table, clinvar_alleles_table, genome_build_id)
-    df.to_csv(out_name, sep="\t", index=False, compression='gzip')
+                                      "as the output will be bgzipped")
+    outfile = BgzfWriter(open(out_name, 'wb'))
+    join_variant_summary_with_clinvar_alleles(
+        variant_summary_table, clinvar_alleles_table, outfile, genome_build_id)
+    outfile.close()
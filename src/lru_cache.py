@@ -0,0 +1,47 @@
+"""A bounded cache with hit counts, used by the parser (for the trait columns of ClinVarSets) and the normalizer
+(for windows of the reference genome)."""
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Dict with at most max_size items, that drops the least recently used item when it is full, and counts its
+    hits and misses
+
+    Args:
+        max_size: Maximum number of items
+        name: What the cache is called in get_summary
+    """
+
+    def __init__(self, max_size, name='cache'):
+        self.max_size = max_size
+        self.name = name
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.items.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.items[key] = value  # move it to the end, as the most recently used
+        return value
+
+    def put(self, key, value):
+        self.items[key] = value
+        if len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def pop_counts(self):
+        """Return the (hits, misses) since the previous call"""
+        counts = self.hits, self.misses
+        self.hits = self.misses = 0
+        return counts
+
+    def get_summary(self):
+        lookups = self.hits + self.misses
+        return '%.1f%% %s hit rate (%s hits, %s misses)' % (
+            100.0 * self.hits / lookups if lookups else 0, self.name, self.hits, self.misses)
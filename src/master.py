@@ -7,6 +7,7 @@ Run with -h to see all options.
 import configargparse
 from datetime import datetime
 import ftplib
+import multiprocessing
 import os
 import sys
 from distutils import spawn
@@ -32,6 +33,12 @@ g.add("-GE", "--gnomad-exome-sites-vcf",  help="gnomAD exome sites vcf file. If
 g.add("-GG", "--gnomad-genome-sites-vcf",  help="gnomAD genome sites vcf file. If specified, a clinvar table with extra gnomAD genome info fields will also be created.")
 g.add("--output-prefix", default="../output/", help="Final output files will have this prefix")
 g.add("--tmp-dir", default="./output_tmp", help="Temporary output files will have this prefix")
+g.add("--parse-workers", type=int, default=multiprocessing.cpu_count(), help="Number of processes to use for parsing the ClinVar XML")
+g.add("--sort-workers", type=int, default=multiprocessing.cpu_count(), help="Number of processes to sort the chromosomes of a table with")
+g.add("--group-workers", type=int, default=multiprocessing.cpu_count(), help="Number of processes to group the chromosomes of the allele-trait pairs tables with")
+g.add("--annotate-workers", type=int, default=multiprocessing.cpu_count(), help="Number of processes to add the ExAC and gnomAD fields to regions of the clinvar alleles tables with")
+g.add("--sort-memory-mb", type=int, default=1024, help="Memory budget of each sort, above which sorted runs are spilled to the tmp dir")
+g.add("--normalize-in-process", action="store_true", help="Normalize the variants as the XML is parsed, with normalize_variants.py, instead of with normalize.py afterwards. Its output hasn't been compared to normalize.py's on a full table yet, see benchmark.py normalize")
 g = p.add_mutually_exclusive_group()
 g.add("--single-only", dest="single_or_multi", action="store_const", const="single", help="Only generate the single-variant tables")
 g.add("--multi-only", dest="single_or_multi", action="store_const", const="multi", help="Only generate the multi-variant tables")
@@ -50,6 +57,12 @@ gnomad_exome_sites_vcf = args.gnomad_exome_sites_vcf
 gnomad_genome_sites_vcf = args.gnomad_genome_sites_vcf
 clinvar_variant_summary_table = args.clinvar_variant_summary_table
 output_prefix = args.output_prefix
+parse_workers = args.parse_workers
+sort_workers = args.sort_workers
+sort_memory_mb = args.sort_memory_mb
+group_workers = args.group_workers
+annotate_workers = args.annotate_workers
+normalize_in_process = args.normalize_in_process
 
 tmp_dir = args.tmp_dir
 os.system("mkdir -p " + tmp_dir)
@@ -127,22 +140,47 @@ job = pypez.Job()
 
 # normalize (convert to minimal representation and left-align)
 # the normalization code is in a different repo (useful for more than just clinvar) so here I just wget it:
-job.add("wget -N https://raw.githubusercontent.com/ericminikel/minimal_representation/master/normalize.py")
+if not normalize_in_process:
+    job.add("wget -N https://raw.githubusercontent.com/ericminikel/minimal_representation/master/normalize.py")
+
+# extract the GRCh37 and GRCh38 coordinates, mutant allele, MeasureSet ID and PubMed IDs from it in a single pass over
+# the XML. This currently takes about 30 minutes on one core, and scales with --parse-workers. The rows of each
+# ClinVarSet are cached in the tmp dir, so that the next release only needs to parse the ClinVarSets that changed.
+# With --normalize-in-process, the variants are normalized against the reference genome as they are written, see
+# normalize_variants.py.
+parse_command = ("python -u IN:parse_clinvar_xml.py -x IN:%(clinvar_xml)s -w %(parse_workers)s --pipeline "
+                 "-c %(tmp_dir)s/clinvar_set_cache.sqlite ") % locals()
+for genome_build in ('b37', 'b38'):
+    genome_build_id = genome_build.replace('b', 'GRCh')
+    if reference_genomes[genome_build] is not None:
+        reference_genome = reference_genomes[genome_build]
+        table_name = 'clinvar_table_normalized' if normalize_in_process else 'clinvar_table_raw'
+        parse_command += ("-b %(genome_build_id)s "
+                          "OUT:%(tmp_dir)s/%(table_name)s.single.%(genome_build)s.tsv "
+                          "OUT:%(tmp_dir)s/%(table_name)s.multi.%(genome_build)s.tsv ") % locals()
+        if normalize_in_process:
+            parse_command += "-r %(genome_build_id)s IN:%(reference_genome)s " % locals()
+if normalize_in_process:
+    job.add(parse_command, input_filenames=["normalize_variants.py"])
+else:
+    job.add(parse_command)
+
+# index the variant summary of each assembly in one pass, so that the joins below don't have to re-read it. The
+# indexes are kept next to the variant summary, and are only rebuilt when its checksum changes.
+genome_build_ids = [genome_build.replace('b', 'GRCh') for genome_build in ('b37', 'b38') if reference_genomes[genome_build] is not None]
+if genome_build_ids:
+    index_command = "python -u IN:variant_summary_index.py -i IN:%(variant_summary_table)s " % locals()
+    index_command += " ".join("-b %s" % genome_build_id for genome_build_id in genome_build_ids)
+    job.add(index_command, input_filenames=["join_variant_summary_with_clinvar_alleles.py"], output_filenames=[
+        "%s.%s.idx" % (variant_summary_table, genome_build_id) for genome_build_id in genome_build_ids])
 
 for genome_build in ('b37', 'b38'):
-    # extract the GRCh37 coordinates, mutant allele, MeasureSet ID and PubMed IDs from it. This currently takes about 20 minutes.
     genome_build_id = genome_build.replace('b', 'GRCh')
     reference_genome = reference_genomes[genome_build]
     if reference_genome is None:
         print("Skippping steps to generate %s tables since reference genome not given." % genome_build)
         continue
 
-    job.add(("python -u IN:parse_clinvar_xml.py "
-            "-x IN:%(clinvar_xml)s "
-            "-g %(genome_build_id)s "
-            "-o OUT:%(tmp_dir)s/clinvar_table_raw.single.%(genome_build)s.tsv "
-            "-m OUT:%(tmp_dir)s/clinvar_table_raw.multi.%(genome_build)s.tsv") % locals())
-
     for is_multi in (True, False):  # multi = clinvar submission that describes multiple alleles (eg. compound het, haplotypes, etc.)
         single_or_multi = 'multi' if is_multi else 'single'
         if args.single_or_multi and single_or_multi != args.single_or_multi:
@@ -154,14 +192,13 @@ for genome_build in ('b37', 'b38'):
         os.system('mkdir -p ' + output_dir)
 
         # normalize variants  (use grep -v '^$' to remove empty rows)
-        job.add("python -u normalize.py -R IN:%(reference_genome)s < IN:%(tmp_dir)s/clinvar_table_raw.%(fsuffix)s.tsv | grep -v ^$ | bgzip -c > OUT:%(tmp_dir)s/clinvar_table_normalized.%(fsuffix)s.tsv.gz" % locals())
+        if not normalize_in_process:
+            job.add("python -u normalize.py -R IN:%(reference_genome)s < IN:%(tmp_dir)s/clinvar_table_raw.%(fsuffix)s.tsv | grep -v ^$ > OUT:%(tmp_dir)s/clinvar_table_normalized.%(fsuffix)s.tsv" % locals())
 
-        # sort
-        job.add(("cat " +
-            "<(gunzip -c IN:%(tmp_dir)s/clinvar_table_normalized.%(fsuffix)s.tsv.gz | head -1) "  # header row
-            "<(gunzip -c IN:%(tmp_dir)s/clinvar_table_normalized.%(fsuffix)s.tsv.gz | tail -n +2 | egrep -v \"^[XYM]\" | sort -k1,1n -k2,2n -k3,3 -k4,4 ) " + # numerically sort chroms 1-22
-            "<(gunzip -c IN:%(tmp_dir)s/clinvar_table_normalized.%(fsuffix)s.tsv.gz | tail -n +2 | egrep \"^[XYM]\" | sort -k1,1 -k2,2n -k3,3 -k4,4 ) " +  #sort chroms X,Y,M 
-            " | bgzip -c > OUT:%(tmp_dir)s/clinvar_allele_trait_pairs.%(fsuffix)s.tsv.gz") % locals())   # lexicogaraphically sort non-numerical chroms at end
+        # sort by chrom (1-22, X, Y, MT), pos, ref, alt
+        job.add(("python -u IN:sort_table.py -i IN:%(tmp_dir)s/clinvar_table_normalized.%(fsuffix)s.tsv "
+                 "-o OUT:%(tmp_dir)s/clinvar_allele_trait_pairs.%(fsuffix)s.tsv.gz "
+                 "-w %(sort_workers)s -m %(sort_memory_mb)s -T %(tmp_dir)s") % locals())
 
         # tabix and copy to output dir
         job.add("tabix -S 1 -s 1 -b 2 -e 2 IN:%(tmp_dir)s/clinvar_allele_trait_pairs.%(fsuffix)s.tsv.gz" % locals(), output_filenames=["%(tmp_dir)s/clinvar_allele_trait_pairs.%(fsuffix)s.tsv.gz.tbi" % locals()])
@@ -170,25 +207,20 @@ for genome_build in ('b37', 'b38'):
             "%(output_dir)s/clinvar_allele_trait_pairs.%(fsuffix)s.tsv.gz.tbi" % locals()
             ])
 
-        # group by allele, since clinvar_allele_trait_pairs.*.tsv will have more than 1 record for some alleles
-        job.add("python -u IN:group_by_allele.py -i IN:%(tmp_dir)s/clinvar_allele_trait_pairs.%(fsuffix)s.tsv.gz | bgzip -c > OUT:%(tmp_dir)s/clinvar_alleles_grouped.%(fsuffix)s.tsv.gz" % locals())
-
-        # join information from the tab-delimited summary to the normalized genomic coordinates
-        job.add("python IN:join_variant_summary_with_clinvar_alleles.py "
-                "IN:%(variant_summary_table)s "
-                "IN:%(tmp_dir)s/clinvar_alleles_grouped.%(fsuffix)s.tsv.gz "
-                "OUT:%(tmp_dir)s/clinvar_alleles_combined.%(fsuffix)s.tsv.gz "
-                "%(genome_build_id)s" % locals())
-
-        # sort again by genomic coordinates
-        job.add(("cat " +
-            "<(gunzip -c IN:%(tmp_dir)s/clinvar_alleles_combined.%(fsuffix)s.tsv.gz | head -1) "  # header row
-            "<(gunzip -c IN:%(tmp_dir)s/clinvar_alleles_combined.%(fsuffix)s.tsv.gz | tail -n +2 | egrep -v \"^[XYM]\" | sort -k1,1n -k2,2n -k3,3 -k4,4 ) " + # numerically sort chroms 1-22
-            "<(gunzip -c IN:%(tmp_dir)s/clinvar_alleles_combined.%(fsuffix)s.tsv.gz | tail -n +2 | egrep \"^[XYM]\" | sort -k1,1 -k2,2n -k3,3 -k4,4 ) " +  #sort chroms X,Y,M 
-            " | bgzip -c > OUT:%(tmp_dir)s/clinvar_alleles.%(fsuffix)s.tsv.gz") % locals())   # lexicogaraphically sort non-numerical chroms at end
-
-        # tabix and copy to output dir
-        job.add("tabix -S 1 -s 1 -b 2 -e 2 IN:%(tmp_dir)s/clinvar_alleles.%(fsuffix)s.tsv.gz" % locals(), output_filenames=["%(tmp_dir)s/clinvar_alleles.%(fsuffix)s.tsv.gz.tbi" % locals()])
+        # group by allele, since clinvar_allele_trait_pairs.*.tsv will have more than 1 record for some alleles,
+        # and join information from the tab-delimited summary to the normalized genomic coordinates, in one pass.
+        # The chromosomes are grouped in parallel, reading them through the tabix index, and the output is written
+        # sorted by genomic coordinates, as BGZF, and indexed.
+        job.add("python -u IN:group_by_allele.py -i IN:%(tmp_dir)s/clinvar_allele_trait_pairs.%(fsuffix)s.tsv.gz "
+                "-S IN:%(variant_summary_table)s -g %(genome_build_id)s --tabix "
+                "-w %(group_workers)s -T %(tmp_dir)s -o OUT:%(tmp_dir)s/clinvar_alleles.%(fsuffix)s.tsv.gz" % locals(),
+                input_filenames=[
+                    "%(tmp_dir)s/clinvar_allele_trait_pairs.%(fsuffix)s.tsv.gz.tbi" % locals(),
+                    "%(variant_summary_table)s.%(genome_build_id)s.idx" % locals(),
+                    "join_variant_summary_with_clinvar_alleles.py", "variant_summary_index.py"],
+                output_filenames=["%(tmp_dir)s/clinvar_alleles.%(fsuffix)s.tsv.gz.tbi" % locals()])
+
+        # copy to output dir
         job.add("cp IN:%(tmp_dir)s/clinvar_alleles.%(fsuffix)s.tsv.gz IN:%(tmp_dir)s/clinvar_alleles.%(fsuffix)s.tsv.gz.tbi %(output_dir)s/"  % locals(),
                 output_filenames=[
                     "%(output_dir)s/clinvar_alleles.%(fsuffix)s.tsv.gz" % locals(),
@@ -207,20 +239,38 @@ for genome_build in ('b37', 'b38'):
         job.add("gunzip -c IN:%(tmp_dir)s/clinvar_alleles.%(fsuffix)s.tsv.gz | head -n 750 > OUT:%(output_dir)s/clinvar_alleles_example_750_rows.%(fsuffix)s.tsv" % locals())
         job.add("gunzip -c IN:%(tmp_dir)s/clinvar_alleles.%(fsuffix)s.vcf.gz | head -n 750 > OUT:%(output_dir)s/clinvar_alleles_example_750_rows.%(fsuffix)s.vcf" % locals())
 
-        # create tsv table with extra fields from ExAC: filter, ac_adj, an_adj, popmax_ac, popmax_an, popmax
+        # create tsv tables with extra fields from ExAC and gnomAD: filter, ac_adj, an_adj, popmax_ac, popmax_an, popmax
         if genome_build == "b37":
-            for label, vcf_arg, vcf_path in (('gnomad_genomes', '-gg', gnomad_genome_sites_vcf), ('gnomad_exomes', '-ge', gnomad_exome_sites_vcf), ('exac_v1', '-e', exac_sites_vcf)):
-                if not vcf_path:
-                    continue
-                script_name = "add_exac_fields.py" if label == "exac_v1" else "add_gnomad_fields.py"
+            population_sources = [(label, vcf_arg, vcf_path) for label, vcf_arg, vcf_path in (('gnomad_genomes', '-gg', gnomad_genome_sites_vcf), ('gnomad_exomes', '-ge', gnomad_exome_sites_vcf), ('exac_v1', '-e', exac_sites_vcf)) if vcf_path]
+            population_vcf_args = []
+            population_store_filenames = []
+            population_output_filenames = []
+            for label, vcf_arg, vcf_path in population_sources:
                 normalized_vcf = os.path.basename(vcf_path).split('.vcf')[0] + ".normalized.vcf.gz" % locals()
                 job.add(("vt decompose -s IN:%(vcf_path)s | "
                          "vt normalize -r IN:%(reference_genome)s - | "
                          "bgzip -c > OUT:%(tmp_dir)s/%(normalized_vcf)s") % locals())
                 job.add("tabix IN:%(tmp_dir)s/%(normalized_vcf)s" % locals(), output_filenames=["%(tmp_dir)s/%(normalized_vcf)s.tbi" % locals()])
-                job.add(("python -u IN:%(script_name)s -i IN:%(tmp_dir)s/clinvar_alleles.%(fsuffix)s.tsv.gz %(vcf_arg)s IN:%(tmp_dir)s/%(normalized_vcf)s | "
-                         "bgzip -c > OUT:%(tmp_dir)s/clinvar_alleles_with_%(label)s.%(fsuffix)s.tsv.gz") % locals())
-                job.add("tabix -S 1 -s 1 -b 2 -e 2 IN:%(tmp_dir)s/clinvar_alleles_with_%(label)s.%(fsuffix)s.tsv.gz" % locals(), output_filenames=["%(tmp_dir)s/clinvar_alleles_with_%(label)s.%(fsuffix)s.tsv.gz.tbi" % locals()])
+                # extract the fields of the dataset once, into a store that is reused by the single and multi tables
+                job.add("python -u IN:population_store.py -i IN:%(tmp_dir)s/%(normalized_vcf)s -l %(label)s" % locals(),
+                        output_filenames=["%(tmp_dir)s/%(normalized_vcf)s.store/meta.json" % locals()])
+                population_store_filenames.append("%(tmp_dir)s/%(normalized_vcf)s.store/meta.json" % locals())
+                population_vcf_args.append("%(vcf_arg)s IN:%(tmp_dir)s/%(normalized_vcf)s" % locals())
+                population_output_filenames += [
+                    "%(tmp_dir)s/clinvar_alleles_with_%(label)s.%(fsuffix)s.tsv.gz" % locals(),
+                    "%(tmp_dir)s/clinvar_alleles_with_%(label)s.%(fsuffix)s.tsv.gz.tbi" % locals()]
+
+            # one pass over the clinvar table for all the datasets
+            if population_sources:
+                population_vcf_args = " ".join(population_vcf_args)
+                job.add(("python -u IN:add_population_fields.py -i IN:%(tmp_dir)s/clinvar_alleles.%(fsuffix)s.tsv.gz %(population_vcf_args)s "
+                         "-o '%(tmp_dir)s/clinvar_alleles_with_%%(label)s.%(fsuffix)s.tsv.gz' --store --tabix "
+                         "-w %(annotate_workers)s -T %(tmp_dir)s") % locals(),
+                        input_filenames=population_store_filenames + [
+                            "%(tmp_dir)s/clinvar_alleles.%(fsuffix)s.tsv.gz.tbi" % locals(), "population_store.py", "tabix_regions.py"],
+                        output_filenames=population_output_filenames)
+
+            for label, vcf_arg, vcf_path in population_sources:
                 job.add("cp IN:%(tmp_dir)s/clinvar_alleles_with_%(label)s.%(fsuffix)s.tsv.gz IN:%(tmp_dir)s/clinvar_alleles_with_%(label)s.%(fsuffix)s.tsv.gz.tbi %(output_dir)s/" % locals(), output_filenames=[
                     "%(output_dir)s/clinvar_alleles_with_%(label)s.%(fsuffix)s.tsv.gz" % locals(),
                     "%(output_dir)s/clinvar_alleles_with_%(label)s.%(fsuffix)s.tsv.gz.tbi" % locals()])
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+"""Normalize variants: convert them to their minimal representation and left-align them against a reference genome.
+
+This is the vt normalize algorithm (see Tan 2015), as implemented in
+https://github.com/ericminikel/minimal_representation/blob/master/normalize.py, which master.py downloads and runs
+as a separate pass over each table. Here, the reference FASTA is memory-mapped and read through its .fai index, and
+the windows of the reference around recently normalized variants are cached, since ClinVar variants are clustered in
+genes. parse_clinvar_xml.py normalizes its rows as it writes them (see its -r option, and master.py
+--normalize-in-process), and this script normalizes any table with chrom, pos, ref and alt columns:
+
+    python normalize_variants.py -R human_g1k_v37.fasta < clinvar_table_raw.single.b37.tsv > clinvar_table.tsv
+
+Variants with an invalid or wrong REF, or with REF == ALT, are dropped, and counted by reason.
+
+Unlike normalize.py, REF and ALT are uppercased before they are checked, and an indel at the start of a contig is
+extended with the next reference base instead of the preceding one. Its output hasn't been compared to normalize.py's
+on a full table yet (see benchmark.py normalize -c), so master.py still runs normalize.py by default.
+"""
+
+import argparse
+import gzip
+import mmap
+import os
+import sys
+from collections import defaultdict
+
+from lru_cache import LRUCache
+
+REFERENCE_WINDOW_SIZE = 2**16  # number of reference bases per cached window
+REFERENCE_MAX_WINDOWS = 64  # number of windows kept in memory
+
+VALID_NUCLEOTIDES = set('ACGTN-')
+
+
+class NormalizationError(Exception):
+    """Raised when a variant can't be normalized. reason is what the variant is counted as."""
+    reason = 'normalization error'
+
+
+class RefEqualsAltError(NormalizationError):
+    reason = 'REF equal to ALT'
+
+
+class InvalidNucleotideSequenceError(NormalizationError):
+    reason = 'invalid nucleotide sequence'
+
+
+class WrongRefError(NormalizationError):
+    reason = 'REF not matching the reference genome'
+
+
+class UnknownContigError(NormalizationError):
+    reason = 'chromosome not in the reference genome'
+
+
+def get_fai_path(fasta_path):
+    return fasta_path + '.fai'
+
+
+def index_fasta(fasta_path):
+    """Write the .fai index of a FASTA file, like samtools faidx. All lines of a sequence but its last must have the
+    same length."""
+
+    contigs = []
+    with open(fasta_path, 'rb') as fasta:
+        offset = 0
+        contig = None
+        for line in fasta:
+            if line.startswith('>'):
+                contig = [line[1:].split()[0], 0, offset + len(line), None, None]
+                contigs.append(contig)
+            elif contig is not None and line.strip():
+                if contig[3] is None:
+                    contig[3] = len(line.rstrip('\r\n'))
+                    contig[4] = len(line)
+                contig[1] += len(line.rstrip('\r\n'))
+            offset += len(line)
+
+    with open(get_fai_path(fasta_path), 'w') as fai:
+        for name, length, contig_offset, line_bases, line_width in contigs:
+            fai.write('%s\t%d\t%d\t%d\t%d\n' % (name, length, contig_offset, line_bases or 0, line_width or 0))
+
+
+def read_fai(fai_path):
+    """Return a dict that maps each contig of a .fai index to its (length, offset, line_bases, line_width)"""
+
+    contigs = {}
+    with open(fai_path) as fai:
+        for line in fai:
+            fields = line.rstrip('\n').split('\t')
+            contigs[fields[0]] = tuple(int(field) for field in fields[1:5])
+    return contigs
+
+
+class ReferenceGenome(object):
+    """Random access to the sequence of a memory-mapped FASTA file, through its .fai index (which is made if it
+    doesn't exist yet).
+
+    Args:
+        fasta_path: Path of the uncompressed FASTA file
+        window_size: Number of bases per window of the sequence that is cached
+        max_windows: Number of windows to cache. If 0, the sequence is read from the FASTA on every fetch.
+    """
+
+    def __init__(self, fasta_path, window_size=REFERENCE_WINDOW_SIZE, max_windows=REFERENCE_MAX_WINDOWS):
+        if not os.path.isfile(get_fai_path(fasta_path)):
+            index_fasta(fasta_path)
+        self.contigs = read_fai(get_fai_path(fasta_path))
+        self.handle = open(fasta_path, 'rb')
+        self.fasta = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self.window_size = window_size
+        self.windows = LRUCache(max_windows) if max_windows > 0 else None
+        self.last_window_key = self.last_window = None
+
+    def fetch(self, chrom, start, end):
+        """Return the uppercase sequence of chrom from the 0-based start to end (exclusive). Like pysam, the sequence
+        is cut short at the end of the contig."""
+
+        if chrom not in self.contigs:
+            raise UnknownContigError('Chromosome %s not in the reference genome' % chrom)
+        if self.windows is None:
+            return self._read(chrom, start, end)
+
+        start = max(start, 0)
+        if start >= end:
+            return ''
+        first_window = start // self.window_size
+        last_window = (end - 1) // self.window_size
+        offset = first_window * self.window_size
+        if first_window == last_window:
+            return self._get_window(chrom, first_window)[start - offset:end - offset]
+        sequence = ''.join(self._get_window(chrom, i) for i in range(first_window, last_window + 1))
+        return sequence[start - offset:end - offset]
+
+    def close(self):
+        self.fasta.close()
+        self.handle.close()
+
+    def _get_window(self, chrom, i):
+        key = (chrom, i)
+        if key == self.last_window_key:
+            return self.last_window  # consecutive variants are usually in the same window
+
+        window = self.windows.get(key)
+        if window is None:
+            window = self._read(chrom, i * self.window_size, (i + 1) * self.window_size)
+            self.windows.put(key, window)
+        self.last_window_key = key
+        self.last_window = window
+        return window
+
+    def _read(self, chrom, start, end):
+        length, offset, line_bases, line_width = self.contigs[chrom]
+        start = max(start, 0)
+        end = min(end, length)
+        if start >= end:
+            return ''
+        first = offset + start // line_bases * line_width + start % line_bases
+        last = offset + (end - 1) // line_bases * line_width + (end - 1) % line_bases + 1
+        return self.fasta[first:last].replace('\n', '').replace('\r', '').upper()
+
+
+def normalize(reference, chrom, pos, ref, alt):
+    """Convert a variant to its minimal representation, and left-align it.
+
+    Args:
+        reference: ReferenceGenome
+        chrom, pos, ref, alt: The variant, with a 1-based pos. '-' stands for an empty allele.
+
+    Return:
+        The normalized (chrom, pos, ref, alt), with an int pos
+
+    Raises:
+        NormalizationError if the variant is invalid
+    """
+
+    try:
+        pos = int(pos)
+    except ValueError:
+        raise InvalidNucleotideSequenceError('Invalid position: %s %s %s %s' % (chrom, pos, ref, alt))
+    ref = ref.upper()
+    alt = alt.upper()
+    if not set(ref + alt) <= VALID_NUCLEOTIDES:
+        raise InvalidNucleotideSequenceError('Invalid nucleotide sequence: %s %s %s %s' % (chrom, pos, ref, alt))
+    if alt == '-':
+        alt = ''
+    if ref == '-':
+        ref = ''
+
+    reference_ref = reference.fetch(chrom, pos - 1, pos - 1 + len(ref))
+    if ref != reference_ref:
+        raise WrongRefError('Incorrect REF value: %s %s %s %s (actual REF should be %s)' % (
+            chrom, pos, ref, alt, reference_ref))
+    if ref == alt:
+        raise RefEqualsAltError('The REF and ALT allele are the same: %s %s %s %s' % (chrom, pos, ref, alt))
+
+    # SNVs are already minimal
+    if len(ref) == 1 and len(alt) == 1:
+        return chrom, pos, ref, alt
+
+    # trim the last base while it's the same in REF and ALT, and extend both alleles with the preceding reference
+    # base while either of them is empty. This shifts indels to the left through repeats.
+    while True:
+        if ref and alt and ref[-1] == alt[-1]:
+            ref = ref[:-1]
+            alt = alt[:-1]
+        elif not ref or not alt:
+            if pos <= 1:
+                # at the start of the contig, extend with the next reference base instead
+                base = reference.fetch(chrom, pos - 1 + len(ref), pos + len(ref))
+                ref += base
+                alt += base
+                break
+            pos -= 1
+            base = reference.fetch(chrom, pos - 1, pos)
+            ref = base + ref
+            alt = base + alt
+        else:
+            break
+
+    # trim the first base while it's the same in REF and ALT
+    while len(ref) > 1 and len(alt) > 1 and ref[0] == alt[0]:
+        ref = ref[1:]
+        alt = alt[1:]
+        pos += 1
+
+    return chrom, pos, ref, alt
+
+
+def normalize_line(reference, line, skipped_counter, skipped_prefix=''):
+    """Normalize a tab-delimited line whose first 4 columns are chrom, pos, ref, alt (as in parse_clinvar_xml.HEADER).
+
+    Return:
+        The normalized line, or None if the variant was skipped (and counted in skipped_counter)
+    """
+
+    chrom, pos, ref, alt, rest = line.split('\t', 4)
+    try:
+        chrom, pos, ref, alt = normalize(reference, chrom, pos, ref, alt)
+    except NormalizationError, e:
+        skipped_counter[skipped_prefix + e.reason] += 1
+        return None
+    return '%s\t%d\t%s\t%s\t%s' % (chrom, pos, ref, alt, rest)
+
+
+def normalize_clinvar_set_rows(row_batches, references, skipped_counter):
+    """Normalize the rows of the ClinVarSets yielded by one of the parse_clinvar_xml.iter_*_rows functions.
+
+    Args:
+        row_batches: Iterator over the list of (genome_build, is_multi, row) tuples of each ClinVarSet
+        references: dict that maps genome builds to a ReferenceGenome. The rows of the other builds are not
+            normalized.
+        skipped_counter: defaultdict(int) that counts the rows that were dropped, by genome build and reason
+
+    Yield:
+        The list of normalized (genome_build, is_multi, row) tuples of each ClinVarSet
+    """
+
+    for rows in row_batches:
+        normalized_rows = []
+        for genome_build, is_multi, row in rows:
+            if genome_build in references:
+                row = normalize_line(references[genome_build], row, skipped_counter, genome_build + ' ')
+                if row is None:
+                    continue
+            normalized_rows.append((genome_build, is_multi, row))
+        yield normalized_rows
+
+
+def normalize_table(infile, outfile, reference, skipped_counter):
+    """Normalize a tab-delimited table with a header, whose first 4 columns are chrom, pos, ref and alt.
+
+    Return:
+        The number of rows written
+    """
+
+    header = next(infile)
+    if header.split('\t')[:4] != ['chrom', 'pos', 'ref', 'alt']:
+        raise ValueError("Expected the first columns to be chrom, pos, ref, alt. Found: %s" % header.strip())
+    outfile.write(header)
+
+    counter = 0
+    for line in infile:
+        if not line.strip():
+            continue
+        line = normalize_line(reference, line, skipped_counter)
+        if line is not None:
+            outfile.write(line)
+            counter += 1
+
+    return counter
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert variants to their minimal representation and left-align '
+                                                 'them. Variants that fail validation are dropped.')
+    parser.add_argument('-R', '--reference-sequence', required=True,
+                        help='Reference genome FASTA (uncompressed). Its .fai index is made if needed.')
+    parser.add_argument('-i', '--input', help='Tab-delimited table (may be gzipped). Default: stdin')
+    parser.add_argument('-o', '--output', type=argparse.FileType('w'), default=sys.stdout)
+    args = parser.parse_args()
+
+    if args.input is None:
+        infile = sys.stdin
+    elif args.input.endswith('.gz'):
+        infile = gzip.open(args.input)
+    else:
+        infile = open(args.input)
+
+    reference = ReferenceGenome(args.reference_sequence)
+    skipped_counter = defaultdict(int)
+    counter = normalize_table(infile, args.output, reference, skipped_counter)
+    reference.close()
+
+    sys.stderr.write("%s variants normalized, %s\n" % (
+        counter, ', '.join('%s skipped due to %s' % (v, k) for k, v in sorted(skipped_counter.items()))))
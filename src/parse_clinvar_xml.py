@@ -1,12 +1,32 @@
 #!/usr/bin/env python
 
+import os
 import re
 import sys
 import gzip
+import json
+import sqlite3
+import hashlib
 import argparse
-from collections import defaultdict
+import itertools
+import subprocess
+import multiprocessing
+import time
+from collections import defaultdict, deque, namedtuple
+from io import BytesIO
 import xml.etree.ElementTree as ET
 
+from bgzf import BgzfReader
+from lru_cache import LRUCache
+from normalize_variants import ReferenceGenome, normalize_clinvar_set_rows
+from pipeline import ReaderThread, WriterThread
+from table_record import make_record_class
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
 # then sort it: cat clinvar_table.tsv | head -1 > clinvar_table_sorted.tsv; cat clinvar_table.tsv | tail -n +2 | sort  -k1,1 -k2,2n -k3,3 -k4,4 >> clinvar_table_sorted.tsv Reference on clinvar XML tag:
 # ftp://ftp.ncbi.nlm.nih.gov/pub/clinvar/clinvar_submission.xsd Reference on clinvar XML tag:
 # ftp://ftp.ncbi.nlm.nih.gov/pub/clinvar/tab_delimited/README
@@ -24,6 +44,24 @@ HEADER = ['chrom', 'pos', 'ref', 'alt', 'start', 'stop', 'strand', 'variation_ty
           'all_pmids', 'inheritance_modes', 'age_of_onset', 'prevalence',
           'disease_mechanism', 'origin', 'xrefs', 'dates_ordered']
 
+ClinvarRecord = make_record_class(HEADER, 'ClinvarRecord')
+
+GENOME_BUILDS = ['GRCh37', 'GRCh38']
+
+CLINVAR_SET_START = b'<ClinVarSet'
+CLINVAR_SET_END = b'</ClinVarSet>'
+
+TRAIT_ATTRIBUTE_COLUMNS = {'ModeOfInheritance': 'inheritance_modes', 'age of onset': 'age_of_onset',
+                           'prevalence': 'prevalence', 'disease mechanism': 'disease_mechanism'}
+
+TRAIT_COLUMNS_CACHE_SIZE = 10000  # max number of distinct trait columns kept by TRAIT_COLUMNS_CACHE
+
+PIPELINE_BATCH_SIZE = 1000  # rows per batch handed to the writer thread
+
+RCV_ACCESSION_REGEX = re.compile(br'<ClinVarAccession\s[^>]*Type="RCV"[^>]*>')
+ACC_ATTRIBUTE_REGEX = re.compile(br'\sAcc="([^"]*)"')
+VERSION_ATTRIBUTE_REGEX = re.compile(br'\sVersion="([^"]*)"')
+
 
 def replace_semicolons(s, replace_with=":"):
     return s.replace(";", replace_with)
@@ -33,205 +71,418 @@ def remove_newlines_and_tabs(s):
     return re.sub("[\t\n\r]", " ", s)
 
 
-def parse_clinvar_tree(handle, dest=sys.stdout, multi=None, verbose=True, genome_build='GRCh37'):
-    """Parse clinvar XML
+def format_list_column(column_value):
+    """Format the values of a list column. Sets are sorted to get a deterministic order."""
+    column_value = column_value if type(column_value) == list else sorted(column_value)
+    return remove_newlines_and_tabs(';'.join(map(replace_semicolons, column_value)))
+
+
+# many RCVs have the same traits (eg. "not specified"), so the trait columns are only computed once for each distinct
+# set of trait values, per process
+TRAIT_COLUMNS_CACHE = LRUCache(TRAIT_COLUMNS_CACHE_SIZE, 'trait cache')
+
+
+def get_trait_columns(trait_names, trait_attributes, trait_xrefs):
+    """Compute the columns that are derived from the TraitSets of a ClinVarSet.
+
     Args:
-        handle: Open input file handle for reading the XML data
-        dest: Open output file handle or stream for simple variants
-        multi: Open output file handle or stream for complex non-single-variant clinvar records
-            (eg. compound het, haplotypes, etc.)
-        verbose: Whether to write extra stats to stderr
-        genome_build: Either 'GRCh37' or 'GRCh38'
+        trait_names: Tuple of the Preferred trait names
+        trait_attributes: Tuple of the (Type, text) of the trait attributes whose Type is in TRAIT_ATTRIBUTE_COLUMNS
+        trait_xrefs: Tuple of the (DB, ID) of the trait XRefs
+
+    Return:
+        dict with the formatted all_traits, inheritance_modes, age_of_onset, prevalence, disease_mechanism and xrefs
+        columns
     """
 
-    # variation -> rcv (one to many)
+    columns = {'all_traits': list(trait_names), 'xrefs': set()}
+    for column_name in TRAIT_ATTRIBUTE_COLUMNS.values():
+        columns[column_name] = set()
 
-    dest.write(('\t'.join(HEADER) + '\n').encode('utf-8'))
-    if multi is not None:
-        multi.write(('\t'.join(HEADER) + '\n').encode('utf-8'))
+    for attribute_type, attribute_text in trait_attributes:
+        column_value = attribute_text.strip()
+        if column_value:
+            columns[TRAIT_ATTRIBUTE_COLUMNS[attribute_type]].add(column_value)
 
-    scounter = 0
-    mcounter = 0
-    skipped_counter = defaultdict(int)
-    for event, elem in ET.iterparse(handle):
-        if elem.tag != 'ClinVarSet' or event != 'end':
-            continue
+    # put all the cross references one column, it may contains NCBI gene ID, conditions ID in disease databases.
+    for xref_db, xref_id in trait_xrefs:
+        columns['xrefs'].add("%s:%s" % (xref_db, xref_id))
 
-        # initialize all the fields
-        current_row = {}
-        current_row['rcv'] = ''
-        current_row['variation_type'] = ''
-        current_row['variation_id'] = ''
-        current_row['allele_id'] = ''
+    for column_name in columns:
+        columns[column_name] = format_list_column(columns[column_name])
 
-        rcv = elem.find('./ReferenceClinVarAssertion/ClinVarAccession')
-        if rcv.attrib.get('Type') != 'RCV':
-            print("Error, not RCV record")
-            break
-        else:
-            current_row['rcv'] = rcv.attrib.get('Acc')
+    return columns
 
-        ReferenceClinVarAssertion = elem.findall(".//ReferenceClinVarAssertion")
-        measureset = ReferenceClinVarAssertion[0].findall(".//MeasureSet")
 
-        # only the ones with just one measure set can be recorded
-        if len(measureset) > 1:
-            print("A submission has more than one measure set." + elem.find('./Title').text)
-            elem.clear()
-            continue
-        elif len(measureset) == 0:
-            print("A submission has no measure set type" + measureset.attrib.get('ID'))
-            elem.clear()
-            continue
+def etree_findall(node, path):
+    return node.findall(path)
 
-        measureset = measureset[0]
 
-        measure = measureset.findall('.//Measure')
+def find_clinvar_set_nodes(elem, findall=etree_findall):
+    """Find the nodes of a ClinVarSet that parse_clinvar_set reads, with one findall(..) per kind of node.
 
-        current_row['variation_id'] = measureset.attrib.get('ID')
-        current_row['variation_type'] = measureset.get('Type')
+    With ElementTree, this is the straightforward but slow version of walk_clinvar_set_nodes, as each
+    findall('.//..') traverses the whole ClinVarSet subtree again. The lxml engine runs the same queries as
+    compiled XPath expressions (see xpath_clinvar_set_nodes).
 
-        # find all scv accession number
-        scv_number = []
-        for scv in elem.findall('.//ClinVarAssertion/ClinVarAccession'):
-            if scv.attrib.get('Type') == "SCV":
-                scv_number.append(scv.attrib.get('Acc'))
+    Args:
+        elem: ClinVarSet element
+        findall: function(node, path) that returns the list of nodes matching path, in document order
+
+    Return:
+        dict with the same keys as walk_clinvar_set_nodes
+    """
+
+    nodes = {}
+    nodes['reference_assertions'] = findall(elem, './/ReferenceClinVarAssertion')
+    nodes['measure_sets'] = findall(nodes['reference_assertions'][0], './/MeasureSet') if nodes['reference_assertions'] else []
+    nodes['measure_set_names'] = []
+    nodes['measures'] = []
+    if len(nodes['measure_sets']) == 1:
+        nodes['measure_set_names'] = findall(nodes['measure_sets'][0], './/Name/ElementValue')[:1]
+        for measure in findall(nodes['measure_sets'][0], './/Measure'):
+            nodes['measures'].append({
+                'measure': measure,
+                'sequence_locations': findall(measure, './/SequenceLocation'),
+                'relationships': findall(measure, './/MeasureRelationship'),
+                'attribute_sets': findall(measure, './AttributeSet'),
+            })
+
+    nodes['scv_accessions'] = findall(elem, './/ClinVarAssertion/ClinVarAccession')
+    nodes['citation_ids'] = [id_node for citation in findall(elem, './/Citation') for id_node in findall(citation, './/ID')]
+    nodes['comments'] = findall(elem, './/Comment')
+    nodes['submission_ids'] = findall(elem, './/ClinVarSubmissionID')
+    nodes['rcv_significance'] = (findall(elem, './/ReferenceClinVarAssertion/ClinicalSignificance') or [None])[0]
+    nodes['scv_significances'] = findall(elem, './/ClinVarAssertion/ClinicalSignificance')
+    nodes['scv_review_statuses'] = findall(elem, './/ClinVarAssertion/ClinicalSignificance/ReviewStatus')
+    nodes['scv_descriptions'] = findall(elem, './/ClinVarAssertion/ClinicalSignificance/Description')
+
+    nodes['trait_names'] = []
+    nodes['trait_attributes'] = []
+    nodes['trait_xrefs'] = []
+    for traitset in findall(elem, './/TraitSet'):
+        nodes['trait_names'] += findall(traitset, './/Name/ElementValue')
+        nodes['trait_attributes'] += findall(traitset, './/AttributeSet/Attribute')
+        nodes['trait_xrefs'] += findall(traitset, './/XRef')
+
+    nodes['origins'] = findall(elem, './/ReferenceClinVarAssertion/ObservedIn/Sample/Origin')
+
+    return nodes
+
+
+def walk_clinvar_set_nodes(elem):
+    """Collect the nodes of a ClinVarSet that parse_clinvar_set reads in a single walk over its subtree, routing
+    each element to the node lists by its tag and ancestors. Equivalent to find_clinvar_set_nodes, but much faster.
+
+    Args:
+        elem: ClinVarSet element
+
+    Return:
+        dict of the nodes, in document order:
+            reference_assertions: .//ReferenceClinVarAssertion
+            measure_sets: .//MeasureSet under the first ReferenceClinVarAssertion
+            measure_set_names: .//Name/ElementValue under the measure set (only the first one is used)
+            measures: a dict for each .//Measure under the measure set, with the Measure element ('measure'),
+                its .//SequenceLocation ('sequence_locations'), .//MeasureRelationship ('relationships'),
+                and ./AttributeSet ('attribute_sets') nodes
+            scv_accessions: .//ClinVarAssertion/ClinVarAccession
+            citation_ids: .//Citation//ID
+            comments: .//Comment
+            submission_ids: .//ClinVarSubmissionID
+            rcv_significance: the first .//ReferenceClinVarAssertion/ClinicalSignificance, or None
+            scv_significances: .//ClinVarAssertion/ClinicalSignificance
+            scv_review_statuses: .//ClinVarAssertion/ClinicalSignificance/ReviewStatus
+            scv_descriptions: .//ClinVarAssertion/ClinicalSignificance/Description
+            trait_names, trait_attributes, trait_xrefs: .//Name/ElementValue, .//AttributeSet/Attribute and
+                .//XRef under each .//TraitSet
+            origins: .//ReferenceClinVarAssertion/ObservedIn/Sample/Origin
+    """
+
+    nodes = {
+        'reference_assertions': [], 'measure_sets': [], 'measure_set_names': [], 'measures': [],
+        'scv_accessions': [], 'citation_ids': [], 'comments': [], 'submission_ids': [],
+        'rcv_significance': None, 'scv_significances': [], 'scv_review_statuses': [], 'scv_descriptions': [],
+        'trait_attributes': [], 'trait_xrefs': [], 'origins': [],
+    }
+    traitset_names = []  # a list of .//Name/ElementValue nodes per TraitSet
+    open_traitset_names = []  # the lists in traitset_names of the TraitSets that enclose the current node
+    open_measures = []  # the dicts in nodes['measures'] of the Measures that enclose the current node
+    path = [elem.tag]  # tags of the current node and its ancestors
+
+    def visit(node, in_first_rca, in_measure_set, in_citation):
+        tag = node.tag
+        parent_tag = path[-1]
+        path.append(tag)
+        opened_traitset = opened_measure = False
+
+        if tag == 'ReferenceClinVarAssertion':
+            nodes['reference_assertions'].append(node)
+            in_first_rca = in_first_rca or len(nodes['reference_assertions']) == 1
+        elif tag == 'MeasureSet':
+            if in_first_rca:
+                nodes['measure_sets'].append(node)
+                in_measure_set = True
+        elif tag == 'Measure':
+            if in_measure_set:
+                measure = {'measure': node, 'sequence_locations': [], 'relationships': [], 'attribute_sets': []}
+                nodes['measures'].append(measure)
+                open_measures.append(measure)
+                opened_measure = True
+        elif tag == 'SequenceLocation':
+            for measure in open_measures:
+                measure['sequence_locations'].append(node)
+        elif tag == 'MeasureRelationship':
+            for measure in open_measures:
+                measure['relationships'].append(node)
+        elif tag == 'AttributeSet':
+            if parent_tag == 'Measure' and open_measures:
+                open_measures[-1]['attribute_sets'].append(node)
+        elif tag == 'ClinVarAccession':
+            if parent_tag == 'ClinVarAssertion':
+                nodes['scv_accessions'].append(node)
+        elif tag == 'Citation':
+            in_citation = True
+        elif tag == 'ID':
+            if in_citation:
+                nodes['citation_ids'].append(node)
+        elif tag == 'Comment':
+            nodes['comments'].append(node)
+        elif tag == 'ClinVarSubmissionID':
+            nodes['submission_ids'].append(node)
+        elif tag == 'ClinicalSignificance':
+            if parent_tag == 'ReferenceClinVarAssertion':
+                if nodes['rcv_significance'] is None:
+                    nodes['rcv_significance'] = node
+            elif parent_tag == 'ClinVarAssertion':
+                nodes['scv_significances'].append(node)
+        elif tag == 'ReviewStatus' or tag == 'Description':
+            if parent_tag == 'ClinicalSignificance' and path[-3] == 'ClinVarAssertion':
+                nodes['scv_review_statuses' if tag == 'ReviewStatus' else 'scv_descriptions'].append(node)
+        elif tag == 'TraitSet':
+            names = []
+            traitset_names.append(names)
+            open_traitset_names.append(names)
+            opened_traitset = True
+        elif tag == 'ElementValue':
+            if parent_tag == 'Name':
+                for names in open_traitset_names:
+                    names.append(node)
+                if in_measure_set:
+                    nodes['measure_set_names'].append(node)
+        elif tag == 'Attribute':
+            if parent_tag == 'AttributeSet' and open_traitset_names:
+                nodes['trait_attributes'].append(node)
+        elif tag == 'XRef':
+            if open_traitset_names:
+                nodes['trait_xrefs'].append(node)
+        elif tag == 'Origin':
+            if path[-4:-1] == ['ReferenceClinVarAssertion', 'ObservedIn', 'Sample']:
+                nodes['origins'].append(node)
+
+        for child in node:
+            visit(child, in_first_rca, in_measure_set, in_citation)
+
+        path.pop()
+        if opened_traitset:
+            open_traitset_names.pop()
+        if opened_measure:
+            open_measures.pop()
+
+    for child in elem:
+        visit(child, False, False, False)
+
+    nodes['trait_names'] = [name for names in traitset_names for name in names]
+
+    return nodes
+
+
+LXML_XPATHS = {}  # path -> compiled lxml.etree.XPath
+
+
+def lxml_findall(node, path):
+    """findall for find_clinvar_set_nodes that evaluates path as an XPath expression, compiled once per path"""
+
+    xpath = LXML_XPATHS.get(path)
+    if xpath is None:
+        xpath = LXML_XPATHS[path] = lxml_etree.XPath(path)
+    return xpath(node)
+
+
+def xpath_clinvar_set_nodes(elem):
+    """find_clinvar_set_nodes for lxml elements, with compiled XPath expressions instead of findall"""
+
+    return find_clinvar_set_nodes(elem, findall=lxml_findall)
+
+
+def parse_clinvar_set(elem, genome_builds, skipped_counter, collect_nodes=walk_clinvar_set_nodes):
+    """Extract the table rows for one ClinVarSet element. The columns that don't depend on the genome build are
+    only computed once, however many genome builds are requested.
+
+    Args:
+        elem: ClinVarSet element
+        genome_builds: List of genome builds ('GRCh37' and/or 'GRCh38') to extract the variant locations for
+        skipped_counter: defaultdict(int) that counts the reasons why variants were skipped
+        collect_nodes: function that returns the nodes of the ClinVarSet that are needed to build the rows
+            (walk_clinvar_set_nodes or find_clinvar_set_nodes, or xpath_clinvar_set_nodes for lxml elements)
+
+    Return:
+        A list of (genome_build, is_multi, row) tuples, one per allele and genome build, where row is a
+        tab-delimited line in HEADER order and is_multi is True for complex non-single-variant clinvar records.
+        None if the ClinVarSet isn't an RCV record, which ends the parse.
+    """
 
-        current_row['scv'] = ';'.join(set(scv_number))
+    rows = []
 
-        # find all the Citation nodes, and get the PMIDs out of them
-        pmids = []
-        for citation in elem.findall('.//Citation'):
-            pmids += [id_node.text for id_node in citation.findall('.//ID') if id_node.attrib.get('Source') == 'PubMed']
+    # initialize all the fields to ''
+    current_row = ClinvarRecord()
 
-        # now find the Comment nodes, regex your way through the comments and extract anything that appears to be a PMID
-        comment_pmids = []
-        for comment in elem.findall('.//Comment'):
-            mentions_pubmed = re.search(mentions_pubmed_regex, comment.text)
-            if mentions_pubmed is not None and mentions_pubmed.group(1) is not None:
-                remaining_text = mentions_pubmed.group(1)
-                while True:
-                    pubmed_id_extraction = re.search(extract_pubmed_id_regex, remaining_text)
-                    if pubmed_id_extraction is None:
+    rcv = elem.find('./ReferenceClinVarAssertion/ClinVarAccession')
+    if rcv.attrib.get('Type') != 'RCV':
+        print("Error, not RCV record")
+        return None
+    else:
+        current_row['rcv'] = rcv.attrib.get('Acc')
+
+    nodes = collect_nodes(elem)
+    measureset = nodes['measure_sets']
+
+    # only the ones with just one measure set can be recorded
+    if len(measureset) > 1:
+        print("A submission has more than one measure set." + elem.find('./Title').text)
+        elem.clear()
+        return []
+    elif len(measureset) == 0:
+        print("A submission has no measure set type" + measureset.attrib.get('ID'))
+        elem.clear()
+        return []
+
+    measureset = measureset[0]
+
+    measure = nodes['measures']
+
+    current_row['variation_id'] = measureset.attrib.get('ID')
+    current_row['variation_type'] = measureset.get('Type')
+
+    # find all scv accession number
+    scv_number = []
+    for scv in nodes['scv_accessions']:
+        if scv.attrib.get('Type') == "SCV":
+            scv_number.append(scv.attrib.get('Acc'))
+
+    current_row['scv'] = ';'.join(set(scv_number))
+
+    # find all the Citation nodes, and get the PMIDs out of them
+    pmids = [id_node.text for id_node in nodes['citation_ids'] if id_node.attrib.get('Source') == 'PubMed']
+
+    # now find the Comment nodes, regex your way through the comments and extract anything that appears to be a PMID
+    comment_pmids = []
+    for comment in nodes['comments']:
+        mentions_pubmed = re.search(mentions_pubmed_regex, comment.text)
+        if mentions_pubmed is not None and mentions_pubmed.group(1) is not None:
+            remaining_text = mentions_pubmed.group(1)
+            while True:
+                pubmed_id_extraction = re.search(extract_pubmed_id_regex, remaining_text)
+                if pubmed_id_extraction is None:
+                    break
+                elif pubmed_id_extraction.group(1) is not None:
+                    comment_pmids.append(pubmed_id_extraction.group(1))
+                    if pubmed_id_extraction.group(2) is not None:
+                        remaining_text = pubmed_id_extraction.group(2)
+
+    current_row['all_pmids'] = ';'.join(sorted(set(pmids + comment_pmids)))
+
+    # now find any/all submitters
+    submitters_ordered = []
+    for submitter_node in nodes['submission_ids']:
+        if submitter_node.attrib is not None and submitter_node.attrib.has_key('submitter'):
+            submitters_ordered.append(submitter_node.attrib['submitter'].replace(';', ','))
+
+    # all_submitters will get deduplicated while submitters_ordered won't
+    current_row['submitters_ordered'] = ';'.join(submitters_ordered)
+    current_row['all_submitters'] = ";".join(set(submitters_ordered))
+
+    # find the clincial significance and review status reported in RCV(aggregated from SCV)
+    current_row['clinical_significance'] = []
+    current_row['review_status'] = []
+
+    clinical_significance = nodes['rcv_significance']
+    if clinical_significance.find('.//ReviewStatus') is not None:
+        current_row['review_status'] = clinical_significance.find('.//ReviewStatus').text;
+    if clinical_significance.find('.//Description') is not None:
+        current_row['clinical_significance'] = clinical_significance.find('.//Description').text
+
+    current_row['last_evaluated'] = '0000-00-00'
+    if clinical_significance.attrib.get('DateLastEvaluated') is not None:
+        current_row['last_evaluated'] = clinical_significance.attrib.get('DateLastEvaluated', '0000-00-00')
+
+    # match the order of the submitter list - edit 2/22/17
+    current_row['review_status_ordered'] = ';'.join([
+        x.text for x in nodes['scv_review_statuses'] if x is not None
+    ])
+
+    list_significance= [
+        x.text.lower() for x in nodes['scv_descriptions'] if x is not None
+    ]
+
+    current_row['pathogenic'] = str(list_significance.count("pathogenic"))
+    current_row['likely_pathogenic'] = str(list_significance.count("likely pathogenic"))
+    current_row['uncertain_significance']=str(list_significance.count("uncertain significance"))
+    current_row['benign']=str(list_significance.count("benign"))
+    current_row['likely_benign']=str(list_significance.count("likely benign"))
+
+    current_row['clinical_significance_ordered'] = ";".join(list_significance)
+
+    current_row['dates_ordered'] = ';'.join([
+        x.attrib.get('DateLastEvaluated', '0000-00-00')
+        for x in nodes['scv_significances']
+        if x is not None
+    ])
+
+    # now find the disease(s) this variant is associated with, and their attributes and cross references
+    trait_key = (
+        tuple(node.text for node in nodes['trait_names']
+              if node.attrib is not None and node.attrib.get('Type') == 'Preferred'),
+        tuple((node.attrib.get('Type'), node.text) for node in nodes['trait_attributes']
+              if node.attrib.get('Type') in TRAIT_ATTRIBUTE_COLUMNS),
+        tuple((node.attrib.get('DB'), node.attrib.get('ID')) for node in nodes['trait_xrefs']),
+    )
+    trait_columns = TRAIT_COLUMNS_CACHE.get(trait_key)
+    if trait_columns is None:
+        trait_columns = get_trait_columns(*trait_key)
+        TRAIT_COLUMNS_CACHE.put(trait_key, trait_columns)
+    current_row.update(trait_columns)
+
+    current_row['origin'] = set()
+    for origin in nodes['origins']:
+        current_row['origin'].add(origin.text)
+    current_row['origin'] = format_list_column(current_row['origin'])
+
+    current_row['symbol'] = ''
+    var_name = nodes['measure_set_names'][0].text
+    if var_name is not None:
+        match = re.search(r"\(([A-Za-z0-9]+)\)", var_name)
+        if match is not None:
+            genesymbol = match.group(1)
+            current_row['symbol'] = genesymbol
+
+    for i in range(len(measure)):
+
+        if current_row['symbol'] is None:
+            genesymbol = measure[i]['measure'].findall('.//Symbol')
+            if genesymbol is not None:
+                for symbol in genesymbol:
+                    if (symbol.find('ElementValue').attrib.get('Type') == 'Preferred'):
+                        current_row['symbol'] = symbol.find('ElementValue').text;
                         break
-                    elif pubmed_id_extraction.group(1) is not None:
-                        comment_pmids.append(pubmed_id_extraction.group(1))
-                        if pubmed_id_extraction.group(2) is not None:
-                            remaining_text = pubmed_id_extraction.group(2)
-
-        current_row['all_pmids'] = ';'.join(sorted(set(pmids + comment_pmids)))
-
-        # now find any/all submitters
-        submitters_ordered = []
-        for submitter_node in elem.findall('.//ClinVarSubmissionID'):
-            if submitter_node.attrib is not None and submitter_node.attrib.has_key('submitter'):
-                submitters_ordered.append(submitter_node.attrib['submitter'].replace(';', ','))
-
-        # all_submitters will get deduplicated while submitters_ordered won't
-        current_row['submitters_ordered'] = ';'.join(submitters_ordered)
-        current_row['all_submitters'] = ";".join(set(submitters_ordered))
-
-        # find the clincial significance and review status reported in RCV(aggregated from SCV)
-        current_row['clinical_significance'] = []
-        current_row['review_status'] = []
-
-        clinical_significance = elem.find('.//ReferenceClinVarAssertion/ClinicalSignificance')
-        if clinical_significance.find('.//ReviewStatus') is not None:
-            current_row['review_status'] = clinical_significance.find('.//ReviewStatus').text;
-        if clinical_significance.find('.//Description') is not None:
-            current_row['clinical_significance'] = clinical_significance.find('.//Description').text
-
-        current_row['last_evaluated'] = '0000-00-00'
-        if clinical_significance.attrib.get('DateLastEvaluated') is not None:
-            current_row['last_evaluated'] = clinical_significance.attrib.get('DateLastEvaluated', '0000-00-00')
-
-        # match the order of the submitter list - edit 2/22/17
-        current_row['review_status_ordered'] = ';'.join([
-            x.text for x in elem.findall('.//ClinVarAssertion/ClinicalSignificance/ReviewStatus') if x is not None
-        ])
-
-        list_significance= [
-            x.text.lower() for x in elem.findall('.//ClinVarAssertion/ClinicalSignificance/Description') if x is not None
-        ]
-
-        current_row['pathogenic'] = str(list_significance.count("pathogenic"))
-        current_row['likely_pathogenic'] = str(list_significance.count("likely pathogenic"))
-        current_row['uncertain_significance']=str(list_significance.count("uncertain significance"))
-        current_row['benign']=str(list_significance.count("benign"))
-        current_row['likely_benign']=str(list_significance.count("likely benign"))
-
-        current_row['clinical_significance_ordered'] = ";".join(list_significance)
-
-        current_row['dates_ordered'] = ';'.join([
-            x.attrib.get('DateLastEvaluated', '0000-00-00')
-            for x in elem.findall('.//ClinVarAssertion/ClinicalSignificance')
-            if x is not None
-        ])
-
-        # init new fields
-        for list_column in ('inheritance_modes', 'age_of_onset', 'prevalence', 'disease_mechanism', 'xrefs'):
-            current_row[list_column] = set()
-
-        # now find the disease(s) this variant is associated with
-        current_row['all_traits'] = []
-        for traitset in elem.findall('.//TraitSet'):
-            disease_name_nodes = traitset.findall('.//Name/ElementValue')
-            trait_values = []
-            for disease_name_node in disease_name_nodes:
-                if disease_name_node.attrib is not None and disease_name_node.attrib.get('Type') == 'Preferred':
-                    trait_values.append(disease_name_node.text)
-            current_row['all_traits'] += trait_values
-
-            for attribute_node in traitset.findall('.//AttributeSet/Attribute'):
-                attribute_type = attribute_node.attrib.get('Type')
-                if attribute_type in {'ModeOfInheritance', 'age of onset', 'prevalence', 'disease mechanism'}:
-                    column_name = 'inheritance_modes' if attribute_type == 'ModeOfInheritance' else attribute_type.replace(
-                        ' ', '_')
-                    column_value = attribute_node.text.strip()
-                    if column_value:
-                        current_row[column_name].add(column_value)
-
-                        # put all the cross references one column, it may contains NCBI gene ID, conditions ID in disease databases.
-            for xref_node in traitset.findall('.//XRef'):
-                xref_db = xref_node.attrib.get('DB')
-                xref_id = xref_node.attrib.get('ID')
-                current_row['xrefs'].add("%s:%s" % (xref_db, xref_id))
-
-        current_row['origin'] = set()
-        for origin in elem.findall('.//ReferenceClinVarAssertion/ObservedIn/Sample/Origin'):
-            current_row['origin'].add(origin.text)
-
-        for column_name in (
-                'all_traits', 'inheritance_modes', 'age_of_onset', 'prevalence', 'disease_mechanism', 'origin',
-                'xrefs'):
-            column_value = current_row[column_name] if type(current_row[column_name]) == list else sorted(
-                current_row[column_name])  # sort columns of type 'set' to get deterministic order
-            current_row[column_name] = remove_newlines_and_tabs(';'.join(map(replace_semicolons, column_value)))
-
-        current_row['symbol'] = ''
-        var_name = measureset.find(".//Name/ElementValue").text
-        if var_name is not None:
-            match = re.search(r"\(([A-Za-z0-9]+)\)", var_name)
-            if match is not None:
-                genesymbol = match.group(1)
-                current_row['symbol'] = genesymbol
-
-        for i in range(len(measure)):
-
-            if current_row['symbol'] is None:
-                genesymbol = measure[i].findall('.//Symbol')
-                if genesymbol is not None:
-                    for symbol in genesymbol:
-                        if (symbol.find('ElementValue').attrib.get('Type') == 'Preferred'):
-                            current_row['symbol'] = symbol.find('ElementValue').text;
-                            break
 
-            # find the allele ID (//Measure/@ID)
-            current_row['allele_id'] = measure[i].attrib.get('ID')
-            # find the GRCh37 or GRCh38 VCF representation
+        # find the allele ID (//Measure/@ID)
+        current_row['allele_id'] = measure[i]['measure'].attrib.get('ID')
+        # find the GRCh37 and/or GRCh38 VCF representation
+        genomic_locations = []
+        for genome_build in genome_builds:
             genomic_location = None
 
-            for sequence_location in measure[i].findall(".//SequenceLocation"):
+            for sequence_location in measure[i]['sequence_locations']:
                 if sequence_location.attrib.get('Assembly') == genome_build:
                     if all(sequence_location.attrib.get(key) is not None for key in
                            ('Chr', 'start', 'referenceAllele', 'alternateAllele')):
@@ -240,10 +491,43 @@ def parse_clinvar_tree(handle, dest=sys.stdout, multi=None, verbose=True, genome
             # break after finding the first non-empty GRCh37 or GRCh38 location
 
             if genomic_location is None:
-                skipped_counter['missing SequenceLocation'] += 1
-                elem.clear()
+                skipped_counter['missing %s SequenceLocation' % genome_build] += 1
                 continue  # don't bother with variants that don't have a VCF location
 
+            genomic_locations.append((genome_build, genomic_location))
+
+        if not genomic_locations:
+            elem.clear()
+            continue
+
+        current_row['molecular_consequence'] = set()
+        current_row['hgvs_c'] = ''
+        current_row['hgvs_p'] = ''
+
+        attributeset = measure[i]['attribute_sets']
+        for attribute_node in attributeset:
+            attribute_type = attribute_node.find('./Attribute').attrib.get('Type')
+            attribute_value = attribute_node.find('./Attribute').text;
+
+            # find hgvs_c
+            if (attribute_type == 'HGVS, coding, RefSeq' and "c." in attribute_value):
+                current_row['hgvs_c'] = attribute_value
+
+            # find hgvs_p
+            if (attribute_type == 'HGVS, protein, RefSeq' and "p." in attribute_value):
+                current_row['hgvs_p'] = attribute_value
+
+            # aggregate all molecular consequences
+            if (attribute_type == 'MolecularConsequence'):
+                for xref in attribute_node.findall('.//XRef'):
+                    if xref.attrib.get('DB') == "RefSeq":
+                        # print xref.attrib.get('ID'), attribute_value
+                        current_row['molecular_consequence'].add(":".join([xref.attrib.get('ID'), attribute_value]))
+
+        current_row['molecular_consequence'] = format_list_column(current_row['molecular_consequence'])
+
+        # only the location columns depend on the genome build
+        for genome_build, genomic_location in genomic_locations:
             current_row['chrom'] = genomic_location.attrib['Chr']
             current_row['pos'] = genomic_location.attrib['start']
             current_row['ref'] = genomic_location.attrib['referenceAllele']
@@ -251,74 +535,584 @@ def parse_clinvar_tree(handle, dest=sys.stdout, multi=None, verbose=True, genome
             current_row['start'] = genomic_location.attrib['start']
             current_row['stop'] = genomic_location.attrib['stop']
             current_row['strand'] = ''
-            for measure_relationship in measure[i].findall(".//MeasureRelationship"):
+            for measure_relationship in measure[i]['relationships']:
                 if current_row['symbol'] == measure_relationship.find(".//Symbol/ElementValue").text:
                     for sequence_location in measure_relationship.findall(".//SequenceLocation"):
                         if 'Strand' in sequence_location.attrib and genomic_location.attrib['Accession'] == sequence_location.attrib['Accession']:
                             current_row['strand'] = sequence_location.attrib['Strand']
                             break
 
-            current_row['molecular_consequence'] = set()
-            current_row['hgvs_c'] = ''
-            current_row['hgvs_p'] = ''
-
-            attributeset = measure[i].findall('./AttributeSet')
-            for attribute_node in attributeset:
-                attribute_type = attribute_node.find('./Attribute').attrib.get('Type')
-                attribute_value = attribute_node.find('./Attribute').text;
-
-                # find hgvs_c
-                if (attribute_type == 'HGVS, coding, RefSeq' and "c." in attribute_value):
-                    current_row['hgvs_c'] = attribute_value
-
-                # find hgvs_p
-                if (attribute_type == 'HGVS, protein, RefSeq' and "p." in attribute_value):
-                    current_row['hgvs_p'] = attribute_value
-
-                # aggregate all molecular consequences
-                if (attribute_type == 'MolecularConsequence'):
-                    for xref in attribute_node.findall('.//XRef'):
-                        if xref.attrib.get('DB') == "RefSeq":
-                            # print xref.attrib.get('ID'), attribute_value
-                            current_row['molecular_consequence'].add(":".join([xref.attrib.get('ID'), attribute_value]))
-
-            column_name = 'molecular_consequence'
-            column_value = current_row[column_name] if type(current_row[column_name]) == list else sorted(
-                current_row[column_name])  # sort columns of type 'set' to get deterministic order
-            current_row[column_name] = remove_newlines_and_tabs(';'.join(map(replace_semicolons, column_value)))
-
-            if len(measure) == 1:
-                dest.write(('\t'.join([current_row[column] for column in HEADER]) + '\n').encode('utf-8'))
-                scounter += 1
-            else:
-                if multi is not None:
-                    multi.write(('\t'.join([current_row[column] for column in HEADER]) + '\n').encode('utf-8'))
-                    mcounter += 1
+            rows.append((genome_build, len(measure) != 1,
+                         current_row.to_line()))
+
+    # done parsing the xml for this one clinvar set.
+    elem.clear()
+
+    return rows
+
+
+def iter_etree_clinvar_sets(handle):
+    """Iterate over the ClinVarSet elements of a ClinVar XML stream in constant memory, with ElementTree.
+
+    Once the caller is done with a ClinVarSet (ie. asks for the next one), it is cleared and removed from the
+    ReleaseSet root, whether it was turned into rows or skipped, so the tree never holds more than the
+    ClinVarSets that are currently being parsed.
+
+    Args:
+        handle: Open input file handle for reading the XML data
+    """
+
+    root = None
+    for event, elem in ET.iterparse(handle, events=('start', 'end')):
+        if root is None:
+            root = elem
+        if event != 'end' or elem.tag != 'ClinVarSet':
+            continue
+
+        yield elem
+
+        elem.clear()
+        try:
+            root.remove(elem)
+        except ValueError:
+            pass  # nested deeper than the root, only its (now empty) element is kept
+
+
+def iter_lxml_clinvar_sets(handle):
+    """Iterate over the ClinVarSet elements of a ClinVar XML stream in constant memory, with lxml.
+
+    Only the ClinVarSet end events are reported by lxml, instead of the events of all elements. Like with
+    iter_etree_clinvar_sets, each ClinVarSet is cleared and removed from the tree once the caller is done with it.
+
+    Args:
+        handle: Open input file handle for reading the XML data
+    """
+
+    for event, elem in lxml_etree.iterparse(handle, events=('end',), tag='ClinVarSet'):
+        yield elem
+
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
 
-            if scounter % 100 == 0:
-                dest.flush()
-            if mcounter % 100 == 0:
-                if multi is not None:
-                    multi.flush()
 
-            counter = scounter + mcounter
+# an engine is the XML library that the ClinVarSets are parsed with: how to iterate over the ClinVarSet elements,
+# and how to collect the nodes that parse_clinvar_set reads from them
+Engine = namedtuple('Engine', ['iter_clinvar_sets', 'collect_nodes'])
+
+ENGINES = {'etree': Engine(iter_etree_clinvar_sets, walk_clinvar_set_nodes)}
+if lxml_etree is not None:
+    ENGINES['lxml'] = Engine(iter_lxml_clinvar_sets, xpath_clinvar_set_nodes)
+
+DEFAULT_ENGINE = 'lxml' if 'lxml' in ENGINES else 'etree'
+
+
+def iter_clinvar_sets(handle, engine=DEFAULT_ENGINE):
+    """Iterate over the ClinVarSet elements of a ClinVar XML stream with the given engine (see ENGINES)"""
+
+    return ENGINES[engine].iter_clinvar_sets(handle)
+
+
+def iter_clinvar_set_rows(handle, genome_builds, skipped_counter, engine=DEFAULT_ENGINE):
+    """Parse the ClinVarSets of handle one by one and yield the list of rows for each (see parse_clinvar_set)"""
+
+    for elem in iter_clinvar_sets(handle, engine=engine):
+        rows = parse_clinvar_set(elem, genome_builds, skipped_counter, collect_nodes=ENGINES[engine].collect_nodes)
+        if rows is None:
+            return
+        yield rows
+
+
+def iter_clinvar_set_shards(handle, shard_size=500, block_size=2**22):
+    """Split a ClinVar XML stream into shards of shard_size complete ClinVarSet elements, without parsing it.
+
+    Text outside of the ClinVarSet elements (the xml declaration, the ReleaseSet tags, whitespace in between)
+    is dropped, so each shard can be parsed on its own by wrapping it in a root element.
+
+    Args:
+        handle: Open input file handle for reading the XML data
+        shard_size: Number of ClinVarSets per shard
+        block_size: Number of bytes to read from handle at a time
+    """
+
+    shard = []
+    data = b''
+    start = None  # offset in data of the ClinVarSet that's currently being read
+    pos = 0  # offset in data where the next search starts
+    while True:
+        if start is None:
+            i = data.find(CLINVAR_SET_START, pos)
+            if i >= 0:
+                start = pos = i
+                continue
+            pos = max(pos, len(data) - len(CLINVAR_SET_START) + 1)
+        else:
+            i = data.find(CLINVAR_SET_END, pos)
+            if i >= 0:
+                pos = i + len(CLINVAR_SET_END)
+                shard.append(data[start:pos])
+                start = None
+                if len(shard) == shard_size:
+                    yield b''.join(shard)
+                    shard = []
+                continue
+            pos = max(pos, len(data) - len(CLINVAR_SET_END) + 1)
+
+        block = handle.read(block_size)
+        if not block:
+            break
+
+        # drop the data that has already been handled
+        keep = pos if start is None else start
+        data = data[keep:] + block
+        pos -= keep
+        if start is not None:
+            start = 0
+
+    if shard:
+        yield b''.join(shard)
+
+
+def read_indexed_shard(xml_path, virtual_offset, length):
+    """Read a shard from iter_clinvar_xml_index_shards (see index_clinvar_xml.py) from the BGZF ClinVar XML"""
+
+    from index_clinvar_xml import read_clinvar_xml
+
+    reader = BgzfReader(xml_path)
+    try:
+        return read_clinvar_xml(reader, virtual_offset, length)
+    finally:
+        reader.close()
+
+
+def _parse_clinvar_shard(args):
+    """Worker for iter_clinvar_shard_rows: parse one shard from iter_clinvar_set_shards, or read and parse the
+    (xml_path, virtual_offset, length) of a shard of an indexed XML.
+
+    Return:
+        (results, stopped, trait_cache_counts) where results has a (rows, skipped_counter) tuple with the
+        parse_clinvar_set rows and skipped counts of each ClinVarSet in the shard, stopped is True if a non-RCV record
+        ended the parse, and trait_cache_counts are the (hits, misses) of the worker's TRAIT_COLUMNS_CACHE
+    """
+
+    shard, genome_builds, engine = args
+    if isinstance(shard, tuple):
+        shard = read_indexed_shard(*shard)
+
+    results = []
+    stopped = False
+    for elem in iter_clinvar_sets(BytesIO(b'<ReleaseSet>' + shard + b'</ReleaseSet>'), engine=engine):
+        skipped_counter = defaultdict(int)
+        rows = parse_clinvar_set(elem, genome_builds, skipped_counter, collect_nodes=ENGINES[engine].collect_nodes)
+        if rows is None:
+            stopped = True
+            break
+        results.append((rows, dict(skipped_counter)))
+
+    return results, stopped, TRAIT_COLUMNS_CACHE.pop_counts()
+
+
+def add_trait_cache_counts(trait_cache_counts):
+    """Add the (hits, misses) of a worker's TRAIT_COLUMNS_CACHE to the counts of this process, so they are
+    reported with the skipped counts"""
+
+    hits, misses = trait_cache_counts
+    TRAIT_COLUMNS_CACHE.hits += hits
+    TRAIT_COLUMNS_CACHE.misses += misses
+
+
+def iter_clinvar_shard_rows(handle, genome_builds, skipped_counter, workers, shard_size=500, engine=DEFAULT_ENGINE,
+                            index_path=None):
+    """Parse the ClinVarSets of handle in a pool of worker processes, and yield the list of rows for each
+    ClinVarSet in input order, so the output is identical to iter_clinvar_set_rows.
+
+    Args:
+        handle: Open input file handle for reading the XML data
+        genome_builds: List of genome builds ('GRCh37' and/or 'GRCh38')
+        skipped_counter: defaultdict(int) that the workers' skipped counts get added to
+        workers: Number of worker processes
+        shard_size: Number of ClinVarSets per shard
+        engine: Name of the engine the workers parse the shards with (see ENGINES)
+        index_path: Index of the XML made by index_clinvar_xml.py. If given, handle isn't read: the workers read
+            their shards straight from the BGZF XML instead.
+    """
+
+    pool = multiprocessing.Pool(workers)
+    pending = deque()
+    max_pending = 2 * workers  # limits how much of the input is held in memory
+    try:
+        if index_path is not None:
+            from index_clinvar_xml import get_indexed_xml_path, iter_clinvar_xml_index_shards
+
+            xml_path = get_indexed_xml_path(index_path)
+            shards = ((xml_path, virtual_offset, length) for virtual_offset, length in
+                      iter_clinvar_xml_index_shards(index_path, shard_size=shard_size))
+        else:
+            shards = iter_clinvar_set_shards(handle, shard_size=shard_size)
+        while True:
+            for shard in shards:
+                pending.append(pool.apply_async(_parse_clinvar_shard, ((shard, genome_builds, engine),)))
+                if len(pending) >= max_pending:
+                    break
+
+            if not pending:
+                break
+
+            results, stopped, trait_cache_counts = pending.popleft().get()
+            add_trait_cache_counts(trait_cache_counts)
+            for rows, clinvar_set_skipped_counter in results:
+                for key, value in clinvar_set_skipped_counter.items():
+                    skipped_counter[key] += value
+                yield rows
+            if stopped:
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def get_clinvar_set_key(clinvar_set):
+    """Return the (rcv accession, rcv version, sha1 hex digest) of the XML of a ClinVarSet, or None if it has no
+    RCV accession"""
+
+    match = RCV_ACCESSION_REGEX.search(clinvar_set)
+    if match is None:
+        return None
+    acc = ACC_ATTRIBUTE_REGEX.search(match.group(0))
+    version = VERSION_ATTRIBUTE_REGEX.search(match.group(0))
+    if acc is None:
+        return None
+
+    return acc.group(1), version.group(1) if version is not None else b'', hashlib.sha1(clinvar_set).hexdigest()
+
+
+def get_parser_digest():
+    """Return the sha1 hex digest of this module's source code, so the cache is not reused after code changes"""
+
+    path = os.path.abspath(__file__)
+    if path.endswith('.pyc') or path.endswith('.pyo'):
+        path = path[:-1]
+    with open(path, 'rb') as source:
+        return hashlib.sha1(source.read()).hexdigest()
+
+
+class ClinVarSetCache(object):
+    """Persistent cache of the parse_clinvar_set rows of each ClinVarSet from the previous parse, keyed by its
+    RCV accession, version and a hash of its XML.
+
+    The cache is an sqlite database. Each parse reads the cache of the previous parse and writes a new one next to
+    it, that replaces it in close(). So it only holds the ClinVarSets of the latest release, and it is left
+    unchanged if the parse fails. It is ignored if it was made for other genome builds or by other parser code.
+    """
+
+    def __init__(self, path, genome_builds):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.hits = 0
+        self.misses = 0
+
+        meta = [('parser_digest', get_parser_digest()), ('genome_builds', ','.join(sorted(genome_builds)))]
+
+        self.previous = None
+        if os.path.isfile(path):
+            previous = sqlite3.connect(path)
+            try:
+                if sorted(previous.execute('SELECT key, value FROM meta')) == sorted(meta):
+                    self.previous = previous
+            except sqlite3.DatabaseError:
+                pass
+            if self.previous is None:
+                previous.close()
+
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        self.db = sqlite3.connect(self.tmp_path)
+        self.db.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.db.execute('CREATE TABLE clinvar_sets (rcv TEXT PRIMARY KEY, version TEXT, digest TEXT, rows TEXT, '
+                        'skipped TEXT)')
+        self.db.executemany('INSERT INTO meta VALUES (?, ?)', meta)
+
+    def get(self, key):
+        """Return the (rows, skipped_counter) of the ClinVarSet with the given get_clinvar_set_key, or None if it
+        is new or has changed since the previous parse. Hits are carried over to the new cache."""
+
+        result = None
+        if self.previous is not None:
+            rcv, version, digest = key
+            result = self.previous.execute('SELECT rows, skipped FROM clinvar_sets WHERE rcv = ? AND version = ? AND '
+                                           'digest = ?', (rcv, version, digest)).fetchone()
+        if result is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.db.execute('INSERT OR REPLACE INTO clinvar_sets VALUES (?, ?, ?, ?, ?)', key + tuple(result))
+        return json.loads(result[0]), json.loads(result[1])
+
+    def put(self, key, rows, skipped_counter):
+        """Add the rows and skipped counts of the ClinVarSet with the given get_clinvar_set_key"""
+
+        self.db.execute('INSERT OR REPLACE INTO clinvar_sets VALUES (?, ?, ?, ?, ?)',
+                        key + (json.dumps(rows), json.dumps(skipped_counter)))
+
+    def close(self):
+        """Replace the previous cache with the new one"""
+
+        if self.previous is not None:
+            self.previous.close()
+        self.db.commit()
+        self.db.close()
+        os.rename(self.tmp_path, self.path)
+
+
+def iter_cached_clinvar_set_rows(handle, genome_builds, skipped_counter, cache, workers=1, shard_size=500,
+                                 engine=DEFAULT_ENGINE):
+    """Yield the list of rows for each ClinVarSet of handle like iter_clinvar_set_rows, but only parse the
+    ClinVarSets that are not in the cache, and replay the cached rows for the others.
+
+    Args:
+        handle: Open input file handle for reading the XML data
+        genome_builds: List of genome builds ('GRCh37' and/or 'GRCh38')
+        skipped_counter: defaultdict(int) that counts the reasons why variants were skipped
+        cache: ClinVarSetCache
+        workers: Number of processes to parse the new and changed ClinVarSets with
+        shard_size: Number of ClinVarSets per shard when workers > 1
+        engine: Name of the engine to parse with (see ENGINES)
+    """
+
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        clinvar_sets = iter_clinvar_set_shards(handle, shard_size=1)
+        while True:
+            chunk = list(itertools.islice(clinvar_sets, shard_size * workers))
+            if not chunk:
+                break
+
+            keys = [get_clinvar_set_key(clinvar_set) for clinvar_set in chunk]
+            results = [cache.get(key) if key is not None else None for key in keys]
+
+            # parse the ClinVarSets that are not in the cache
+            missing = [i for i, result in enumerate(results) if result is None]
+            shards = [(b''.join(chunk[i] for i in missing[j:j + shard_size]), genome_builds, engine)
+                      for j in range(0, len(missing), shard_size)]
+            parsed = []
+            for shard_results, stopped, trait_cache_counts in (
+                    pool.map(_parse_clinvar_shard, shards) if pool is not None else
+                    itertools.imap(_parse_clinvar_shard, shards)):
+                parsed += shard_results
+                add_trait_cache_counts(trait_cache_counts)
+                if stopped:
+                    break
+
+            for i, (rows, clinvar_set_skipped_counter) in zip(missing, parsed):
+                results[i] = (rows, clinvar_set_skipped_counter)
+                if keys[i] is not None:
+                    cache.put(keys[i], rows, clinvar_set_skipped_counter)
+
+            for result in results:
+                if result is None:
+                    return  # a non-RCV record ended the parse
+                rows, clinvar_set_skipped_counter = result
+                for key, value in clinvar_set_skipped_counter.items():
+                    skipped_counter[key] += value
+                yield rows
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def reads_input_stream(workers=1, cache_path=None, index_path=None):
+    """Return whether parse_clinvar_tree_by_build reads its handle with these options. It doesn't when the workers
+    read their shards from an indexed XML (and there is no cache, which reads the stream)."""
+    return cache_path is not None or index_path is None or workers <= 1
+
+
+def parse_clinvar_tree(handle, dest=sys.stdout, multi=None, verbose=True, genome_build='GRCh37', workers=1,
+                       shard_size=500, engine=DEFAULT_ENGINE, cache_path=None, index_path=None, pipeline=False,
+                       reference=None):
+    """Parse clinvar XML
+    Args:
+        handle: Open input file handle for reading the XML data
+        dest: Open output file handle or stream for simple variants
+        multi: Open output file handle or stream for complex non-single-variant clinvar records
+            (eg. compound het, haplotypes, etc.)
+        verbose: Whether to write extra stats to stderr
+        genome_build: Either 'GRCh37' or 'GRCh38'
+        workers: Number of processes to parse with. If > 1, the input is split into shards of shard_size
+            ClinVarSets that are parsed in parallel. The output is the same either way.
+        shard_size: Number of ClinVarSets per shard when workers > 1
+        engine: Name of the XML library to parse with (see ENGINES). The output is the same either way.
+        cache_path: Path of a ClinVarSetCache. If given, only the ClinVarSets that are new or have changed since
+            the previous parse with this cache are parsed, and the cache is updated.
+        index_path: Index of the XML made by index_clinvar_xml.py. If given and workers > 1, the workers read
+            their shards straight from the indexed BGZF XML, instead of the main process splitting the stream.
+        pipeline: Whether to read (decompress) the input and encode and write the output in separate threads, so
+            they overlap with the parsing. The output is the same either way.
+        reference: Path of the genome_build reference FASTA. If given, the variants are normalized against it
+            (see normalize_variants.py).
+    """
+
+    parse_clinvar_tree_by_build(handle, {genome_build: (dest, multi)}, verbose=verbose, workers=workers,
+                                shard_size=shard_size, engine=engine, cache_path=cache_path, index_path=index_path,
+                                pipeline=pipeline, references={genome_build: reference} if reference else None)
+
+
+def write_rows(outputs, rows):
+    """Write a batch of (genome_build, is_multi, row) rows to the outputs of parse_clinvar_tree_by_build, and flush"""
+
+    for genome_build, is_multi, row in rows:
+        dest, multi = outputs[genome_build]
+        if not is_multi:
+            dest.write(row.encode('utf-8'))
+        elif multi is not None:
+            multi.write(row.encode('utf-8'))
+
+    for dest, multi in outputs.values():
+        dest.flush()
+        if multi is not None:
+            multi.flush()
+
+
+def parse_clinvar_tree_by_build(handle, outputs, verbose=True, workers=1, shard_size=500, engine=DEFAULT_ENGINE,
+                                cache_path=None, index_path=None, pipeline=False, references=None):
+    """Parse clinvar XML for one or more genome builds in a single pass over the XML
+    Args:
+        handle: Open input file handle for reading the XML data. None if it isn't read (see reads_input_stream).
+        outputs: dict that maps each genome build ('GRCh37' and/or 'GRCh38') to a (dest, multi) tuple of open
+            output file handles or streams for its simple variants and complex non-single-variant clinvar
+            records (eg. compound het, haplotypes, etc.). multi can be None.
+        verbose: Whether to write extra stats to stderr
+        workers: Number of processes to parse with. If > 1, the input is split into shards of shard_size
+            ClinVarSets that are parsed in parallel. The output is the same either way.
+        shard_size: Number of ClinVarSets per shard when workers > 1
+        engine: Name of the XML library to parse with (see ENGINES). The output is the same either way.
+        cache_path: Path of a ClinVarSetCache. If given, only the ClinVarSets that are new or have changed since
+            the previous parse with this cache are parsed, and the cache is updated.
+        index_path: Index of the XML made by index_clinvar_xml.py. If given and workers > 1, the workers read
+            their shards straight from the indexed BGZF XML, instead of the main process splitting the stream.
+        pipeline: Whether to read (decompress) the input and encode and write the output in separate threads, so
+            they overlap with the parsing. The output is the same either way.
+        references: dict that maps genome builds to the path of their reference FASTA. The variants of these builds
+            are normalized (converted to their minimal representation and left-aligned) as they are written, and
+            the ones that fail normalization are skipped (see normalize_variants.py).
+    """
+
+    # variation -> rcv (one to many)
+
+    genome_builds = sorted(outputs)
+    for dest, multi in outputs.values():
+        dest.write(('\t'.join(HEADER) + '\n').encode('utf-8'))
+        if multi is not None:
+            multi.write(('\t'.join(HEADER) + '\n').encode('utf-8'))
+
+    scounter = defaultdict(int)
+    mcounter = defaultdict(int)
+    skipped_counter = defaultdict(int)
+
+    reader_thread = writer_thread = None
+    if pipeline:
+        if handle is not None and reads_input_stream(workers, cache_path, index_path):
+            reader_thread = ReaderThread(handle)
+            reader_thread.start()
+            handle = reader_thread.get_reader()
+        writer_thread = WriterThread(lambda rows: write_rows(outputs, rows))
+        writer_thread.start()
+    start_time = time.time()
+    TRAIT_COLUMNS_CACHE.pop_counts()
+
+    cache = None
+    if cache_path is not None:
+        cache = ClinVarSetCache(cache_path, genome_builds)
+        row_batches = iter_cached_clinvar_set_rows(handle, genome_builds, skipped_counter, cache, workers=workers,
+                                                   shard_size=shard_size, engine=engine)
+    elif workers > 1:
+        row_batches = iter_clinvar_shard_rows(handle, genome_builds, skipped_counter, workers, shard_size=shard_size,
+                                              engine=engine, index_path=index_path)
+    else:
+        row_batches = iter_clinvar_set_rows(handle, genome_builds, skipped_counter, engine=engine)
+
+    reference_genomes = {}
+    if references:
+        reference_genomes = {genome_build: ReferenceGenome(path) for genome_build, path in references.items()}
+        row_batches = normalize_clinvar_set_rows(row_batches, reference_genomes, skipped_counter)
+
+    counter = 0
+    clinvar_set_counter = 0
+    batch = []
+    for rows in row_batches:
+        clinvar_set_counter += 1
+        for genome_build, is_multi, row in rows:
+            dest, multi = outputs[genome_build]
+            if writer_thread is not None:
+                batch.append((genome_build, is_multi, row))
+                if len(batch) >= PIPELINE_BATCH_SIZE:
+                    writer_thread.put(batch)
+                    batch = []
+                if not is_multi:
+                    scounter[genome_build] += 1
+                elif multi is not None:
+                    mcounter[genome_build] += 1
+            else:
+                if not is_multi:
+                    dest.write(row.encode('utf-8'))
+                    scounter[genome_build] += 1
+                else:
+                    if multi is not None:
+                        multi.write(row.encode('utf-8'))
+                        mcounter[genome_build] += 1
+
+                if scounter[genome_build] % 100 == 0:
+                    dest.flush()
+                if mcounter[genome_build] % 100 == 0:
+                    if multi is not None:
+                        multi.flush()
+
+            counter = sum(scounter.values()) + sum(mcounter.values())
             if verbose and counter % 100 == 0:
-                sys.stderr.write("{0} entries completed, {1}, {2} total \r".format(
+                sys.stderr.write("{0} entries completed, {1}, {2} total, {3} \r".format(
                     counter,
                     ', '.join('%s skipped due to %s' % (v, k) for k, v in skipped_counter.items()),
-                    counter + sum(skipped_counter.values())
+                    counter + sum(skipped_counter.values()),
+                    TRAIT_COLUMNS_CACHE.get_summary()
                 ))
                 sys.stderr.flush()
 
-        # done parsing the xml for this one clinvar set.
-        elem.clear()
-
+    if writer_thread is not None:
+        writer_thread.put(batch)
+        writer_thread.close()
+        if verbose:
+            elapsed = max(time.time() - start_time, 1e-6)
+            if reader_thread is not None:
+                sys.stderr.write("Read {0:.1f} MB of XML ({1:.1f} MB/sec)\n".format(
+                    reader_thread.bytes_read / 1e6, reader_thread.bytes_read / 1e6 / elapsed))
+            sys.stderr.write("Parsed {0} ClinVarSets ({1:.1f}/sec), wrote {2} rows ({3:.1f}/sec) in {4:.1f} sec\n".format(
+                clinvar_set_counter, clinvar_set_counter / elapsed, writer_thread.items_written,
+                writer_thread.items_written / elapsed, elapsed))
+            if reader_thread is not None:
+                sys.stderr.write(reader_thread.blocks.get_summary() + "\n")
+            sys.stderr.write(writer_thread.batches.get_summary() + "\n")
+
+    if cache is not None:
+        cache.close()
+        if verbose:
+            sys.stderr.write("{0} ClinVarSets replayed from the cache, {1} parsed\n".format(cache.hits, cache.misses))
+    for reference_genome in reference_genomes.values():
+        reference_genome.close()
+    if verbose:
+        sys.stderr.write(TRAIT_COLUMNS_CACHE.get_summary() + "\n")
     sys.stderr.write("Done\n")
 
 
-def get_handle(path):
+def get_handle(path, decompressor=None):
+    """Open the (gzipped) XML for reading. decompressor is an optional external gzip decompression command, eg. pigz,
+    that runs in a separate process."""
+
     if path[-3:] == '.gz':
-        handle = gzip.open(path)
+        if decompressor is not None:
+            handle = subprocess.Popen([decompressor, '-dc', path], stdout=subprocess.PIPE, bufsize=-1).stdout
+        else:
+            handle = gzip.open(path)
     else:
         handle = open(path)
     return handle
@@ -326,17 +1120,69 @@ def get_handle(path):
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Extract PMIDs from the ClinVar XML dump')
-    parser.add_argument('-g', '--genome-build', choices=['GRCh37', 'GRCh38'],
-                        help='Genome version (either GRCh37 or GRCh38)', required=True)
+    parser.add_argument('-g', '--genome-build', choices=GENOME_BUILDS,
+                        help='Genome version (either GRCh37 or GRCh38). Required unless -b is used.')
     parser.add_argument('-x', '--xml', dest='xml_path',
                         type=str, help='Path to the ClinVar XML dump', required=True)
     parser.add_argument('-o', '--out', nargs='?', type=argparse.FileType('w'), default=sys.stdout)
     parser.add_argument('-m', '--multi', help="Output file name for complex alleles")
+    parser.add_argument('-b', '--build-outputs', nargs=3, action='append', default=[],
+                        metavar=('GENOME_BUILD', 'OUT', 'MULTI'),
+                        help='Also extract the variants for GENOME_BUILD in the same pass over the XML, and write '
+                             'them to the OUT and MULTI file names. Can be repeated.')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Number of processes to parse with. The output is the same for any number of workers.')
+    parser.add_argument('--shard-size', type=int, default=500,
+                        help='Number of ClinVarSets handed to a worker at a time when --workers > 1')
+    parser.add_argument('-e', '--engine', choices=sorted(ENGINES), default=DEFAULT_ENGINE,
+                        help='XML library to parse with. lxml is used if it is installed. The output is the same '
+                             'for either engine.')
+    parser.add_argument('-c', '--cache', dest='cache_path',
+                        help='Path of a cache of the rows of each ClinVarSet. Only the ClinVarSets that are new or '
+                             'have changed since the previous parse with the same cache are parsed.')
+    parser.add_argument('-i', '--index', dest='index_path',
+                        help='Index of the XML made by index_clinvar_xml.py (XML.cvi), so that the workers read their '
+                             'shards straight from the XML when --workers > 1')
+    parser.add_argument('-p', '--pipeline', action='store_true',
+                        help='Read the XML and write the output in separate threads, overlapping with the parsing, '
+                             'and report the throughput and queue depths of the stages')
+    parser.add_argument('--decompressor',
+                        help='External command to decompress the gzipped XML with, eg. pigz')
+    parser.add_argument('-r', '--reference', nargs=2, action='append', default=[],
+                        metavar=('GENOME_BUILD', 'FASTA'),
+                        help='Normalize the variants of GENOME_BUILD against the FASTA reference as they are written '
+                             '(see normalize_variants.py). Can be repeated.')
 
     args = parser.parse_args()
-    if args.multi is not None:
-        f = open(args.multi, 'w')
-        parse_clinvar_tree(get_handle(args.xml_path), dest=args.out, multi=f, genome_build=args.genome_build)
-        f.close()
-    else:
-        parse_clinvar_tree(get_handle(args.xml_path), dest=args.out, genome_build=args.genome_build)
+    if args.genome_build is None and not args.build_outputs:
+        parser.error("Either -g or -b is required")
+
+    outputs = {}
+    if args.genome_build is not None:
+        outputs[args.genome_build] = (args.out, open(args.multi, 'w') if args.multi is not None else None)
+    for genome_build, out_path, multi_path in args.build_outputs:
+        if genome_build not in GENOME_BUILDS:
+            parser.error("Unexpected genome build: %s. Expected one of: %s" % (genome_build, ', '.join(GENOME_BUILDS)))
+        if genome_build in outputs:
+            parser.error("Genome build %s was specified more than once" % genome_build)
+        outputs[genome_build] = (open(out_path, 'w'), open(multi_path, 'w'))
+
+    references = {}
+    for genome_build, fasta_path in args.reference:
+        if genome_build not in outputs:
+            parser.error("Reference genome given for %s, but its variants are not extracted" % genome_build)
+        references[genome_build] = fasta_path
+
+    # with --index and --workers, the workers read the XML, so it isn't opened (or decompressed by --decompressor)
+    handle = None
+    if reads_input_stream(args.workers, args.cache_path, args.index_path):
+        handle = get_handle(args.xml_path, decompressor=args.decompressor)
+    parse_clinvar_tree_by_build(handle, outputs, workers=args.workers, shard_size=args.shard_size,
+                                engine=args.engine, cache_path=args.cache_path,
+                                index_path=args.index_path, pipeline=args.pipeline, references=references)
+
+    for dest, multi in outputs.values():
+        if dest is not sys.stdout:
+            dest.close()
+        if multi is not None:
+            multi.close()
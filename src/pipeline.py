@@ -0,0 +1,141 @@
+"""Helpers to overlap the reading, processing and writing of a stream in separate threads.
+
+The input is read (and decompressed) by a reader thread, and the output is encoded and written by a writer thread,
+while the main thread does the CPU-bound processing. The stages are connected by bounded queues, so memory use
+stays bounded whichever stage is the slowest. zlib, file and pipe I/O release the GIL, so the I/O threads run
+in parallel with the main thread.
+"""
+
+import Queue
+import sys
+import threading
+import time
+
+END = None  # put in a queue after the last item
+
+
+class CountingQueue(Queue.Queue):
+    """Bounded queue that keeps track of its depth, and of how long its producer and its consumer were blocked"""
+
+    def __init__(self, name, maxsize):
+        Queue.Queue.__init__(self, maxsize)
+        self.name = name
+        self.puts = 0
+        self.total_depth = 0
+        self.max_depth = 0
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+
+    def put(self, item, block=True, timeout=None):
+        start = time.time()
+        Queue.Queue.put(self, item, block, timeout)
+        self.put_wait += time.time() - start
+
+        depth = self.qsize()
+        self.puts += 1
+        self.total_depth += depth
+        self.max_depth = max(self.max_depth, depth)
+
+    def get(self, block=True, timeout=None):
+        start = time.time()
+        item = Queue.Queue.get(self, block, timeout)
+        self.get_wait += time.time() - start
+        return item
+
+    def get_summary(self):
+        return "%s queue: avg depth %.1f, max depth %d (of %d), producer blocked %.1fs, consumer blocked %.1fs" % (
+            self.name, float(self.total_depth) / max(self.puts, 1), self.max_depth, self.maxsize, self.put_wait,
+            self.get_wait)
+
+
+class QueueReader(object):
+    """File-like object that reads the data blocks that a reader thread puts in a queue"""
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.block = b''
+        self.pos = 0
+        self.done = False
+
+    def read(self, size=-1):
+        """Read at most size bytes (less at the end of a block, and b'' at the end of the stream)"""
+
+        while self.pos == len(self.block) and not self.done:
+            block = self.blocks.get()
+            if block is END:
+                self.done = True
+            elif isinstance(block, Exception):
+                self.done = True
+                raise block
+            else:
+                self.block = block
+                self.pos = 0
+
+        end = len(self.block) if size < 0 else min(len(self.block), self.pos + size)
+        data = self.block[self.pos:end]
+        self.pos = end
+        return data
+
+
+class ReaderThread(threading.Thread):
+    """Reads a file handle in blocks (eg. decompresses it) and puts the blocks in a CountingQueue"""
+
+    def __init__(self, handle, block_size=2**20, max_blocks=16):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.handle = handle
+        self.block_size = block_size
+        self.blocks = CountingQueue('read', max_blocks)
+        self.bytes_read = 0
+
+    def run(self):
+        try:
+            while True:
+                block = self.handle.read(self.block_size)
+                if not block:
+                    break
+                self.bytes_read += len(block)
+                self.blocks.put(block)
+            self.blocks.put(END)
+        except Exception, e:
+            self.blocks.put(e)
+
+    def get_reader(self):
+        return QueueReader(self.blocks)
+
+
+class WriterThread(threading.Thread):
+    """Takes batches of items from a CountingQueue and writes them with a write_batch function"""
+
+    def __init__(self, write_batch, max_batches=16):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.write_batch = write_batch
+        self.batches = CountingQueue('write', max_batches)
+        self.items_written = 0
+        self.error = None
+
+    def run(self):
+        while True:
+            batch = self.batches.get()
+            if batch is END:
+                break
+            if self.error is not None:
+                continue  # keep taking batches, so the producer doesn't block forever
+            try:
+                self.write_batch(batch)
+                self.items_written += len(batch)
+            except Exception, e:
+                self.error = e
+                self.error_info = sys.exc_info()
+
+    def put(self, batch):
+        self.batches.put(batch)
+
+    def close(self):
+        """Wait for the queued batches to be written, and re-raise the error of write_batch if it failed"""
+
+        self.batches.put(END)
+        self.join()
+        if self.error is not None:
+            raise self.error_info[0], self.error_info[1], self.error_info[2]
@@ -0,0 +1,633 @@
+#!/usr/bin/env python
+
+"""Extract the fields of a population dataset (see add_population_fields.SOURCE_SPECS) from its decomposed and
+normalized sites VCF once, into a memory-mapped columnar store, so that annotating each clinvar release looks the
+variants up in a few arrays instead of re-parsing the INFO (with its VEP CSQ) of every VCF row they overlap.
+
+A store is a directory of .npy files, next to the VCF by default:
+
+    meta.json               version, md5, size and mtime of the VCF it was made from, the number of rows, the chromosomes,
+                            and the fields with the type of their column
+    allele_keys.npy         int64 allele_key.pack_allele_key of each row, sorted. The rows of the other columns are in
+                            this order, and the rows with the same key are in the order of the VCF.
+    position_keys.npy       int64 chromosome index << 32 | pos of each row, sorted, and position_rows.npy, the row of
+                            each of them. Used to tell why a clinvar allele isn't in the dataset, as in add_population_fields.
+    ref.*, alt.*            the ref and alt of each row, as string columns whose string ids are the rows of the VCF
+    field.<field>.*         the column of each field
+
+Columns are typed, as long as that is lossless: a field whose values are all integers (that print the same as in the
+VCF) is an int32 column, or int64 if they don't fit, one whose values are all floats that print the same is a float64
+column, and any other field is a string column of uint32 ids (.npy) into its distinct strings (.offsets.npy and
+.heap.npy). Missing values are MISSING_INT32 or MISSING_INT, NaN and MISSING_STRING_ID.
+
+The VCFs have hundreds of millions of rows, so the store is built without holding them in memory: the rows are read
+chunk_size at a time, and the columns appended to files in the VCF order. The keys are then sorted in buckets on disk
+(see sort_keys), and each column is written in their order. Only the distinct strings of the string fields are kept in
+memory.
+
+The store is rebuilt when the checksum of the VCF changes. The checksum is only computed when the size or mtime of the
+file changed.
+
+    python population_store.py -i gnomad.exomes.r2.0.1.sites.normalized.vcf.gz -l gnomad_exomes
+"""
+
+import argparse
+import errno
+import gzip
+import json
+import os
+import shutil
+from array import array
+
+import numpy as np
+
+from allele_key import pack_allele_key
+from file_cache import INT64, UINT32, check_file, get_file_checksum, make_temp_dir, to_numpy, write_json
+
+STORE_VERSION = 1
+MISSING_INT = -2**63
+MAX_INT = 2**63 - 1
+MISSING_INT32 = -2**31
+MAX_INT32 = 2**31 - 1
+MISSING_STRING_ID = 2**32 - 1
+CHUNK_SIZE = 2**20  # rows read, and keys sorted, at a time while building a store
+SAMPLES_PER_BUCKET = 64  # keys sampled per bucket of sort_keys, to split them into buckets of about the same size
+
+
+def get_store_path(sites_vcf):
+    """Return the default path of the store of a sites VCF: next to it, so that it's reused by the next runs"""
+
+    return sites_vcf + '.store'
+
+
+def read_raw(path, dtype):
+    """Return a read-only memmap of a file of raw values, or an empty array if it's empty"""
+
+    if not os.path.getsize(path):
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+def write_npy(path, dtype, count, chunks):
+    """Write a .npy file of a 1-d array of count values from an iterable of arrays, one at a time"""
+
+    dtype = np.dtype(dtype)
+    written = 0
+    with open(path, 'wb') as f:
+        np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False,
+                                                 'shape': (count,)})
+        for chunk in chunks:
+            np.asarray(chunk, dtype=dtype).tofile(f)
+            written += len(chunk)
+    if written != count:
+        raise ValueError("Wrote %d values instead of %d to %s" % (written, count, path))
+
+
+def iter_chunks(values, chunk_size, order=None):
+    """Yield the values chunk_size at a time, or the values at each chunk of order"""
+
+    count = len(values) if order is None else len(order)
+    for start in xrange(0, count, chunk_size):
+        yield values[start:start + chunk_size] if order is None else values[order[start:start + chunk_size]]
+
+
+def sort_keys(keys_path, sorted_keys_path, order_path, tmp_dir, chunk_size=CHUNK_SIZE):
+    """Stable argsort of a file of int64 keys that may not fit in memory. The keys are split into buckets of about
+    chunk_size / 2 keys, by splitters from a sample of them, and each bucket is sorted in memory.
+
+    Args:
+        keys_path: Path of the raw int64 keys
+        sorted_keys_path: Path of the raw sorted keys to write
+        order_path: Path of the raw int64 index in keys_path of each sorted key to write
+        tmp_dir: Directory of the buckets
+        chunk_size: Number of keys read at a time
+    """
+
+    keys = read_raw(keys_path, np.int64)
+    bucket_count = 2 * len(keys) // chunk_size + 1
+    # the splitters are evenly spaced in a sorted sample of the keys. Equal keys go to the same bucket.
+    sample = np.sort(keys[::max(1, len(keys) // (bucket_count * SAMPLES_PER_BUCKET))])
+    splitters = sample[len(sample) * np.arange(1, bucket_count) // bucket_count]
+    bucket_path = os.path.join(tmp_dir, 'bucket.%d')
+    for start in xrange(0, len(keys), chunk_size):
+        chunk = np.array(keys[start:start + chunk_size])
+        buckets = np.searchsorted(splitters, chunk, 'right')
+        chunk_order = np.argsort(buckets, kind='mergesort')
+        items = np.column_stack((chunk[chunk_order], chunk_order + start))  # (key, index) in the order of the buckets
+        ends = np.cumsum(np.bincount(buckets, minlength=bucket_count))
+        for bucket in np.unique(buckets):
+            with open(bucket_path % bucket, 'ab') as f:
+                items[ends[bucket - 1] if bucket else 0:ends[bucket]].tofile(f)
+    del keys
+
+    with open(sorted_keys_path, 'wb') as sorted_keys_file, open(order_path, 'wb') as order_file:
+        for bucket in xrange(bucket_count):
+            if not os.path.isfile(bucket_path % bucket):
+                continue
+            items = np.fromfile(bucket_path % bucket, dtype=np.int64).reshape(-1, 2)
+            bucket_order = np.argsort(items[:, 0], kind='mergesort')  # the indices of equal keys are in file order
+            items[bucket_order, 0].tofile(sorted_keys_file)
+            items[bucket_order, 1].tofile(order_file)
+            os.remove(bucket_path % bucket)
+
+
+class ColumnBuilder(object):
+    """Accumulates the values of a column, as ints while they all are ints, as floats while they all are floats, and
+    as strings otherwise, or as strings from the start if value_type is 'string'. The values are appended to a file
+    of the column's type at each flush; when the type changes, the file is converted."""
+
+    def __init__(self, path, value_type=None, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.type = None  # until the first value
+        self.values = array(INT64)
+        self.strings = None
+        self.string_ids = None
+        self.missing = 0
+        self.min_value = self.max_value = None  # of an int column, but for the missing values
+        if value_type is not None:
+            self.set_type(value_type)
+
+    def append_missing(self):
+        if self.type is None:
+            self.missing += 1
+        elif self.type == 'int':
+            self.values.append(MISSING_INT)
+        elif self.type == 'float':
+            self.values.append(float('nan'))
+        else:
+            self.values.append(MISSING_STRING_ID)
+
+    def append(self, value):
+        column_type = self.type
+        if column_type == 'int':
+            int_value = parse_int(value)
+            if int_value is not None:
+                self.values.append(int_value)
+                return
+            self.set_type('string')
+        elif column_type == 'float':
+            float_value = parse_float(value)
+            if float_value is not None:
+                self.values.append(float_value)
+                return
+            self.set_type('string')
+        elif column_type is None:
+            self.set_type(get_value_type(value))
+            self.append(value)
+            return
+
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            string_id = self.string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        self.values.append(string_id)
+
+    def flush(self):
+        """Append the values so far to the file"""
+
+        if self.type is None:
+            return
+        if self.type == 'int' and self.values:
+            values = to_numpy(self.values, np.int64)
+            present_values = values[values != MISSING_INT]
+            if len(present_values):
+                min_value, max_value = present_values.min(), present_values.max()
+                self.min_value = min_value if self.min_value is None else min(self.min_value, min_value)
+                self.max_value = max_value if self.max_value is None else max(self.max_value, max_value)
+        with open(self.path, 'ab') as f:
+            self.values.tofile(f)
+        del self.values[:]
+
+    def set_type(self, value_type):
+        """Start, or convert the values so far to, a column of value_type"""
+
+        if self.type is None:
+            self.values = array({'int': INT64, 'float': 'd', 'string': UINT32}[value_type])
+            self.type = value_type
+            open(self.path, 'wb').close()
+            if value_type == 'string':
+                self.strings = []
+                self.string_ids = {}
+            for i in xrange(self.missing):
+                self.append_missing()
+                if len(self.values) >= self.chunk_size:
+                    self.flush()
+            return
+
+        # the ints and floats so far print as they were in the VCF
+        previous_type = self.type
+        self.flush()
+        previous_path = self.path + '.' + previous_type
+        os.rename(self.path, previous_path)
+        self.type = None
+        self.missing = 0
+        self.set_type('string')
+        for values in iter_chunks(read_raw(previous_path, np.int64 if previous_type == 'int' else np.float64),
+                                  self.chunk_size):
+            for value in values.tolist():
+                if (value == MISSING_INT) if previous_type == 'int' else (value != value):
+                    self.append_missing()
+                else:
+                    self.append(str(value) if previous_type == 'int' else repr(value))
+            self.flush()
+        os.remove(previous_path)
+
+    def save(self, path_prefix, order):
+        """Write the column, with its rows in the given order, remove its file, and return its type: int32 or int64
+        for an int column, the smallest of them that holds its values, float or string"""
+
+        if self.type is None:  # no values: an int column of missing values
+            self.set_type('int')
+        self.flush()
+        dtype = {'int': np.int64, 'float': np.float64, 'string': np.uint32}[self.type]
+        values = read_raw(self.path, dtype)
+        chunks = iter_chunks(values, self.chunk_size, order)
+        column_type = self.type
+        if column_type == 'int':
+            if self.min_value is None or (self.min_value > MISSING_INT32 and self.max_value <= MAX_INT32):
+                chunks = (np.where(chunk != MISSING_INT, chunk, MISSING_INT32) for chunk in chunks)
+                dtype = np.int32
+                column_type = 'int32'
+            else:
+                column_type = 'int64'
+        write_npy(path_prefix + '.npy', dtype, len(order), chunks)
+        del values
+        os.remove(self.path)
+        if self.type == 'string':
+            offsets = np.zeros(len(self.strings) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(string) for string in self.strings])
+            np.save(path_prefix + '.offsets.npy', offsets)
+            np.save(path_prefix + '.heap.npy', to_numpy(''.join(self.strings), np.uint8))
+        return column_type
+
+
+class RowStringColumnBuilder(object):
+    """Accumulates a string per row, such as the ref or alt of the row, without deduplicating them: the string id of
+    each row is its row in the VCF. The heap and offsets are appended to files at each flush."""
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.strings = []
+        self.count = 0
+        self.heap_size = 0
+        open(self.path + '.heap', 'wb').close()
+        open(self.path + '.offsets', 'wb').close()
+
+    def append(self, value):
+        self.strings.append(value)
+
+    def flush(self):
+        offsets = np.cumsum([len(string) for string in self.strings], dtype=np.int64) + self.heap_size
+        with open(self.path + '.heap', 'ab') as f:
+            f.write(''.join(self.strings))
+        with open(self.path + '.offsets', 'ab') as f:
+            offsets.tofile(f)
+        self.count += len(self.strings)
+        if len(offsets):
+            self.heap_size = int(offsets[-1])
+        del self.strings[:]
+
+    def save(self, path_prefix, order):
+        """Write the column, with its rows in the given order, and remove its files"""
+
+        self.flush()
+        write_npy(path_prefix + '.npy', np.uint32, len(order), iter_chunks(order, self.chunk_size))
+        offsets = read_raw(self.path + '.offsets', np.int64)
+        write_npy(path_prefix + '.offsets.npy', np.int64, self.count + 1,
+                  [np.zeros(1, dtype=np.int64)] + list(iter_chunks(offsets, self.chunk_size)))
+        heap = read_raw(self.path + '.heap', np.uint8)
+        write_npy(path_prefix + '.heap.npy', np.uint8, self.heap_size, iter_chunks(heap, self.chunk_size))
+        del offsets, heap
+        os.remove(self.path + '.offsets')
+        os.remove(self.path + '.heap')
+
+
+def parse_int(value):
+    """Return the int of a value if it prints the same as the int, or None"""
+
+    try:
+        int_value = int(value)
+    except ValueError:
+        return None
+    return int_value if MISSING_INT < int_value <= MAX_INT and str(int_value) == value else None
+
+
+def parse_float(value):
+    """Return the float of a value if it prints the same as the float, and isn't NaN, or None"""
+
+    try:
+        float_value = float(value)
+    except ValueError:
+        return None
+    return float_value if float_value == float_value and repr(float_value) == value else None
+
+
+def get_value_type(value):
+    """Return 'int' or 'float' if the value prints the same as an int or a float, and 'string' otherwise"""
+
+    if parse_int(value) is not None:
+        return 'int'
+    if parse_float(value) is not None:
+        return 'float'
+    return 'string'
+
+
+def build_population_store(sites_vcf, fields, store_path=None, chunk_size=CHUNK_SIZE):
+    """Extract the fields of each row of a sites VCF into a store.
+
+    Args:
+        sites_vcf: Path of the VCF, decomposed / normalized with vt, and bgzipped
+        fields: The INFO fields to extract, and 'Filter' for the FILTER column
+        store_path: Path of the store directory. It's written to a temp directory that is renamed at the end, so that
+            an annotation never sees a partial store. Default: see get_store_path
+        chunk_size: Number of rows read, and of keys sorted, at a time
+    """
+
+    if store_path is None:
+        store_path = get_store_path(sites_vcf)
+    fields = [field for i, field in enumerate(fields) if field not in fields[:i]]
+    fields_set = set(fields)
+    stat = os.stat(sites_vcf)
+    checksum = get_file_checksum(sites_vcf)
+
+    tmp_path = make_temp_dir(store_path)
+    try:
+        # the columns in the order of the VCF, until they are sorted
+        build_path = os.path.join(tmp_path, 'build')
+        os.mkdir(build_path)
+        chroms = []
+        chrom_indices = {}
+        allele_keys = array(INT64)
+        position_keys = array(INT64)
+        ref_column = RowStringColumnBuilder(os.path.join(build_path, 'ref'), chunk_size)
+        alt_column = RowStringColumnBuilder(os.path.join(build_path, 'alt'), chunk_size)
+        columns = [ColumnBuilder(os.path.join(build_path, 'field.%d' % i), chunk_size=chunk_size)
+                   for i in range(len(fields))]
+        row_count = 0
+        with gzip.open(sites_vcf) as vcf, open(os.path.join(build_path, 'allele_keys'), 'wb') as allele_keys_file, \
+                open(os.path.join(build_path, 'position_keys'), 'wb') as position_keys_file:
+            for row in vcf:
+                if row.startswith('#'):
+                    continue
+                chrom, pos, variant_id, ref, alt, qual, filter_value, info = row.rstrip('\n').split('\t', 8)[:8]
+                if "," in alt:
+                    raise ValueError("Found multiallelic variant: %s. Expecting a VCF that has been decomposed / "
+                                     "normalized with vt." % "-".join([chrom, pos, variant_id, ref, alt]))
+                chrom_index = chrom_indices.get(chrom)
+                if chrom_index is None:
+                    chrom_index = chrom_indices[chrom] = len(chroms)
+                    chroms.append(chrom)
+                pos = int(pos)
+                allele_keys.append(pack_allele_key(chrom, pos, ref, alt))
+                position_keys.append(chrom_index << 32 | pos)
+                ref_column.append(ref)
+                alt_column.append(alt)
+
+                values = {'Filter': filter_value} if 'Filter' in fields_set else {}
+                for kv in info.split(';'):
+                    key, _, value = kv.partition('=')
+                    if key in fields_set:
+                        values[key] = value
+                for field, column in zip(fields, columns):
+                    value = values.get(field)
+                    if value is None:
+                        column.append_missing()
+                    else:
+                        column.append(value)
+
+                row_count += 1
+                if row_count % chunk_size == 0:
+                    allele_keys.tofile(allele_keys_file)
+                    position_keys.tofile(position_keys_file)
+                    del allele_keys[:], position_keys[:]
+                    for column in [ref_column, alt_column] + columns:
+                        column.flush()
+            allele_keys.tofile(allele_keys_file)
+            position_keys.tofile(position_keys_file)
+        if row_count >= MISSING_STRING_ID:
+            raise ValueError("Too many rows for the string ids of the ref and alt columns: %d" % row_count)
+
+        # sort the rows by allele key, and the positions by position key
+        sort_keys(os.path.join(build_path, 'allele_keys'), os.path.join(build_path, 'sorted_allele_keys'),
+                  os.path.join(build_path, 'order'), build_path, chunk_size)
+        sort_keys(os.path.join(build_path, 'position_keys'), os.path.join(build_path, 'sorted_position_keys'),
+                  os.path.join(build_path, 'position_order'), build_path, chunk_size)
+        order = read_raw(os.path.join(build_path, 'order'), np.int64)
+        write_npy(os.path.join(tmp_path, 'allele_keys.npy'), np.int64, row_count,
+                  iter_chunks(read_raw(os.path.join(build_path, 'sorted_allele_keys'), np.int64), chunk_size))
+        write_npy(os.path.join(tmp_path, 'position_keys.npy'), np.int64, row_count,
+                  iter_chunks(read_raw(os.path.join(build_path, 'sorted_position_keys'), np.int64), chunk_size))
+
+        # the row of each VCF row in the store, to find the rows of the sorted positions
+        if row_count:
+            rows = np.memmap(os.path.join(build_path, 'rows'), dtype=np.int64, mode='w+', shape=(row_count,))
+            for start in xrange(0, row_count, chunk_size):
+                rows[order[start:start + chunk_size]] = np.arange(start, min(start + chunk_size, row_count))
+        else:
+            rows = np.zeros(0, dtype=np.int64)
+        write_npy(os.path.join(tmp_path, 'position_rows.npy'), np.int64, row_count,
+                  iter_chunks(rows, chunk_size, read_raw(os.path.join(build_path, 'position_order'), np.int64)))
+        del rows
+
+        ref_column.save(os.path.join(tmp_path, 'ref'), order)
+        alt_column.save(os.path.join(tmp_path, 'alt'), order)
+        column_types = [column.save(os.path.join(tmp_path, 'field.' + field), order)
+                        for field, column in zip(fields, columns)]
+        del order
+        shutil.rmtree(build_path)
+
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump({'version': STORE_VERSION, 'checksum': checksum, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                       'rows': row_count, 'chroms': chroms, 'fields': fields, 'column_types': column_types}, f,
+                      indent=1)
+
+        replace_store(tmp_path, store_path, checksum, fields)
+    except:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def replace_store(tmp_path, store_path, checksum, fields):
+    """Rename a new store into place. The old store is renamed aside first, so that the new one replaces it with the
+    next rename, and is removed after. If another builder renamed its store into place in between, that store is kept
+    if it was built from the same content of the VCF, with the fields, and an error is raised otherwise."""
+
+    old_path = None
+    if os.path.isdir(store_path):
+        old_path = make_temp_dir(store_path)
+        try:
+            os.rename(store_path, old_path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:  # another builder renamed it aside
+                raise
+            os.rmdir(old_path)
+            old_path = None
+    try:
+        os.rename(tmp_path, store_path)
+    except OSError as e:
+        if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+            raise
+        shutil.rmtree(tmp_path)
+        meta = read_store_meta(store_path)
+        if meta is None or meta['checksum'] != checksum or not set(fields) <= set(meta['fields']):
+            raise ValueError("Another store was built at %s while this one was built" % store_path)
+    finally:
+        if old_path is not None:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+
+def read_store_meta(store_path):
+    """Return the meta.json dict of a store, or None if it doesn't exist or isn't a store of this version"""
+
+    meta_path = os.path.join(store_path, 'meta.json')
+    if not os.path.isfile(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return meta if meta.get('version') == STORE_VERSION else None
+
+
+def is_store_up_to_date(sites_vcf, store_path, fields=()):
+    """Return whether the store exists, has all the fields, and was made from the current content of the VCF"""
+
+    meta = read_store_meta(store_path)
+    if meta is None or not set(fields) <= set(meta['fields']):
+        return False
+    unchanged, new_mtime = check_file(sites_vcf, meta['size'], meta['mtime'], meta['checksum'])
+    if new_mtime is not None:
+        save_store_mtime(store_path, meta['checksum'], new_mtime)
+    return unchanged
+
+
+def save_store_mtime(store_path, checksum, mtime):
+    """Save the new mtime of the VCF of a store in its meta.json, unless the store was replaced by one of another
+    content of the VCF in the meantime"""
+
+    meta = read_store_meta(store_path)
+    if meta is None or meta['checksum'] != checksum:
+        return
+    meta['mtime'] = mtime
+    try:
+        write_json(os.path.join(store_path, 'meta.json'), meta)
+    except (IOError, OSError):
+        pass  # e.g. a read-only store, which is still up to date: its checksum is computed again next time
+
+
+class StringColumn(object):
+    """The memory-mapped string ids of a column, and their strings, which are decoded once"""
+
+    def __init__(self, path_prefix):
+        self.ids = np.load(path_prefix + '.npy', mmap_mode='r')
+        self.offsets = np.load(path_prefix + '.offsets.npy', mmap_mode='r')
+        self.heap = np.load(path_prefix + '.heap.npy', mmap_mode='r')
+        self.strings = {MISSING_STRING_ID: None}
+
+    def get(self, rows):
+        strings = self.strings
+        values = []
+        for string_id in self.ids[rows].tolist():
+            string = strings.get(string_id)
+            if string is None and string_id != MISSING_STRING_ID:
+                string = strings[string_id] = self.heap[self.offsets[string_id]:self.offsets[string_id + 1]].tostring()
+            values.append(string)
+        return values
+
+
+class NumberColumn(object):
+    """A memory-mapped int32, int64 or float column"""
+
+    def __init__(self, path_prefix, column_type):
+        self.values = np.load(path_prefix + '.npy', mmap_mode='r')
+        self.format = repr if column_type == 'float' else str
+        self.missing = {'int32': MISSING_INT32, 'int64': MISSING_INT, 'float': None}[column_type]
+
+    def get(self, rows):
+        format_value = self.format
+        if self.missing is None:  # NaN
+            return [format_value(value) if value == value else None for value in self.values[rows].tolist()]
+        missing = self.missing
+        return [format_value(value) if value != missing else None for value in self.values[rows].tolist()]
+
+
+class PopulationStore(object):
+    """Read-only access to a store.
+
+    lookup(allele_keys) returns the row of each allele key, or -1, and get_column(field, rows) the values of a field
+    in rows, as they were in the VCF, or None if a row doesn't have the field.
+    """
+
+    def __init__(self, store_path):
+        self.meta = read_store_meta(store_path)
+        if self.meta is None:
+            raise ValueError("Not a population store: %s" % store_path)
+        self.fields = self.meta['fields']
+        self.chrom_indices = {chrom: i for i, chrom in enumerate(self.meta['chroms'])}
+        self.allele_keys = np.load(os.path.join(store_path, 'allele_keys.npy'), mmap_mode='r')
+        self.position_keys = np.load(os.path.join(store_path, 'position_keys.npy'), mmap_mode='r')
+        self.position_rows = np.load(os.path.join(store_path, 'position_rows.npy'), mmap_mode='r')
+        self.ref = StringColumn(os.path.join(store_path, 'ref'))
+        self.alt = StringColumn(os.path.join(store_path, 'alt'))
+        self.columns = {}
+        for field, column_type in zip(self.fields, self.meta['column_types']):
+            path_prefix = os.path.join(store_path, 'field.' + field)
+            self.columns[field] = StringColumn(path_prefix) if column_type == 'string' else \
+                NumberColumn(path_prefix, column_type)
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def lookup(self, allele_keys):
+        """Return the int64 array of the first row of each of an array of allele keys, or -1 if it's not in the store"""
+
+        allele_keys = np.asarray(allele_keys, dtype=np.int64)
+        rows = np.searchsorted(self.allele_keys, allele_keys)
+        found = rows < len(self.allele_keys)
+        found[found] = self.allele_keys[rows[found]] == allele_keys[found]
+        return np.where(found, rows, -1)
+
+    def get_column(self, field, rows):
+        return self.columns[field].get(rows)
+
+    def get_alleles_at(self, chrom, pos):
+        """Return the (ref, alt) of the rows at a position, in the order of the VCF"""
+
+        chrom_index = self.chrom_indices.get(chrom)
+        if chrom_index is None:
+            return []
+        position_key = chrom_index << 32 | pos
+        start = np.searchsorted(self.position_keys, position_key, 'left')
+        end = np.searchsorted(self.position_keys, position_key, 'right')
+        rows = self.position_rows[start:end]
+        return zip(self.ref.get(rows), self.alt.get(rows))
+
+
+def open_population_store(sites_vcf, fields, store_path=None):
+    """Return the PopulationStore of a sites VCF, building it first if it doesn't exist or is out of date"""
+
+    if store_path is None:
+        store_path = get_store_path(sites_vcf)
+    if not is_store_up_to_date(sites_vcf, store_path, fields):
+        build_population_store(sites_vcf, fields, store_path)
+    return PopulationStore(store_path)
+
+
+if __name__ == '__main__':
+    from add_population_fields import SOURCE_SPECS
+
+    parser = argparse.ArgumentParser(description='Extract the fields of a population dataset from its sites VCF into '
+                                                 'a memory-mapped store, for add_population_fields.py --store')
+    parser.add_argument('-i', '--input', required=True, help='Sites VCF, decomposed / normalized with vt')
+    parser.add_argument('-l', '--label', required=True, choices=list(SOURCE_SPECS), help='The dataset of the VCF')
+    parser.add_argument('-o', '--output', help='Store directory. Default: the VCF path + .store')
+    parser.add_argument('-f', '--force', action='store_true', help='Rebuild the store even if it is up to date')
+    args = parser.parse_args()
+
+    store_path = args.output or get_store_path(args.input)
+    fields = SOURCE_SPECS[args.label].fields
+    if args.force or not is_store_up_to_date(args.input, store_path, fields):
+        build_population_store(args.input, fields, store_path)
+        print("Built %s: %d rows" % (store_path, len(PopulationStore(store_path))))
+    else:
+        print("%s is up to date" % store_path)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+
+"""A Bloom filter of the positions of a sites VCF, so that add_population_fields.py --position-filter can skip the
+VCF lookup of a clinvar allele whose position is definitely not in the dataset, which is most of them for the
+coding-only datasets. The filter never misses a position that is in the VCF; a position that isn't may pass it with
+about the false positive rate it was built for, and is then looked up as usual, so the output is the same either way.
+
+Positions rather than alleles are filtered, because a clinvar allele at a position of the VCF is counted and reported
+by how its alleles mismatch, which needs the VCF rows.
+
+The filter is built once next to the VCF, and rebuilt when its checksum changes (as in population_store.py):
+
+    <vcf>.positions.bloom.npy   the bits, as uint8, memory-mapped when the filter is opened
+    <vcf>.positions.bloom.json  version, md5, size and mtime of the VCF, the number of positions, the number of bits and
+                                hashes, and the false positive rate it was built for
+
+    python position_filter.py -i gnomad.genomes.r2.0.1.sites.normalized.vcf.gz
+"""
+
+import argparse
+import gzip
+import json
+import math
+import os
+import zlib
+from array import array
+
+import numpy as np
+
+from allele_key import CHROMOSOME_CODES
+from file_cache import INT64, check_file, get_file_checksum, make_temp_file, to_numpy, write_json
+
+FILTER_VERSION = 1
+FALSE_POSITIVE_RATE = 0.01
+ADD_CHUNK_SIZE = 2**20  # the bits of this many keys are computed at a time
+
+# splitmix64 constants, to spread the position keys over the bits
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+MIX_MULTIPLIER_1 = np.uint64(0xBF58476D1CE4E5B9)
+MIX_MULTIPLIER_2 = np.uint64(0x94D049BB133111EB)
+ONE = np.uint64(1)
+SEVEN = np.uint64(7)
+
+
+def get_filter_path(sites_vcf):
+    """Return the default path prefix of the filter of a VCF, without the .npy and .json extensions"""
+    return sites_vcf + '.positions.bloom'
+
+
+def pack_position_key(chrom, pos):
+    """Return an int64 key of a position. Positions on the chromosomes of allele_key have distinct keys; the other
+    contigs share keys by the crc32 of their name, which only makes more false positives."""
+
+    chrom_code = CHROMOSOME_CODES.get(chrom)
+    if chrom_code is None:
+        chrom_code = len(CHROMOSOME_CODES) + (zlib.crc32(chrom) & 0xffff)
+    return chrom_code << 32 | int(pos)
+
+
+def mix(keys):
+    """Return the splitmix64 hash of an array of uint64"""
+
+    z = keys + GOLDEN_GAMMA
+    z = (z ^ (z >> np.uint64(30))) * MIX_MULTIPLIER_1
+    z = (z ^ (z >> np.uint64(27))) * MIX_MULTIPLIER_2
+    return z ^ (z >> np.uint64(31))
+
+
+class PositionFilter(object):
+    """Bloom filter of position keys, with hash_count bits per key from double hashing of the splitmix64 hash.
+
+    Args:
+        bits: uint8 array of the bits
+        hash_count: Number of bits set per key
+        key_count: Number of distinct keys added
+    """
+
+    def __init__(self, bits, hash_count, key_count=0):
+        self.bits = bits
+        self.bit_count = len(bits) * 8
+        self.hash_count = hash_count
+        self.key_count = key_count
+
+    def get_bit_indices(self, keys):
+        """Return a (hash_count, len(keys)) array of the bits of each key"""
+
+        with np.errstate(over='ignore'):
+            h1 = mix(np.asarray(keys, dtype=np.int64).astype(np.uint64))
+            h2 = mix(h1) | ONE
+            steps = np.arange(self.hash_count, dtype=np.uint64)[:, np.newaxis]
+            return (h1 + steps * h2) % np.uint64(self.bit_count)
+
+    def add(self, keys):
+        """Add an array of distinct keys that weren't added before"""
+
+        indices = self.get_bit_indices(keys).ravel()
+        np.bitwise_or.at(self.bits, indices >> np.uint64(3), (ONE << (indices & SEVEN)).astype(np.uint8))
+        self.key_count += len(keys)
+
+    def contains(self, keys):
+        """Return a bool array of whether each key may have been added. False is definite."""
+
+        indices = self.get_bit_indices(keys)
+        set_bits = self.bits[indices >> np.uint64(3)] & (ONE << (indices & SEVEN)).astype(np.uint8)
+        return set_bits.all(axis=0)
+
+    def get_false_positive_rate(self):
+        """Return the expected false positive rate for the number of keys added"""
+        return (1 - math.exp(-float(self.hash_count) * self.key_count / self.bit_count)) ** self.hash_count
+
+
+def make_position_filter(key_count, false_positive_rate=FALSE_POSITIVE_RATE):
+    """Return an empty PositionFilter of the optimal size for key_count keys at the false positive rate"""
+
+    key_count = max(key_count, 1)
+    bit_count = int(math.ceil(-key_count * math.log(false_positive_rate) / math.log(2) ** 2))
+    hash_count = max(1, int(round(float(bit_count) / key_count * math.log(2))))
+    return PositionFilter(np.zeros((bit_count + 7) // 8, dtype=np.uint8), hash_count)
+
+
+def build_position_filter(sites_vcf, filter_path=None, false_positive_rate=FALSE_POSITIVE_RATE):
+    """Add the positions of each row of a sites VCF to a filter.
+
+    Args:
+        sites_vcf: Path of the VCF, bgzipped
+        filter_path: Path prefix of the filter. Default: see get_filter_path
+        false_positive_rate: Expected false positive rate of the filter
+    """
+
+    if filter_path is None:
+        filter_path = get_filter_path(sites_vcf)
+    stat = os.stat(sites_vcf)
+    checksum = get_file_checksum(sites_vcf)
+
+    position_keys = array(INT64)
+    with gzip.open(sites_vcf) as vcf:
+        for row in vcf:
+            if row.startswith('#'):
+                continue
+            chrom, pos = row.split('\t', 2)[:2]
+            key = pack_position_key(chrom, pos)
+            if not position_keys or position_keys[-1] != key:  # the rows at a position are next to each other
+                position_keys.append(key)
+    position_keys = np.unique(to_numpy(position_keys, np.int64))
+
+    position_filter = make_position_filter(len(position_keys), false_positive_rate)
+    for start in range(0, len(position_keys), ADD_CHUNK_SIZE):
+        position_filter.add(position_keys[start:start + ADD_CHUNK_SIZE])
+
+    npy_fd, npy_tmp_path = make_temp_file(filter_path + '.npy')
+    json_fd, json_tmp_path = make_temp_file(filter_path + '.json')
+    try:
+        with os.fdopen(npy_fd, 'wb') as f:
+            np.save(f, position_filter.bits)
+        with os.fdopen(json_fd, 'w') as f:
+            json.dump({'version': FILTER_VERSION, 'checksum': checksum, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                       'positions': len(position_keys), 'bits': position_filter.bit_count,
+                       'hashes': position_filter.hash_count, 'false_positive_rate': false_positive_rate}, f,
+                      indent=1)
+
+        # the .json is renamed last, so that an annotation never sees a partial filter
+        if os.path.isfile(filter_path + '.json'):
+            os.remove(filter_path + '.json')
+        os.rename(npy_tmp_path, filter_path + '.npy')
+        os.rename(json_tmp_path, filter_path + '.json')
+    except:
+        for tmp_path in (npy_tmp_path, json_tmp_path):
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+        raise
+
+
+def read_filter_meta(filter_path):
+    """Return the .json dict of a filter, or None if it doesn't exist or isn't a filter of this version"""
+
+    if not os.path.isfile(filter_path + '.json') or not os.path.isfile(filter_path + '.npy'):
+        return None
+    with open(filter_path + '.json') as f:
+        meta = json.load(f)
+    return meta if meta.get('version') == FILTER_VERSION else None
+
+
+def is_filter_up_to_date(sites_vcf, filter_path, false_positive_rate=FALSE_POSITIVE_RATE):
+    """Return whether the filter exists, was built for the false positive rate, and from the current content of the
+    VCF"""
+
+    meta = read_filter_meta(filter_path)
+    if meta is None or meta['false_positive_rate'] != false_positive_rate:
+        return False
+    unchanged, new_mtime = check_file(sites_vcf, meta['size'], meta['mtime'], meta['checksum'])
+    if new_mtime is not None:
+        save_filter_mtime(filter_path, meta['checksum'], new_mtime)
+    return unchanged
+
+
+def save_filter_mtime(filter_path, checksum, mtime):
+    """Save the new mtime of the VCF of a filter in its .json, unless the filter was replaced by one of another content
+    of the VCF in the meantime"""
+
+    meta = read_filter_meta(filter_path)
+    if meta is None or meta['checksum'] != checksum:
+        return
+    meta['mtime'] = mtime
+    try:
+        write_json(filter_path + '.json', meta)
+    except (IOError, OSError):
+        pass  # e.g. a read-only filter, which is still up to date: its checksum is computed again next time
+
+
+def open_position_filter(sites_vcf, false_positive_rate=FALSE_POSITIVE_RATE, filter_path=None):
+    """Return the PositionFilter of a sites VCF, building it first if it doesn't exist or is out of date.
+
+    Return:
+        (PositionFilter, its meta dict)
+    """
+
+    if filter_path is None:
+        filter_path = get_filter_path(sites_vcf)
+    if not is_filter_up_to_date(sites_vcf, filter_path, false_positive_rate):
+        build_position_filter(sites_vcf, filter_path, false_positive_rate)
+    meta = read_filter_meta(filter_path)
+    return PositionFilter(np.load(filter_path + '.npy', mmap_mode='r'), meta['hashes'], meta['positions']), meta
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the Bloom filter of the positions of a sites VCF, for '
+                                                 'add_population_fields.py --position-filter')
+    parser.add_argument('-i', '--input', required=True, help='Sites VCF')
+    parser.add_argument('-o', '--output', help='Path prefix of the filter. Default: the VCF path + .positions.bloom')
+    parser.add_argument('-p', '--false-positive-rate', type=float, default=FALSE_POSITIVE_RATE,
+                        help='Expected false positive rate. Default: %(default)s')
+    parser.add_argument('-f', '--force', action='store_true', help='Rebuild the filter even if it is up to date')
+    args = parser.parse_args()
+
+    filter_path = args.output or get_filter_path(args.input)
+    if args.force or not is_filter_up_to_date(args.input, filter_path, args.false_positive_rate):
+        build_position_filter(args.input, filter_path, args.false_positive_rate)
+        meta = read_filter_meta(filter_path)
+        print("Built %s: %d positions, %d bits, %d hashes" % (filter_path, meta['positions'], meta['bits'],
+                                                              meta['hashes']))
+    else:
+        print("%s is up to date" % filter_path)
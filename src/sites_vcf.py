@@ -0,0 +1,92 @@
+"""Read the rows of a tabix-indexed sites VCF (eg. ExAC or gnomAD, decomposed and normalized with vt) at the
+position of each allele of a clinvar table.
+
+Both readers have a get_rows(chrom, pos) method that returns the rows of the VCF whose POS is pos, split into fields,
+in the order of the VCF:
+
+    TabixSitesVcfReader does a tabix fetch for each position: a seek in the index and the decompression of a BGZF block
+        per clinvar allele.
+    SortedSitesVcfReader reads through each chromosome of the VCF once, if the positions are asked for in order, as in
+        the coordinate-sorted clinvar_alleles tables. It only seeks when a chromosome starts, when a position is
+        before the previous one, and when the next position is more than max_scan_distance bp past the last row read,
+        so that the sparse parts of the clinvar table don't read through the whole VCF.
+"""
+
+MAX_SCAN_DISTANCE = 100000
+
+
+class TabixSitesVcfReader(object):
+    """Look up each position with a tabix fetch.
+
+    Args:
+        tabix_file: pysam.TabixFile of the sites VCF
+    """
+
+    def __init__(self, tabix_file):
+        self.tabix_file = tabix_file
+        self.seeks = 0
+        self.rows_read = 0
+
+    def get_rows(self, chrom, pos):
+        # tabix returns all the rows that overlap pos, including the indels that start before it
+        self.seeks += 1
+        rows = []
+        for row in self.tabix_file.fetch(chrom, pos - 1, pos):
+            self.rows_read += 1
+            fields = row.split('\t')
+            if fields[1] == str(pos):
+                rows.append(fields)
+        return rows
+
+
+class SortedSitesVcfReader(object):
+    """Merge the positions, in coordinate order, with the rows of the sites VCF.
+
+    Args:
+        tabix_file: pysam.TabixFile of the sites VCF
+        max_scan_distance: Seek to the next position instead of reading through the rows before it when it's more
+            than this many bp past the last row read
+    """
+
+    def __init__(self, tabix_file, max_scan_distance=MAX_SCAN_DISTANCE):
+        self.tabix_file = tabix_file
+        self.max_scan_distance = max_scan_distance
+        self.seeks = 0
+        self.rows_read = 0
+
+        self.chrom = None
+        self.pos = None
+        self.rows = []  # the rows at self.pos
+        self.vcf_rows = None  # iterator over the rows of self.chrom
+        self.next_row = None  # next row of vcf_rows, and its pos. None at the end of the chromosome.
+        self.next_pos = None
+
+    def seek(self, chrom, pos):
+        self.seeks += 1
+        self.chrom = chrom
+        self.vcf_rows = self.tabix_file.fetch(chrom, pos - 1)
+        self.read_next_row()
+
+    def read_next_row(self):
+        for row in self.vcf_rows:
+            self.rows_read += 1
+            self.next_row = row
+            self.next_pos = int(row.split('\t', 2)[1])
+            return
+        self.next_row = self.next_pos = None
+
+    def get_rows(self, chrom, pos):
+        if chrom == self.chrom and pos == self.pos:
+            return self.rows  # the alleles of a position are next to each other in the clinvar table
+        if chrom != self.chrom or pos < self.pos or (
+                self.next_row is not None and pos - self.next_pos > self.max_scan_distance):
+            self.seek(chrom, pos)
+        self.pos = pos
+
+        while self.next_row is not None and self.next_pos < pos:
+            self.read_next_row()
+        self.rows = []
+        while self.next_row is not None and self.next_pos == pos:
+            self.rows.append(self.next_row.split('\t'))
+            self.read_next_row()
+        return self.rows
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+"""Sort a table by chrom, pos, ref and alt, with the chromosomes in their natural order (1..22, X, Y, MT, then any
+others in lexicographic order), and write it as BGZF so it can be indexed with tabix -S 1 -s 1 -b 2 -e 2.
+
+The table is read once. Its lines are split up by chromosome and buffered in memory, and whenever the buffers
+reach the memory budget, each one is sorted and spilled to disk as a run. The chromosomes are then sorted in
+parallel: each worker merges the runs of a chromosome with the rest of its lines into a BGZF part, and the parts are
+concatenated in chromosome order. Lines with the same chrom, pos, ref and alt are ordered by the whole line, like
+LC_ALL=C sort -k1,1 -k2,2n -k3,3 -k4,4.
+
+    python sort_table.py -i clinvar_table_normalized.single.b37.tsv -o clinvar_allele_trait_pairs.single.b37.tsv.gz
+"""
+
+import argparse
+import gzip
+import heapq
+import itertools
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+from bgzf import BgzfWriter
+
+CHROMOSOME_ORDER = [str(i) for i in range(1, 23)] + ['X', 'Y', 'MT']
+CHROMOSOME_RANKS = {chrom: i for i, chrom in enumerate(CHROMOSOME_ORDER)}
+
+SORT_MEMORY_MB = 1024  # default memory budget for the buffered lines
+LINE_OVERHEAD = 100  # approximate number of bytes that python uses for a line on top of its characters
+
+_partitions = {}  # chromosome -> TablePartition, inherited by the workers of sort_table
+
+
+def get_chromosome_sort_key(chrom):
+    return CHROMOSOME_RANKS.get(chrom, len(CHROMOSOME_ORDER)), chrom
+
+
+def get_line_sort_key(line):
+    """Return the (pos, ref, alt, line) sort key of a line within its chromosome"""
+
+    fields = line.split('\t', 4)
+    return int(fields[1]), fields[2], fields[3].rstrip('\n'), line
+
+
+class TablePartition(object):
+    """The lines of one chromosome: the ones that are buffered in memory, and the paths of the sorted runs that were
+    spilled to disk"""
+
+    def __init__(self):
+        self.lines = []
+        self.runs = []
+
+    def spill(self, path):
+        self.lines.sort(key=get_line_sort_key)
+        with open(path, 'wb') as run:
+            run.writelines(self.lines)
+        self.runs.append(path)
+        self.lines = []
+
+
+def partition_table(infile, tmp_dir, memory_budget):
+    """Split up the lines of a table by chromosome, spilling sorted runs to tmp_dir when more than memory_budget
+    bytes are buffered.
+
+    Return:
+        (header, partitions) where partitions is a dict that maps each chromosome to its TablePartition
+    """
+
+    header = next(infile)
+    partitions = {}
+    buffered = 0
+    spills = 0
+    for line in infile:
+        if not line.strip():
+            continue
+        chrom = line[:line.index('\t')]
+        partition = partitions.get(chrom)
+        if partition is None:
+            partition = partitions[chrom] = TablePartition()
+        partition.lines.append(line)
+        buffered += len(line) + LINE_OVERHEAD
+        if buffered >= memory_budget:
+            for i, partition in enumerate(partitions.values()):
+                if partition.lines:
+                    partition.spill(os.path.join(tmp_dir, 'run_%d_%d.tsv' % (spills, i)))
+            spills += 1
+            buffered = 0
+
+    return header, partitions
+
+
+def iter_run(path):
+    with open(path, 'rb') as run:
+        for line in run:
+            yield get_line_sort_key(line)
+
+
+def _sort_chromosome(args):
+    """Worker for sort_table: merge the runs and buffered lines of a chromosome of _partitions into a BGZF file.
+
+    Return:
+        The number of lines written
+    """
+
+    chrom, part_path = args
+    partition = _partitions[chrom]
+    runs = [iter_run(path) for path in partition.runs]
+    runs.append(iter(sorted(itertools.imap(get_line_sort_key, partition.lines))))
+
+    count = 0
+    writer = BgzfWriter(open(part_path, 'wb'))
+    for key in heapq.merge(*runs):
+        writer.write(key[3])
+        count += 1
+    writer.close()
+
+    return count
+
+
+def sort_table(infile, output, memory_mb=SORT_MEMORY_MB, workers=1, tmp_dir=None):
+    """Sort a table by chrom, pos, ref, alt (see module docstring).
+
+    Args:
+        infile: Input file stream of the table, whose first line is the header, and first 4 columns are chrom, pos,
+            ref and alt
+        output: BgzfWriter to write the sorted table to
+        memory_mb: Number of MB of lines to buffer before spilling sorted runs to disk. While the workers sort, they
+            need up to about twice that.
+        workers: Number of processes to sort the chromosomes with
+        tmp_dir: Directory for the runs and the parts of the output. Default: the system's temp dir
+
+    Return:
+        The number of lines written, not counting the header
+    """
+
+    global _partitions
+
+    tmp_dir = tempfile.mkdtemp(prefix='sort_table_', dir=tmp_dir)
+    try:
+        header, _partitions = partition_table(infile, tmp_dir, memory_mb * 2**20)
+        chroms = sorted(_partitions, key=get_chromosome_sort_key)
+        tasks = [(chrom, os.path.join(tmp_dir, 'part_%d.bgz' % i)) for i, chrom in enumerate(chroms)]
+
+        output.write(header)
+        count = 0
+        if workers > 1:
+            # the workers are forked after the table was read, so they share the buffered lines
+            pool = multiprocessing.Pool(workers)
+            try:
+                for (chrom, part_path), part_count in zip(tasks, pool.imap(_sort_chromosome, tasks)):
+                    output.append_file(part_path)
+                    os.remove(part_path)
+                    count += part_count
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            for chrom, part_path in tasks:
+                count += _sort_chromosome((chrom, part_path))
+                _partitions[chrom] = None  # free its memory
+                output.append_file(part_path)
+                os.remove(part_path)
+    finally:
+        _partitions = {}
+        shutil.rmtree(tmp_dir)
+
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sort a table by chrom, pos, ref, alt in natural chromosome order, '
+                                                 'and write it as BGZF.')
+    parser.add_argument('-i', '--input', help='Tab-delimited table with a header (may be gzipped). Default: stdin')
+    parser.add_argument('-o', '--output', help='Path of the BGZF output. Default: stdout')
+    parser.add_argument('-m', '--memory-mb', type=int, default=SORT_MEMORY_MB,
+                        help='Memory budget for the lines that are buffered before sorted runs are spilled to disk')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Number of processes to sort the chromosomes with')
+    parser.add_argument('-T', '--tmp-dir', help='Directory for the spilled runs. Default: the system\'s temp dir')
+    args = parser.parse_args()
+
+    if args.input is None:
+        infile = sys.stdin
+    elif args.input.endswith('.gz'):
+        infile = gzip.open(args.input)
+    else:
+        infile = open(args.input)
+
+    output = BgzfWriter(open(args.output, 'wb') if args.output is not None else sys.stdout)
+    count = sort_table(infile, output, memory_mb=args.memory_mb, workers=args.workers, tmp_dir=args.tmp_dir)
+    output.close()
+
+    sys.stderr.write("Sorted %d rows\n" % count)
@@ -0,0 +1,92 @@
+"""Split a bgzipped, tabix-indexed table into regions that hold about the same amount of data, using its .tbi index,
+so that they can be processed in parallel without reading the table first.
+
+The .tbi index (see the tabix section of the SAM spec) has, for each sequence, the bins of the binning index, with
+the virtual offsets of their chunks, and a linear index: the virtual offset of the first record that overlaps each
+16 kb window. The compressed bytes between the offsets of two windows are the size of their data.
+"""
+
+import gzip
+import struct
+
+from bgzf import split_virtual_offset
+
+TABIX_MAGIC = 'TBI\1'
+TABIX_WINDOW_SIZE = 2**14
+TABIX_METADATA_BIN = 37450  # pseudo-bin of the number of mapped and unmapped records, not a real bin
+
+INT32 = struct.Struct('<i')
+UINT32 = struct.Struct('<I')
+
+
+def read_tabix_index(tbi_path):
+    """Return the [(sequence name, linear index, virtual offset of the end of its last chunk)] of a .tbi file, in
+    the order of the table"""
+
+    with gzip.open(tbi_path) as f:
+        data = f.read()
+    if data[:4] != TABIX_MAGIC:
+        raise ValueError("Not a tabix index: %s" % tbi_path)
+
+    n_ref = INT32.unpack_from(data, 4)[0]
+    names_length = INT32.unpack_from(data, 32)[0]
+    names = data[36:36 + names_length].split('\0')[:n_ref]
+    offset = 36 + names_length
+
+    sequences = []
+    for name in names:
+        n_bin = INT32.unpack_from(data, offset)[0]
+        offset += 4
+        begin = end = None
+        for i in range(n_bin):
+            bin_number = UINT32.unpack_from(data, offset)[0]
+            n_chunk = INT32.unpack_from(data, offset + 4)[0]
+            offset += 8
+            if bin_number != TABIX_METADATA_BIN:
+                for j in range(n_chunk):
+                    chunk_begin, chunk_end = struct.unpack_from('<QQ', data, offset + 16 * j)
+                    begin = chunk_begin if begin is None else min(begin, chunk_begin)
+                    end = chunk_end if end is None else max(end, chunk_end)
+            offset += 16 * n_chunk
+
+        n_intv = INT32.unpack_from(data, offset)[0]
+        offset += 4
+        linear_index = list(struct.unpack_from('<%dQ' % n_intv, data, offset))
+        offset += 8 * n_intv
+        if begin is None:  # no records
+            continue
+        # the windows before the first record have offset 0
+        sequences.append((name, [max(virtual_offset, begin) for virtual_offset in linear_index], end))
+    return sequences
+
+
+def get_balanced_regions(tbi_path, region_count):
+    """Split a table into about region_count regions of about the same compressed size. Each region is in one
+    sequence, and starts and ends at the boundaries of 16 kb windows.
+
+    Return:
+        List of (sequence name, start, end) in the order of the table, with 0-based start and end as in
+        pysam.TabixFile.fetch: the records of a region are those that overlap [start, end). end is None for the
+        last region of a sequence, so that each record is in exactly one region.
+    """
+
+    sequences = read_tabix_index(tbi_path)
+    window_sizes = []
+    for name, linear_index, end in sequences:
+        block_offsets = [split_virtual_offset(virtual_offset)[0] for virtual_offset in linear_index + [end]]
+        window_sizes.append([block_offsets[i + 1] - block_offsets[i] for i in range(len(linear_index))])
+    total_size = sum(sum(sizes) for sizes in window_sizes)
+    region_size = max(1, total_size // max(1, region_count))
+
+    regions = []
+    for (name, linear_index, end), sizes in zip(sequences, window_sizes):
+        start = 0
+        size = 0
+        for i, window_size in enumerate(sizes):
+            size += window_size
+            if size >= region_size and i + 1 < len(sizes):
+                regions.append((name, start, (i + 1) * TABIX_WINDOW_SIZE))
+                start = (i + 1) * TABIX_WINDOW_SIZE
+                size = 0
+        regions.append((name, start, None))
+    return regions
@@ -0,0 +1,135 @@
+"""Records for the rows of the tab-delimited tables of the pipeline, instead of a dict(zip(header, fields)) per row.
+
+A record class is made for a header with make_record_class. Its records keep the fields of a row in a list, and have
+no __dict__, so making one only allocates the record itself, and its fields are read and written by index
+(record[3]), by column name (record['alt']), or as attributes (record.alt):
+
+    ClinvarRecord = make_record_class(HEADER, 'ClinvarRecord')
+    reader = TableReader(gzip.open('clinvar_alleles.single.b37.tsv.gz'))
+    for record in reader:
+        print(record.chrom, record.pos)
+"""
+
+import keyword
+from collections import OrderedDict
+
+
+class TableRecord(object):
+    """Base class of the record classes made by make_record_class"""
+
+    __slots__ = ('fields',)
+    COLUMNS = ()
+    INDICES = {}
+
+    def __init__(self, fields=None):
+        self.fields = fields if fields is not None else [''] * len(self.COLUMNS)
+
+    @classmethod
+    def from_line(cls, line):
+        return cls(line.rstrip('\n').split('\t'))
+
+    def __getitem__(self, key):
+        return self.fields[key if key.__class__ is int else self.INDICES[key]]
+
+    def __setitem__(self, key, value):
+        self.fields[key if key.__class__ is int else self.INDICES[key]] = value
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __eq__(self, other):
+        return self.__class__ is other.__class__ and self.fields == other.fields
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.fields)
+
+    def get(self, column_name, default=None):
+        i = self.INDICES.get(column_name)
+        return self.fields[i] if i is not None and i < len(self.fields) else default
+
+    def update(self, values):
+        """Set the fields of the column names in a dict"""
+        for column_name, value in values.iteritems():
+            self.fields[self.INDICES[column_name]] = value
+
+    def to_line(self):
+        return '\t'.join(self.fields) + '\n'
+
+    def as_dict(self):
+        return OrderedDict(zip(self.COLUMNS, self.fields))
+
+
+def make_field_property(i):
+    def get_field(record):
+        return record.fields[i]
+
+    def set_field(record, value):
+        record.fields[i] = value
+
+    return property(get_field, set_field)
+
+
+def make_record_class(column_names, class_name='Record'):
+    """Return a subclass of TableRecord for the rows of a table with these columns. The columns whose names are
+    valid identifiers, and don't clash with a method, are also attributes of the records."""
+
+    attributes = {
+        '__slots__': (),
+        'COLUMNS': tuple(column_names),
+        'INDICES': {column_name: i for i, column_name in enumerate(column_names)},
+    }
+    for i, column_name in enumerate(column_names):
+        if (column_name and (column_name[0].isalpha() or column_name[0] == '_') and
+                column_name.replace('_', 'a').isalnum() and not keyword.iskeyword(column_name) and
+                not hasattr(TableRecord, column_name)):
+            attributes[column_name] = make_field_property(i)
+    return type(class_name, (TableRecord,), attributes)
+
+
+class TableReader(object):
+    """Iterate over the rows of a tab-delimited table with a header line, as records.
+
+    Args:
+        infile: Input file stream, whose first line is the header
+        record_class: Record class of the table. Default: a record class made for its header
+    """
+
+    def __init__(self, infile, record_class=None):
+        self.infile = infile
+        self.column_names = next(infile).rstrip('\n').split('\t')
+        if record_class is None:
+            record_class = make_record_class(self.column_names)
+        elif list(record_class.COLUMNS) != self.column_names:
+            raise ValueError("Unexpected header: %s" % '\t'.join(self.column_names))
+        self.record_class = record_class
+
+    def __iter__(self):
+        record_class = self.record_class
+        for line in self.infile:
+            yield record_class(line.rstrip('\n').split('\t'))
+
+
+class TableWriter(object):
+    """Write records to a tab-delimited table, after its header line.
+
+    Args:
+        outfile: Output file stream
+        column_names: The columns of the table
+    """
+
+    def __init__(self, outfile, column_names):
+        self.outfile = outfile
+        self.column_names = list(column_names)
+        outfile.write('\t'.join(self.column_names) + '\n')
+
+    def write(self, record):
+        self.outfile.write('\t'.join(record.fields) + '\n')
+
+    def write_fields(self, fields):
+        self.outfile.write('\t'.join(fields) + '\n')
@@ -0,0 +1,135 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from add_population_fields import NEEDED_EXAC_FIELDS, NEEDED_GNOMAD_FIELDS, PopulationSource, \
+    StorePopulationSource, SOURCE_SPECS, add_population_fields, add_population_fields_in_parallel
+from bgzf import BgzfWriter
+from population_store import open_population_store
+from position_filter import open_position_filter
+from sites_vcf import SortedSitesVcfReader, TabixSitesVcfReader
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+CLINVAR_HEADER = ['chrom', 'pos', 'ref', 'alt', 'allele_id']
+CLINVAR_ROWS = [
+    ['1', '100', 'A', 'G', '1'],
+    ['1', '100', 'A', 'C', '2'],
+    ['1', '200', 'AT', 'A', '3'],
+    ['2', '50', 'C', 'T', '4'],
+    ['MT', '10', 'G', 'A', '5'],
+]
+
+
+@unittest.skipIf(pysam is None, 'pysam is not installed')
+class TestAddPopulationFields(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.exac_path = self.write_vcf('exac.vcf.gz', [('1', 100, 'A', 'G'), ('1', 200, 'A', 'T'), ('2', 50, 'C', 'T')],
+                                        NEEDED_EXAC_FIELDS)
+        # the gnomAD rows only have some of the fields
+        self.gnomad_path = self.write_vcf('gnomad.vcf.gz', [('1', 100, 'A', 'C'), ('2', 50, 'C', 'T')], ['AC', 'AN'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_vcf(self, filename, variants, fields):
+        path = os.path.join(self.tmp_dir, filename)
+        vcf = BgzfWriter(open(path, 'wb'))
+        vcf.write('##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+        for chrom, pos, ref, alt in variants:
+            info = ';'.join('%s=%s%s' % (field, field, pos) for field in fields if field != 'Filter')
+            vcf.write('%s\t%d\t.\t%s\t%s\t100\tPASS\t%s\n' % (chrom, pos, ref, alt, info))
+        vcf.close()
+        pysam.tabix_index(path, preset='vcf')
+        return path
+
+    def annotate(self, make_source):
+        sources = [make_source('gnomad_exomes', self.gnomad_path), make_source('exac_v1', self.exac_path)]
+        clinvar_f = StringIO(''.join('\t'.join(row) + '\n' for row in [CLINVAR_HEADER] + CLINVAR_ROWS))
+        outputs = [StringIO(), StringIO(), StringIO()]
+        self.assertEqual(add_population_fields(clinvar_f, sources, outputs[:2], outputs[2]), len(CLINVAR_ROWS))
+        return sources, [[line.split('\t') for line in output.getvalue().splitlines()] for output in outputs]
+
+    def make_sorted_source(self, label, path):
+        return PopulationSource(label, SortedSitesVcfReader(pysam.TabixFile(path)))
+
+    def make_tabix_source(self, label, path):
+        return PopulationSource(label, TabixSitesVcfReader(pysam.TabixFile(path)))
+
+    def make_filtered_source(self, label, path):
+        position_filter, meta = open_position_filter(path)
+        return PopulationSource(label, TabixSitesVcfReader(pysam.TabixFile(path)), position_filter)
+
+    def make_store_source(self, label, path):
+        return StorePopulationSource(label, open_population_store(path, SOURCE_SPECS[label].fields))
+
+    def test_add_population_fields(self):
+        sources, (gnomad, exac, combined) = self.annotate(self.make_sorted_source)
+
+        self.assertEqual(gnomad[0], CLINVAR_HEADER + NEEDED_GNOMAD_FIELDS)
+        self.assertEqual(exac[0], CLINVAR_HEADER + NEEDED_EXAC_FIELDS)
+        self.assertEqual(combined[0], CLINVAR_HEADER + ['gnomad_exomes_' + field for field in NEEDED_GNOMAD_FIELDS] +
+                         ['exac_v1_' + field for field in NEEDED_EXAC_FIELDS])
+        for rows in (gnomad, exac, combined):
+            self.assertEqual(len(rows), len(CLINVAR_ROWS) + 1)
+            self.assertEqual(set(len(row) for row in rows), set([len(rows[0])]))
+        for i, row in enumerate(CLINVAR_ROWS, 1):
+            self.assertEqual(combined[i], gnomad[i] + exac[i][len(CLINVAR_HEADER):])
+
+        gnomad_values = [dict(zip(NEEDED_GNOMAD_FIELDS, row[len(CLINVAR_HEADER):])) for row in gnomad[1:]]
+        self.assertEqual([(values['Filter'], values['AC'], values['AF_AMR']) for values in gnomad_values],
+                         [('', '', ''), ('PASS', 'AC100', ''), ('', '', ''), ('PASS', 'AC50', ''), ('', '', '')])
+        exac_values = [dict(zip(NEEDED_EXAC_FIELDS, row[len(CLINVAR_HEADER):])) for row in exac[1:]]
+        self.assertEqual([values['AC_Adj'] for values in exac_values], ['AC_Adj100', '', '', 'AC_Adj50', ''])
+
+        self.assertEqual(dict(sources[1].counts), {
+            'total_clinvar_variants': 4,
+            'clinvar_variants_with_matching_position_and_matching_allele': 2,
+            'clinvar_snp_with_mismatching_alt_allele_in_exac': 1,
+            'clinvar_indel_with_no_matching_allele_in_exac': 1,
+        })
+
+    def test_other_sources(self):
+        sources, outputs = self.annotate(self.make_sorted_source)
+        for make_source in (self.make_tabix_source, self.make_store_source, self.make_filtered_source):
+            other_sources, other_outputs = self.annotate(make_source)
+            self.assertEqual(other_outputs, outputs)
+            self.assertEqual([source.counts for source in other_sources], [source.counts for source in sources])
+
+        # only 1:200 isn't in the gnomAD VCF, and isn't fetched
+        self.assertEqual([source.skipped_lookups for source in other_sources], [1, 0])
+        self.assertEqual([source.sites_vcf.seeks for source in other_sources], [3, 4])
+
+    def test_parallel(self):
+        sources, outputs = self.annotate(self.make_sorted_source)
+        clinvar_path = os.path.join(self.tmp_dir, 'clinvar.tsv.gz')
+        clinvar = BgzfWriter(open(clinvar_path, 'wb'))
+        clinvar.write(''.join('\t'.join(row) + '\n' for row in [CLINVAR_HEADER] + CLINVAR_ROWS))
+        clinvar.close()
+        pysam.tabix_index(clinvar_path, seq_col=0, start_col=1, end_col=1, line_skip=1, force=True)
+
+        for store in (False, True):
+            output_paths = [os.path.join(self.tmp_dir, '%s_%d.tsv.gz' % (name, store)) for name in ('gnomad', 'exac', 'combined')]
+            parallel_outputs = [BgzfWriter(open(path, 'wb')) for path in output_paths]
+            count, parallel_sources = add_population_fields_in_parallel(
+                clinvar_path, [('gnomad_exomes', self.gnomad_path), ('exac_v1', self.exac_path)], parallel_outputs[:2],
+                parallel_outputs[2], 2, tmp_dir=self.tmp_dir, store=store)
+            for output in parallel_outputs:
+                output.close()
+            self.assertEqual(count, len(CLINVAR_ROWS))
+            self.assertEqual([[line.split('\t') for line in gzip.open(path).read().splitlines()] for path in output_paths],
+                             outputs)
+            self.assertEqual([source.counts for source in parallel_sources], [source.counts for source in sources])
+        # the parts are removed
+        self.assertFalse([name for name in os.listdir(self.tmp_dir) if name.startswith('add_population_fields_')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import random
+import unittest
+
+from allele_key import pack_allele_key, unpack_allele_key, is_packed_allele_key, format_allele_key
+from sort_table import get_chromosome_sort_key
+
+
+class TestAlleleKey(unittest.TestCase):
+
+    def test_packed_keys(self):
+        for allele in [('1', 100, 'A', 'G'), ('22', 1, 'ACGTACG', 'T'), ('MT', 16569, 'A', ''),
+                       ('X', 2**28 - 1, 'TTTTTTT', 'GGGGG'), ('Y', 0, '', '')]:
+            key = pack_allele_key(*allele)
+            self.assertTrue(is_packed_allele_key(key))
+            self.assertTrue(0 <= key < 2**63)
+            self.assertEqual(unpack_allele_key(key), allele)
+        self.assertEqual(pack_allele_key('1', '100', 'A', 'G'), pack_allele_key('1', 100, 'A', 'G'))
+        self.assertEqual(format_allele_key(pack_allele_key('1', 100, 'A', 'G')), '1-100-A-G')
+
+    def test_hashed_keys(self):
+        for allele in [('1', 100, 'AAAAAAAA', 'A'), ('1', 100, 'ACGTAC', 'ACGTACG'), ('GL000192.1', 1, 'A', 'G'),
+                       ('1', 2**28, 'A', 'G'), ('1', 100, 'N', 'A'), ('1', 100, 'a', 'g')]:
+            key = pack_allele_key(*allele)
+            self.assertFalse(is_packed_allele_key(key))
+            self.assertTrue(-2**63 <= key < 0)
+            self.assertEqual(unpack_allele_key(key), None)
+        # hashed keys don't depend on the process
+        self.assertEqual(pack_allele_key('GL000192.1', 1, 'A', 'G'), -6013658246066503057)
+
+    def test_distinct_keys(self):
+        rng = random.Random(0)
+        alleles = set()
+        for i in range(5000):
+            chrom = rng.choice(['1', '2', 'X', 'MT', 'GL000192.1'])
+            ref = ''.join(rng.choice('ACGT') for j in range(rng.randint(0, 9)))
+            alt = ''.join(rng.choice('ACGT') for j in range(rng.randint(0, 9)))
+            alleles.add((chrom, rng.randint(1, 20), ref, alt))
+        keys = set(pack_allele_key(*allele) for allele in alleles)
+        self.assertEqual(len(keys), len(alleles))
+        # the ref/alt boundary is part of the key
+        self.assertNotEqual(pack_allele_key('1', 1, 'A', 'CG'), pack_allele_key('1', 1, 'AC', 'G'))
+
+    def test_sort_order(self):
+        alleles = [(chrom, pos, 'A', 'G') for chrom in ('MT', 'X', '10', '2', '1', 'Y') for pos in (5, 1, 300000000 / 2)]
+        expected = sorted(alleles, key=lambda allele: (get_chromosome_sort_key(allele[0]), allele[1]))
+        self.assertEqual(sorted(alleles, key=lambda allele: pack_allele_key(*allele)), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
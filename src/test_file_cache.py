@@ -0,0 +1,75 @@
+import json
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from file_cache import UMASK, check_file, from_bytes, get_file_checksum, make_temp_dir, make_temp_file, \
+    to_bytes, to_numpy, write_json
+
+
+class TestFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'input.txt')
+        self.write_input('abc\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_input(self, content):
+        with open(self.path, 'w') as f:
+            f.write(content)
+
+    def test_check_file(self):
+        stat_result = os.stat(self.path)
+        checksum = get_file_checksum(self.path)
+        self.assertEqual(checksum, get_file_checksum(self.path, chunk_size=1))
+        self.assertEqual(check_file(self.path, stat_result.st_size, stat_result.st_mtime, checksum), (True, None))
+
+        # touched, with the same content: the new mtime is returned to be saved
+        os.utime(self.path, (0, 0))
+        self.assertEqual(check_file(self.path, stat_result.st_size, stat_result.st_mtime, checksum), (True, 0))
+        self.assertEqual(check_file(self.path, stat_result.st_size, 0, checksum), (True, None))
+
+        self.write_input('abd\n')
+        os.utime(self.path, (0, 0))
+        self.assertEqual(check_file(self.path, stat_result.st_size, stat_result.st_mtime, checksum), (False, None))
+        self.write_input('abcd\n')
+        self.assertEqual(check_file(self.path, stat_result.st_size, stat_result.st_mtime, checksum), (False, None))
+
+    def test_temp_paths(self):
+        output_path = os.path.join(self.tmp_dir, 'input.txt.idx')
+        fd, tmp_path = make_temp_file(output_path)
+        os.close(fd)
+        other_fd, other_tmp_path = make_temp_file(output_path)
+        os.close(other_fd)
+        self.assertNotEqual(tmp_path, other_tmp_path)
+        self.assertEqual(os.path.dirname(tmp_path), self.tmp_dir)
+        self.assertEqual(stat.S_IMODE(os.stat(tmp_path).st_mode), 0o666 & ~UMASK)
+
+        tmp_dir = make_temp_dir(output_path)
+        self.assertNotEqual(tmp_dir, make_temp_dir(output_path))
+        self.assertEqual(os.path.dirname(tmp_dir), self.tmp_dir)
+        self.assertEqual(stat.S_IMODE(os.stat(tmp_dir).st_mode), 0o777 & ~UMASK)
+
+    def test_write_json(self):
+        json_path = os.path.join(self.tmp_dir, 'meta.json')
+        for mtime in (1.5, 2.5):
+            write_json(json_path, {'mtime': mtime})
+            with open(json_path) as f:
+                self.assertEqual(json.load(f), {'mtime': mtime})
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['input.txt', 'meta.json'])
+
+    def test_arrays(self):
+        data = to_bytes([0, 1, 2**32 - 1])
+        self.assertEqual(data, '\0\0\0\0\1\0\0\0\xff\xff\xff\xff')
+        self.assertEqual(list(from_bytes(data)), [0, 1, 2**32 - 1])
+        self.assertEqual(list(to_numpy(from_bytes(data), 'uint32')), [0, 1, 2**32 - 1])
+        self.assertEqual(len(to_numpy('', 'int64')), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,20 @@
+import os
+import gzip
+import shutil
+import tempfile
 import unittest
-from group_by_allele import group_alleles, group_by_allele
+from bgzf import BgzfWriter
+from group_by_allele import group_alleles, group_by_allele, group_unsorted_by_allele, group_by_allele_in_parallel
+from join_variant_summary_with_clinvar_alleles import JoinedOutput, join_clinvar_alleles, read_variant_summary
 from pprint import pprint
 from StringIO import StringIO
 from parse_clinvar_xml import HEADER
+from sort_table import sort_table
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
 
 class TestGroupByAllele(unittest.TestCase):
 
@@ -46,6 +58,87 @@ class TestGroupByAllele(unittest.TestCase):
             elif i == 2:
                 self.assertEqual(output_row, '')
 
+    def test_group_unsorted_by_allele(self):
+        r4 = ['2', '100', 'A', 'G'] + self.r3[4:]
+        r5 = ['X', '100', 'A', 'G'] + self.r3[4:]
+        r6 = ['10', '5', 'A', 'G'] + self.r2[4:]
+        sorted_rows = ["\t".join(row)+"\n" for row in [self.header] + sorted([self.r1, self.r2, self.r3]) + [r4, r6, r5]]
+        expected = StringIO()
+        group_by_allele(iter(sorted_rows), expected)
+
+        unsorted_rows = ["\t".join(row)+"\n" for row in [self.header, r5, self.r3, r6, self.r1, r4, self.r2]]
+        for memory_mb in (1024, 0):  # with a memory cap of 0, the rows are partitioned into buckets on disk
+            outfile = StringIO()
+            group_unsorted_by_allele(iter(unsorted_rows), outfile, memory_mb=memory_mb, buckets=3)
+            self.assertEqual(outfile.getvalue(), expected.getvalue())
+        self.assertEqual(len(outfile.getvalue().split('\n')), 6)
+
+    @unittest.skipIf(pysam is None, 'pysam is not installed')
+    def test_group_by_allele_in_parallel(self):
+        rows = [self.r1, self.r2, self.r3] + [[chrom, str(pos)] + self.r2[2:] for chrom in ('1', '2', 'X', 'MT')
+                                               for pos in (100, 100, 200)]
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'clinvar_allele_trait_pairs.tsv.gz')
+            output = BgzfWriter(open(path, 'wb'))
+            sort_table(StringIO(''.join("\t".join(row)+"\n" for row in [self.header] + rows)), output)
+            output.close()
+            pysam.tabix_index(path, seq_col=0, start_col=1, end_col=1, line_skip=1)
+
+            expected = StringIO()
+            group_by_allele(gzip.open(path), expected)
+
+            grouped_path = os.path.join(tmp_dir, 'clinvar_alleles_grouped.tsv.gz')
+            output = BgzfWriter(open(grouped_path, 'wb'))
+            group_by_allele_in_parallel(path, output, workers=2)
+            output.close()
+            self.assertEqual(gzip.open(grouped_path).read(), expected.getvalue())
+            self.assertEqual(len(expected.getvalue().split('\n')), 11)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    @unittest.skipIf(pysam is None, 'pysam is not installed')
+    def test_group_and_join(self):
+        r4 = ['2', '100', 'A', 'G'] + self.r3[4:11] + ['99999'] + self.r3[12:]  # not in the variant summary
+        rows = [self.r1, self.r2, self.r3, r4] + [[chrom, '100'] + self.r2[2:] for chrom in ('X', 'MT')]
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            variant_summary_path = os.path.join(tmp_dir, 'variant_summary.txt.gz')
+            with gzip.open(variant_summary_path, 'wb') as variant_summary:
+                variant_summary.write('#AlleleID\tClinicalSignificance\tLastEvaluated\tAssembly\tReviewStatus\n')
+                variant_summary.write('45333\tBenign\tSep 28, 2016\tGRCh37\treviewed by expert panel\n')
+
+            path = os.path.join(tmp_dir, 'clinvar_allele_trait_pairs.tsv.gz')
+            output = BgzfWriter(open(path, 'wb'))
+            sort_table(StringIO(''.join("\t".join(row)+"\n" for row in [self.header] + rows)), output)
+            output.close()
+            pysam.tabix_index(path, seq_col=0, start_col=1, end_col=1, line_skip=1)
+
+            # the same as grouping, then joining
+            grouped = StringIO()
+            group_by_allele(gzip.open(path), grouped)
+            expected = StringIO()
+            grouped.seek(0)
+            join_clinvar_alleles(grouped, expected, read_variant_summary(variant_summary_path, 'GRCh37'))
+            self.assertEqual(len(expected.getvalue().split('\n')), 5)
+
+            outfile = StringIO()
+            joined_output = JoinedOutput(outfile, read_variant_summary(variant_summary_path, 'GRCh37'))
+            group_by_allele(gzip.open(path), joined_output)
+            self.assertEqual(outfile.getvalue(), expected.getvalue())
+            self.assertEqual((joined_output.rows_read, joined_output.rows_written), (4, 3))
+
+            joined_path = os.path.join(tmp_dir, 'clinvar_alleles.tsv.gz')
+            output = BgzfWriter(open(joined_path, 'wb'))
+            rows_written = group_by_allele_in_parallel(path, output, workers=2,
+                                                       variant_summary_table=variant_summary_path,
+                                                       genome_build_id='GRCh37')
+            output.close()
+            self.assertEqual(rows_written, 3)
+            self.assertEqual(gzip.open(joined_path).read(), expected.getvalue())
+        finally:
+            shutil.rmtree(tmp_dir)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,121 @@
+import gzip
+import os
+import random
+import re
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from bgzf import BGZF_BLOCK_SIZE, BgzfReader, BgzfWriter
+from index_clinvar_xml import get_index_path, index_clinvar_xml, iter_clinvar_xml_index, \
+    iter_clinvar_xml_index_shards, lookup_clinvar_sets, read_clinvar_xml, split_clinvar_xml
+from parse_clinvar_xml import get_handle, parse_clinvar_tree
+
+SAMPLE_XML = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data', 'clinvar_sample.xml')
+
+
+class CountingHandle(StringIO):
+    """StringIO that counts its reads"""
+
+    def __init__(self, data):
+        StringIO.__init__(self, data)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return StringIO.read(self, size)
+
+
+class TestIndexClinvarXml(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_bgzf(self):
+        path = os.path.join(self.tmp_dir, 'test.gz')
+        random.seed(0)
+        lines = ['%d\t%s\n' % (i, 'ACGT' * random.randint(0, 5000)) for i in range(200)]
+
+        writer = BgzfWriter(open(path, 'wb'))
+        offsets = []
+        for line in lines:
+            offsets.append(writer.tell())
+            writer.write(line)
+        writer.close()
+
+        self.assertEqual(gzip.open(path).read(), ''.join(lines))
+        self.assertGreater(len(set(offset >> 16 for offset in offsets)), len(''.join(lines)) // BGZF_BLOCK_SIZE)
+
+        reader = BgzfReader(path)
+        self.assertEqual(list(reader), lines)
+        for i in (150, 3, 199, 0, 42):
+            reader.seek(offsets[i])
+            self.assertEqual(reader.readline(), lines[i])
+            self.assertEqual(reader.read(30000), ''.join(lines[i + 1:])[:30000])
+        reader.close()
+
+    def test_split_clinvar_xml(self):
+        xml = open(SAMPLE_XML).read()
+        for block_size in (1, 7, 100, 2**22):
+            pieces = list(split_clinvar_xml(StringIO(xml), block_size=block_size))
+            self.assertEqual(''.join(data for is_clinvar_set, data in pieces), xml)
+            clinvar_sets = [data for is_clinvar_set, data in pieces if is_clinvar_set]
+            self.assertEqual(len(clinvar_sets), 5)
+            self.assertTrue(all(data.startswith('<ClinVarSet ') and data.endswith('</ClinVarSet>')
+                                for data in clinvar_sets))
+
+    def test_index_clinvar_xml(self):
+        xml_path = os.path.join(self.tmp_dir, 'clinvar.xml.gz')
+        output = BgzfWriter(open(xml_path, 'wb'))
+        with open(get_index_path(xml_path), 'w') as index:
+            self.assertEqual(index_clinvar_xml(get_handle(SAMPLE_XML), output, index), 5)
+        output.close()
+
+        xml = open(SAMPLE_XML).read()
+        self.assertEqual(gzip.open(xml_path).read(), xml)
+
+        reader = BgzfReader(xml_path)
+        entries = list(iter_clinvar_xml_index(get_index_path(xml_path)))
+        for virtual_offset, offset, length in reversed(entries):
+            clinvar_set = read_clinvar_xml(reader, virtual_offset, length)
+            self.assertEqual(clinvar_set, xml[offset:offset + length])
+            self.assertTrue(clinvar_set.startswith('<ClinVarSet ') and clinvar_set.endswith('</ClinVarSet>'))
+
+        # look up by ID: the IDs of the ReferenceClinVarAssertion, including all the MeasureSets of a GenotypeSet
+        for id_type, ids, expected_rcvs in [
+            ('variation', ['53200', '500009', '12345'], ['RCV000150002', 'RCV000500006']),
+            ('allele', ['61000', '22001'], ['RCV000150002', 'RCV000600011']),
+            ('rcv', ['RCV000000012'], ['RCV000000012']),
+        ]:
+            clinvar_sets = [read_clinvar_xml(reader, virtual_offset, length) for virtual_offset, length in
+                            lookup_clinvar_sets(get_index_path(xml_path), id_type, ids)]
+            self.assertEqual([re.search('Acc="(RCV[0-9]+)"', clinvar_set).group(1) for clinvar_set in clinvar_sets],
+                             expected_rcvs)
+
+        shards = list(iter_clinvar_xml_index_shards(get_index_path(xml_path), shard_size=2))
+        self.assertEqual([read_clinvar_xml(reader, *shard).count('</ClinVarSet>') for shard in shards], [2, 2, 1])
+        reader.close()
+
+        # the workers read their shards from the indexed XML
+        expected = StringIO()
+        parse_clinvar_tree(get_handle(SAMPLE_XML), dest=expected, verbose=False)
+        dest = StringIO()
+        parse_clinvar_tree(None, dest=dest, verbose=False, workers=2, shard_size=2,
+                           index_path=get_index_path(xml_path))
+        self.assertEqual(dest.getvalue(), expected.getvalue())
+
+        # and the input stream isn't read, even in a pipeline
+        handle = CountingHandle(open(SAMPLE_XML).read())
+        dest = StringIO()
+        parse_clinvar_tree(handle, dest=dest, verbose=False, workers=2, shard_size=2,
+                           index_path=get_index_path(xml_path), pipeline=True)
+        self.assertEqual(dest.getvalue(), expected.getvalue())
+        self.assertEqual(handle.reads, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
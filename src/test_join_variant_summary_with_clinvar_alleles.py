@@ -0,0 +1,95 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from join_variant_summary_with_clinvar_alleles import FINAL_HEADER, read_variant_summary, join_clinvar_alleles, \
+    get_gold_stars, is_conflicted
+from parse_clinvar_xml import HEADER
+
+VARIANT_SUMMARY_HEADER = ['#AlleleID', 'Type', 'Name', 'ClinicalSignificance', 'LastEvaluated', 'Assembly',
+                          'ReviewStatus', 'VariationID']
+
+
+def make_variant_summary_line(allele_id, assembly, clinical_significance, last_evaluated, review_status):
+    return '\t'.join([allele_id, 'single nucleotide variant', 'name', clinical_significance, last_evaluated,
+                      assembly, review_status, '1']) + '\n'
+
+
+def make_clinvar_alleles_line(chrom, pos, allele_id):
+    row = dict((column, 'x') for column in HEADER)
+    row.update({'chrom': chrom, 'pos': pos, 'ref': 'A', 'alt': 'G', 'allele_id': allele_id})
+    return '\t'.join(row[column] for column in HEADER) + '\n'
+
+
+class TestJoinVariantSummaryWithClinvarAlleles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.variant_summary_path = os.path.join(self.tmp_dir, 'variant_summary.txt.gz')
+        with gzip.open(self.variant_summary_path, 'wb') as variant_summary:
+            variant_summary.write('\t'.join(VARIANT_SUMMARY_HEADER) + '\n')
+            for args in [
+                ('1', 'GRCh37', 'Pathogenic', 'Jan 01, 2017', 'reviewed by expert panel'),
+                ('1', 'GRCh38', 'Benign', 'Jan 01, 2016', 'practice guideline'),
+                ('2', 'GRCh37', 'Conflicting interpretations of pathogenicity', '-',
+                 'criteria provided, conflicting interpretations'),
+                ('2', 'GRCh37', 'Conflicting interpretations of pathogenicity', '-',
+                 'criteria provided, conflicting interpretations'),
+                ('3', 'GRCh37', 'Likely benign', '-', 'no assertion criteria provided'),
+                ('3', 'GRCh37', 'Uncertain significance', '-', 'unknown status'),
+                ('4', 'GRCh38', 'Pathogenic', '-', 'practice guideline'),
+            ]:
+                variant_summary.write(make_variant_summary_line(*args))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_variant_summary(self):
+        variant_summary = read_variant_summary(self.variant_summary_path, 'GRCh37')
+        self.assertEqual(variant_summary, {
+            '1': [('Pathogenic', 'reviewed by expert panel', 'Jan 01, 2017')],
+            '2': [('Conflicting interpretations of pathogenicity', 'criteria provided, conflicting interpretations',
+                   '-')],
+            '3': [('Likely benign', 'no assertion criteria provided', '-'),
+                  ('Uncertain significance', 'unknown status', '-')],
+        })
+        self.assertEqual(sorted(read_variant_summary(self.variant_summary_path, 'GRCh38')), ['1', '4'])
+
+    def test_gold_stars_and_conflicted(self):
+        self.assertEqual(get_gold_stars('practice guideline'), '4')
+        self.assertEqual(get_gold_stars('unknown status'), '')
+        self.assertEqual(is_conflicted('Conflicting interpretations of pathogenicity'), '1')
+        self.assertEqual(is_conflicted('Pathogenic'), '0')
+
+    def test_join_clinvar_alleles(self):
+        infile = StringIO('\t'.join(HEADER) + '\n' +
+                          make_clinvar_alleles_line('1', '10', '3') +
+                          make_clinvar_alleles_line('1', '20', '4') +
+                          make_clinvar_alleles_line('2', '5', '1') +
+                          make_clinvar_alleles_line('X', '7', '2'))
+        outfile = StringIO()
+        variant_summary = read_variant_summary(self.variant_summary_path, 'GRCh37')
+        self.assertEqual(join_clinvar_alleles(infile, outfile, variant_summary), (4, 4))
+
+        lines = outfile.getvalue().splitlines()
+        self.assertEqual(lines[0].split('\t'), FINAL_HEADER)
+        rows = [dict(zip(FINAL_HEADER, line.split('\t'))) for line in lines[1:]]
+        # the input order is kept, allele 4 isn't in the GRCh37 summary, and allele 3 is in it twice
+        self.assertEqual([(row['chrom'], row['pos'], row['allele_id']) for row in rows],
+                         [('1', '10', '3'), ('1', '10', '3'), ('2', '5', '1'), ('X', '7', '2')])
+        self.assertEqual([(row['clinical_significance'], row['gold_stars'], row['conflicted']) for row in rows], [
+            ('Likely benign', '0', '0'),
+            ('Uncertain significance', '', '0'),
+            ('Pathogenic', '3', '0'),
+            ('Conflicting interpretations of pathogenicity', '1', '1'),
+        ])
+        self.assertEqual(rows[2]['last_evaluated'], 'Jan 01, 2017')
+        self.assertEqual(rows[2]['review_status'], 'reviewed by expert panel')
+        self.assertEqual(rows[2]['ref'], 'A')
+
+
+if __name__ == '__main__':
+    unittest.main()
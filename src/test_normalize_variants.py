@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+from collections import defaultdict
+from StringIO import StringIO
+
+from normalize_variants import ReferenceGenome, NormalizationError, RefEqualsAltError, WrongRefError, \
+    InvalidNucleotideSequenceError, UnknownContigError, normalize, normalize_table, normalize_clinvar_set_rows, \
+    read_fai
+from parse_clinvar_xml import HEADER
+
+#                   1         2         3         4
+#          1234567890123456789012345678901234567890
+CHROM_1 = 'GGATCCTACACACACAGTTTTTGCAagcttAGCTAGCTGA'
+CHROM_2 = 'ACGTACGTAC' * 7
+
+
+class TestNormalizeVariants(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fasta_path = os.path.join(self.tmp_dir, 'reference.fa')
+        with open(self.fasta_path, 'w') as fasta:
+            for name, sequence in (('1', CHROM_1), ('2', CHROM_2)):
+                fasta.write('>%s description\n' % name)
+                for i in range(0, len(sequence), 7):
+                    fasta.write(sequence[i:i + 7] + '\n')
+
+        # small windows, so that fetches span several windows and lines
+        self.reference = ReferenceGenome(self.fasta_path, window_size=8, max_windows=2)
+
+    def tearDown(self):
+        self.reference.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_fai(self):
+        self.assertEqual(read_fai(self.fasta_path + '.fai'), {'1': (40, 15, 7, 8), '2': (70, 76, 7, 8)})
+
+    def test_fetch(self):
+        uncached = ReferenceGenome(self.fasta_path, max_windows=0)
+        for chrom, sequence in (('1', CHROM_1.upper()), ('2', CHROM_2)):
+            for start in range(len(sequence) + 2):
+                for end in range(start, len(sequence) + 3):
+                    self.assertEqual(self.reference.fetch(chrom, start, end), sequence[start:end])
+                    self.assertEqual(uncached.fetch(chrom, start, end), sequence[start:end])
+        uncached.close()
+        self.assertRaises(UnknownContigError, self.reference.fetch, 'X', 0, 1)
+
+    def test_normalize(self):
+        # SNVs are unchanged
+        self.assertEqual(normalize(self.reference, '1', '8', 'a', 'G'), ('1', 8, 'A', 'G'))
+        # shared bases are trimmed
+        self.assertEqual(normalize(self.reference, '1', 8, 'ACAC', 'AGAC'), ('1', 9, 'C', 'G'))
+        # indels are left-aligned through repeats
+        self.assertEqual(normalize(self.reference, '1', 13, 'CAC', 'C'), ('1', 7, 'TAC', 'T'))
+        self.assertEqual(normalize(self.reference, '1', 22, 'T', 'TT'), ('1', 17, 'G', 'GT'))
+        self.assertEqual(normalize(self.reference, '1', 22, '-', 'T'), ('1', 17, 'G', 'GT'))
+        self.assertEqual(normalize(self.reference, '1', 18, 'TTTTT', '-'), ('1', 17, 'GTTTTT', 'G'))
+        self.assertEqual(normalize(self.reference, '2', 5, 'ACGT', 'ACGTACGT'), ('2', 1, 'A', 'ACGTA'))
+
+        self.assertRaises(WrongRefError, normalize, self.reference, '1', 8, 'C', 'G')
+        self.assertRaises(RefEqualsAltError, normalize, self.reference, '1', 8, 'A', 'A')
+        self.assertRaises(InvalidNucleotideSequenceError, normalize, self.reference, '1', 8, 'A', 'R')
+        self.assertRaises(UnknownContigError, normalize, self.reference, 'MT', 8, 'A', 'G')
+        self.assertTrue(issubclass(UnknownContigError, NormalizationError))
+
+    def test_normalize_table(self):
+        table = StringIO('\t'.join(HEADER[:5]) + '\n' +
+                         '1\t13\tCAC\tC\tx\n' +
+                         '1\t8\tC\tG\tx\n' +
+                         '\n' +
+                         '2\t1\tA\tC\tx\n')
+        output = StringIO()
+        skipped_counter = defaultdict(int)
+        self.assertEqual(normalize_table(table, output, self.reference, skipped_counter), 2)
+        self.assertEqual(output.getvalue(), 'chrom\tpos\tref\talt\tstart\n1\t7\tTAC\tT\tx\n2\t1\tA\tC\tx\n')
+        self.assertEqual(dict(skipped_counter), {WrongRefError.reason: 1})
+
+    def test_normalize_clinvar_set_rows(self):
+        row_batches = [
+            [('GRCh37', False, u'1\t13\tCAC\tC\trest\n'), ('GRCh38', False, u'1\t13\tCAC\tC\trest\n')],
+            [('GRCh37', True, u'1\t8\tA\tA\trest\n')],
+        ]
+        skipped_counter = defaultdict(int)
+        normalized = list(normalize_clinvar_set_rows(iter(row_batches), {'GRCh37': self.reference}, skipped_counter))
+        self.assertEqual(normalized, [
+            [('GRCh37', False, u'1\t7\tTAC\tT\trest\n'), ('GRCh38', False, u'1\t13\tCAC\tC\trest\n')],
+            [],
+        ])
+        self.assertEqual(dict(skipped_counter), {'GRCh37 ' + RefEqualsAltError.reason: 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,257 @@
+import os
+import sys
+import shutil
+import resource
+import tempfile
+import subprocess
+import unittest
+from collections import defaultdict
+from StringIO import StringIO
+
+from parse_clinvar_xml import HEADER, ENGINES, ClinVarSetCache, get_handle, iter_clinvar_sets, \
+    iter_clinvar_set_shards, iter_cached_clinvar_set_rows, parse_clinvar_tree, parse_clinvar_tree_by_build, \
+    find_clinvar_set_nodes, walk_clinvar_set_nodes, TRAIT_COLUMNS_CACHE
+from lru_cache import LRUCache
+
+SAMPLE_XML = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data', 'clinvar_sample.xml')
+
+# every 5th ClinVarSet only has a GRCh38 location, so it is skipped when parsing GRCh37
+SYNTHETIC_CLINVAR_SET = """<ClinVarSet ID="%(i)d">
+  <RecordStatus>current</RecordStatus>
+  <Title>NM_000000.1(GENE1):c.%(i)dA&gt;G AND not provided</Title>
+  <ReferenceClinVarAssertion ID="%(i)d">
+    <ClinVarAccession Acc="RCV%(i)09d" Version="1" Type="RCV" DateUpdated="2017-01-01"/>
+    <ClinicalSignificance DateLastEvaluated="2016-01-01">
+      <ReviewStatus>criteria provided, single submitter</ReviewStatus>
+      <Description>Pathogenic</Description>
+    </ClinicalSignificance>
+    <MeasureSet Type="Variant" ID="%(i)d">
+      <Measure Type="single nucleotide variant" ID="%(i)d">
+        <Name><ElementValue Type="Preferred">NM_000000.1(GENE1):c.%(i)dA&gt;G</ElementValue></Name>
+        <SequenceLocation Assembly="%(genome_build)s" Chr="1" start="%(i)d" stop="%(i)d" referenceAllele="A" alternateAllele="G"/>
+      </Measure>
+    </MeasureSet>
+    <TraitSet Type="Disease" ID="1">
+      <Trait Type="Disease"><Name><ElementValue Type="Preferred">not provided</ElementValue></Name></Trait>
+    </TraitSet>
+  </ReferenceClinVarAssertion>
+  <ClinVarAssertion ID="%(i)d">
+    <ClinVarSubmissionID submitter="Lab"/>
+    <ClinVarAccession Acc="SCV%(i)09d" Type="SCV" Version="1"/>
+    <ClinicalSignificance><ReviewStatus>criteria provided, single submitter</ReviewStatus><Description>Pathogenic</Description></ClinicalSignificance>
+  </ClinVarAssertion>
+</ClinVarSet>
+"""
+
+
+class SyntheticRelease(object):
+    """File-like ClinVar release with n ClinVarSets that are generated as they are read"""
+
+    def __init__(self, n):
+        self.chunks = self._iter_chunks(n)
+        self.buffer = ''
+
+    def _iter_chunks(self, n):
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n<ReleaseSet Dated="2017-01-01" Type="full">\n'
+        for i in range(1, n + 1):
+            genome_build = 'GRCh38' if i % 5 == 0 else 'GRCh37'
+            yield SYNTHETIC_CLINVAR_SET % locals()
+        yield '</ReleaseSet>\n'
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class NullOutput(object):
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+def get_synthetic_release_peak_rss(n, engine):
+    """Parse a SyntheticRelease of n ClinVarSets and return the peak RSS of the process in KB"""
+    parse_clinvar_tree(SyntheticRelease(n), dest=NullOutput(), multi=NullOutput(), verbose=False, engine=engine)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def parse_sample(**kwargs):
+    dest = StringIO()
+    multi = StringIO()
+    parse_clinvar_tree(get_handle(SAMPLE_XML), dest=dest, multi=multi, verbose=False, **kwargs)
+    return dest.getvalue(), multi.getvalue()
+
+
+class TestParseClinvarXml(unittest.TestCase):
+
+    def test_parse_clinvar_tree(self):
+        single, multi = parse_sample(genome_build='GRCh37')
+
+        single_rows = [dict(zip(HEADER, line.split('\t'))) for line in single.rstrip('\n').split('\n')[1:]]
+        self.assertEqual([(r['chrom'], r['pos'], r['ref'], r['alt']) for r in single_rows],
+                         [('7', '4820844', 'GGAT', 'TGCTGTAAACTGTAACTGTAAA'), ('13', '32890592', 'T', 'A')])
+        self.assertEqual(single_rows[0]['symbol'], 'AP5Z1')
+        self.assertEqual(single_rows[0]['all_pmids'], '12345678;20301682;20613862;23456789')
+        self.assertEqual(single_rows[0]['all_traits'], 'Spastic paraplegia 48, autosomal recessive;'
+                         'SPASTIC PARAPLEGIA 48: AUTOSOMAL RECESSIVE;Spastic paraplegia 48, autosomal recessive')
+        self.assertEqual(single_rows[1]['clinical_significance_ordered'], 'likely benign;uncertain significance')
+
+        # the 2nd allele of the haplotype has no GRCh37 location
+        multi_rows = multi.rstrip('\n').split('\n')[1:]
+        self.assertEqual(len(multi_rows), 1)
+        self.assertEqual(dict(zip(HEADER, multi_rows[0].split('\t')))['allele_id'], '22000')
+
+    def test_parallel_output_matches_serial(self):
+        for genome_build in ('GRCh37', 'GRCh38'):
+            expected = parse_sample(genome_build=genome_build)
+            for shard_size in (1, 2, 10):
+                self.assertEqual(parse_sample(genome_build=genome_build, workers=2, shard_size=shard_size), expected)
+
+    def test_pipeline_output_matches_serial(self):
+        for genome_build in ('GRCh37', 'GRCh38'):
+            expected = parse_sample(genome_build=genome_build)
+            self.assertEqual(parse_sample(genome_build=genome_build, pipeline=True), expected)
+            self.assertEqual(parse_sample(genome_build=genome_build, pipeline=True, workers=2, shard_size=2), expected)
+
+            # more rows than fit in one batch of the writer thread
+            expected = StringIO()
+            parse_clinvar_tree(SyntheticRelease(2500), dest=expected, verbose=False, genome_build=genome_build)
+            dest = StringIO()
+            parse_clinvar_tree(SyntheticRelease(2500), dest=dest, verbose=False, genome_build=genome_build,
+                               pipeline=True)
+            self.assertEqual(dest.getvalue(), expected.getvalue())
+
+    def test_parse_clinvar_tree_by_build(self):
+        outputs = {'GRCh37': (StringIO(), StringIO()), 'GRCh38': (StringIO(), StringIO())}
+        parse_clinvar_tree_by_build(get_handle(SAMPLE_XML), outputs, verbose=False)
+        for genome_build, (dest, multi) in outputs.items():
+            self.assertEqual((dest.getvalue(), multi.getvalue()), parse_sample(genome_build=genome_build))
+
+    def test_engines_output_matches(self):
+        for genome_build in ('GRCh37', 'GRCh38'):
+            expected = parse_sample(genome_build=genome_build, engine='etree')
+            for engine in ENGINES:
+                self.assertEqual(parse_sample(genome_build=genome_build, engine=engine), expected)
+                self.assertEqual(parse_sample(genome_build=genome_build, engine=engine, workers=2, shard_size=2),
+                                 expected)
+
+            # a larger release, with records that are skipped
+            expected = StringIO()
+            parse_clinvar_tree(SyntheticRelease(100), dest=expected, verbose=False, genome_build=genome_build,
+                               engine='etree')
+            for engine in ENGINES:
+                dest = StringIO()
+                parse_clinvar_tree(SyntheticRelease(100), dest=dest, verbose=False, genome_build=genome_build,
+                                   engine=engine)
+                self.assertEqual(dest.getvalue(), expected.getvalue())
+
+    @unittest.skipIf('lxml' not in ENGINES, 'lxml is not installed')
+    def test_lxml_engine(self):
+        self.assertEqual(parse_sample(genome_build='GRCh37', engine='lxml'),
+                         parse_sample(genome_build='GRCh37', engine='etree'))
+
+    def test_walk_clinvar_set_nodes(self):
+        count = 0
+        for elem in iter_clinvar_sets(get_handle(SAMPLE_XML), engine='etree'):
+            expected = find_clinvar_set_nodes(elem)
+            nodes = walk_clinvar_set_nodes(elem)
+            self.assertEqual(sorted(nodes.keys()), sorted(expected.keys()))
+
+            # the measures are only used when there is exactly one measure set
+            if len(expected['measure_sets']) != 1:
+                del nodes['measures'], expected['measures']
+            nodes['measure_set_names'] = nodes['measure_set_names'][:1]
+            for key in expected:
+                self.assertEqual(nodes[key], expected[key], key)
+            count += 1
+        self.assertEqual(count, 5)
+
+    def test_parse_clinvar_tree_memory(self):
+        # parse in a fresh interpreter, so that the peak RSS only depends on the parse
+        for engine in ENGINES:
+            peak_rss = {}
+            for n in (500, 5000):
+                output = subprocess.check_output(
+                    [sys.executable, '-c', 'import test_parse_clinvar_xml as t; '
+                                           'print(t.get_synthetic_release_peak_rss(%d, %r))' % (n, engine)],
+                    cwd=os.path.dirname(os.path.abspath(__file__)))
+                peak_rss[n] = int(output.strip().split('\n')[-1])
+
+            # without pruning the tree, each ClinVarSet adds ~0.7 KB
+            self.assertLess(peak_rss[5000] - peak_rss[500], 1024, engine)
+
+    def test_clinvar_set_cache(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            cache_path = os.path.join(tmp_dir, 'clinvar_sets.sqlite')
+            expected = parse_sample(genome_build='GRCh37')
+            self.assertEqual(parse_sample(genome_build='GRCh37', cache_path=cache_path), expected)
+            self.assertEqual(parse_sample(genome_build='GRCh37', cache_path=cache_path), expected)
+            self.assertEqual(parse_sample(genome_build='GRCh37', cache_path=cache_path, workers=2, shard_size=2),
+                             expected)
+
+            # in the next release, only the changed ClinVarSet is parsed
+            xml = open(SAMPLE_XML).read().replace('SPASTIC PARAPLEGIA 48', 'SPASTIC PARAPLEGIA 49')
+            cache = ClinVarSetCache(cache_path, ['GRCh37'])
+            rows = list(iter_cached_clinvar_set_rows(StringIO(xml), ['GRCh37'], defaultdict(int), cache))
+            cache.close()
+            self.assertEqual((cache.hits, cache.misses), (4, 1))
+            self.assertIn('SPASTIC PARAPLEGIA 49', rows[0][0][2])
+
+            dest = StringIO()
+            parse_clinvar_tree(StringIO(xml), dest=dest, verbose=False, cache_path=cache_path)
+            expected = StringIO()
+            parse_clinvar_tree(StringIO(xml), dest=expected, verbose=False)
+            self.assertEqual(dest.getvalue(), expected.getvalue())
+
+            # the cache is not used for other genome builds
+            cache = ClinVarSetCache(cache_path, ['GRCh37', 'GRCh38'])
+            list(iter_cached_clinvar_set_rows(StringIO(xml), ['GRCh37', 'GRCh38'], defaultdict(int), cache))
+            cache.close()
+            self.assertEqual((cache.hits, cache.misses), (0, 5))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)  # drops b, the least recently used
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertEqual(cache.pop_counts(), (3, 1))
+        self.assertEqual(cache.pop_counts(), (0, 0))
+
+    def test_trait_columns_cache(self):
+        expected = parse_sample(genome_build='GRCh37')
+        TRAIT_COLUMNS_CACHE.items.clear()
+        self.assertEqual(parse_sample(genome_build='GRCh37'), expected)
+        self.assertEqual(TRAIT_COLUMNS_CACHE.hits, 0)
+
+        # the trait columns of the second parse all come from the cache
+        self.assertEqual(parse_sample(genome_build='GRCh37'), expected)
+        self.assertEqual(TRAIT_COLUMNS_CACHE.misses, 0)
+        self.assertGreater(TRAIT_COLUMNS_CACHE.hits, 0)
+
+    def test_iter_clinvar_set_shards(self):
+        xml = open(SAMPLE_XML).read()
+        for block_size in (7, 100, 2**22):
+            shards = list(iter_clinvar_set_shards(StringIO(xml), shard_size=2, block_size=block_size))
+            self.assertEqual([shard.count('<ClinVarSet ') for shard in shards], [2, 2, 1])
+            self.assertTrue(all(shard.startswith('<ClinVarSet ') for shard in shards))
+            self.assertTrue(all(shard.endswith('</ClinVarSet>') for shard in shards))
+            self.assertEqual(''.join(shards).count('</ClinVarSet>'), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
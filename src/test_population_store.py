@@ -0,0 +1,173 @@
+import gzip
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from allele_key import pack_allele_key
+from population_store import PopulationStore, build_population_store, get_store_path, get_value_type, \
+    is_store_up_to_date, open_population_store, sort_keys
+
+FIELDS = ['Filter', 'AC', 'AF', 'MIXED', 'BIG', 'POPMAX', 'NONE', 'AC']
+
+VCF_ROWS = [
+    ('1', 100, 'A', 'G', 'PASS', 'AC=5;AF=0.5;MIXED=3;BIG=1;POPMAX=NFE;CSQ=x|y'),
+    ('1', 100, 'A', 'T', 'AC0', 'AC=0;AF=1e-05;MIXED=0.25;BIG=9999999999;POPMAX=;CSQ=x|y'),
+    ('1', 150, 'ACGTACGTACGT', 'A', 'PASS', 'AC=2;AF=0.1'),  # a hashed allele key
+    ('1', 100, 'A', 'G', 'PASS', 'AC=7;AF=0.7'),  # same allele as the first row
+    ('X', 5, 'C', 'T', 'PASS', 'MIXED=05;BIG=-3'),
+]
+
+
+def build_stores(vcf_path, count=5):
+    """Build the store of a VCF count times, as concurrent runs of add_population_fields.py --store would"""
+    for i in range(count):
+        build_population_store(vcf_path, FIELDS)
+
+
+class TestPopulationStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.vcf_path = os.path.join(self.tmp_dir, 'sites.vcf.gz')
+        self.write_vcf(VCF_ROWS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_vcf(self, rows):
+        with gzip.open(self.vcf_path, 'wb') as vcf:
+            vcf.write('##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+            for chrom, pos, ref, alt, filter_value, info in rows:
+                vcf.write('%s\t%d\t.\t%s\t%s\t100\t%s\t%s\n' % (chrom, pos, ref, alt, filter_value, info))
+
+    def test_value_types(self):
+        self.assertEqual([get_value_type(value) for value in ['5', '-3', '05', '+5', '1' * 20]],
+                         ['int', 'int', 'string', 'string', 'string'])
+        self.assertEqual([get_value_type(value) for value in ['0.5', '1e-05', '1.0e-05', '1.50', 'nan', '']],
+                         ['float', 'float', 'string', 'string', 'string', 'string'])
+
+    def test_store(self):
+        build_population_store(self.vcf_path, FIELDS)
+        store = PopulationStore(get_store_path(self.vcf_path))
+        self.assertEqual(len(store), len(VCF_ROWS))
+        self.assertEqual(store.fields, ['Filter', 'AC', 'AF', 'MIXED', 'BIG', 'POPMAX', 'NONE'])
+        self.assertEqual(store.meta['column_types'], ['string', 'int32', 'float', 'string', 'int64', 'string', 'int32'])
+
+        alleles = [('1', 100, 'A', 'G'), ('1', 100, 'A', 'T'), ('1', 150, 'ACGTACGTACGT', 'A'), ('X', 5, 'C', 'T'),
+                   ('1', 100, 'A', 'C'), ('2', 100, 'A', 'G')]
+        rows = store.lookup([pack_allele_key(*allele) for allele in alleles])
+        self.assertEqual(list(rows[4:]), [-1, -1])
+        found_rows = rows[:4]
+        self.assertEqual(zip(store.ref.get(found_rows), store.alt.get(found_rows)),
+                         [allele[2:] for allele in alleles[:4]])
+        # the values print as in the VCF, and the first row of an allele wins
+        self.assertEqual([store.get_column(field, found_rows) for field in store.fields], [
+            ['PASS', 'AC0', 'PASS', 'PASS'],
+            ['5', '0', '2', None],
+            ['0.5', '1e-05', '0.1', None],
+            ['3', '0.25', None, '05'],
+            ['1', '9999999999', None, '-3'],
+            ['NFE', '', None, None],
+            [None, None, None, None],
+        ])
+
+        self.assertEqual(store.get_alleles_at('1', 100), [('A', 'G'), ('A', 'T'), ('A', 'G')])
+        self.assertEqual(store.get_alleles_at('1', 101), [])
+        self.assertEqual(store.get_alleles_at('MT', 100), [])
+
+    def test_chunks(self):
+        # the rows are read and sorted a few at a time, and the columns change type after some of them were written
+        rng = random.Random(1)
+        rows = []
+        for i in range(200):
+            info = 'AC=%d;AF=%r' % (rng.randint(0, 9), rng.random()) if i < 150 else 'AC=x;AF=.'
+            rows.append((rng.choice(['1', '2', 'GL000192.1']), rng.randint(1, 20), rng.choice(['A', 'ACGTACGTACGT']),
+                         rng.choice(['G', 'T']), 'PASS', info + (';BIG=%d' % 2**40 if i == 120 else '')))
+        self.write_vcf(rows)
+        build_population_store(self.vcf_path, FIELDS, os.path.join(self.tmp_dir, 'store'))
+        build_population_store(self.vcf_path, FIELDS, os.path.join(self.tmp_dir, 'chunked_store'), chunk_size=7)
+        store = PopulationStore(os.path.join(self.tmp_dir, 'store'))
+        chunked_store = PopulationStore(os.path.join(self.tmp_dir, 'chunked_store'))
+        self.assertEqual(chunked_store.meta, store.meta)
+        self.assertEqual(store.meta['column_types'], ['string', 'string', 'string', 'int32', 'int64', 'int32', 'int32'])
+        self.assertEqual(list(chunked_store.allele_keys), list(store.allele_keys))
+        self.assertEqual(list(chunked_store.position_rows), list(store.position_rows))
+        all_rows = np.arange(len(rows))
+        self.assertEqual(chunked_store.ref.get(all_rows), store.ref.get(all_rows))
+        self.assertEqual(chunked_store.alt.get(all_rows), store.alt.get(all_rows))
+        for field in store.fields:
+            self.assertEqual(chunked_store.get_column(field, all_rows), store.get_column(field, all_rows))
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['chunked_store', 'sites.vcf.gz', 'store'])
+
+    def test_sort_keys(self):
+        keys = np.array([random.Random(1).randint(-3, 3) * 2**40 for i in range(1000)], dtype=np.int64)
+        keys.tofile(os.path.join(self.tmp_dir, 'keys'))
+        for chunk_size in (1, 10, 1000, 2000):
+            sort_keys(os.path.join(self.tmp_dir, 'keys'), os.path.join(self.tmp_dir, 'sorted_keys'),
+                      os.path.join(self.tmp_dir, 'order'), self.tmp_dir, chunk_size)
+            order = np.fromfile(os.path.join(self.tmp_dir, 'order'), dtype=np.int64)
+            self.assertEqual(list(order), list(np.argsort(keys, kind='mergesort')))
+            self.assertEqual(list(np.fromfile(os.path.join(self.tmp_dir, 'sorted_keys'), dtype=np.int64)),
+                             sorted(keys))
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['keys', 'order', 'sites.vcf.gz', 'sorted_keys'])
+
+    def test_float_column(self):
+        self.write_vcf([('1', i, 'A', 'G', 'PASS', 'AF=%r' % (i / 7.0) if i % 2 else '') for i in range(1, 10)])
+        build_population_store(self.vcf_path, ['AF'])
+        store = PopulationStore(get_store_path(self.vcf_path))
+        self.assertEqual(store.meta['column_types'], ['float'])
+        rows = store.lookup([pack_allele_key('1', i, 'A', 'G') for i in range(1, 10)])
+        values = store.get_column('AF', rows)
+        self.assertEqual(values, [repr(i / 7.0) if i % 2 else None for i in range(1, 10)])
+        self.assertTrue(math.isnan(store.columns['AF'].values[rows[1]]))
+
+    def test_empty_store(self):
+        self.write_vcf([])
+        store = open_population_store(self.vcf_path, FIELDS)
+        self.assertEqual(len(store), 0)
+        self.assertEqual(list(store.lookup([pack_allele_key('1', 100, 'A', 'G')])), [-1])
+        self.assertEqual(store.get_alleles_at('1', 100), [])
+
+    def test_rebuild(self):
+        store_path = get_store_path(self.vcf_path)
+        store = open_population_store(self.vcf_path, ['AC'])
+        self.assertEqual(store.get_column('AC', store.lookup([pack_allele_key('X', 5, 'C', 'T')])), [None])
+        self.assertTrue(is_store_up_to_date(self.vcf_path, store_path, ['AC']))
+        # a store without all the fields is rebuilt
+        self.assertFalse(is_store_up_to_date(self.vcf_path, store_path, ['AC', 'AF']))
+
+        # touching the VCF doesn't invalidate the store, and its new mtime is saved
+        os.utime(self.vcf_path, (0, 0))
+        self.assertTrue(is_store_up_to_date(self.vcf_path, store_path, ['AC']))
+        self.assertEqual(PopulationStore(store_path).meta['mtime'], 0)
+        self.assertEqual([name for name in os.listdir(store_path) if name.endswith('.tmp')], [])
+
+        # but changing it does
+        self.write_vcf([('X', 5, 'C', 'T', 'PASS', 'AC=1')])
+        self.assertFalse(is_store_up_to_date(self.vcf_path, store_path, ['AC']))
+        store = open_population_store(self.vcf_path, ['AC'])
+        self.assertEqual(store.get_column('AC', store.lookup([pack_allele_key('X', 5, 'C', 'T')])), ['1'])
+        self.assertTrue(is_store_up_to_date(self.vcf_path, store_path, ['AC']))
+
+    def test_concurrent_builds(self):
+        # each builder renames its own store into place, and none of them fails
+        pool = multiprocessing.Pool(4)
+        pool.map(build_stores, [self.vcf_path] * 4)
+        pool.close()
+        pool.join()
+        self.assertEqual(len(PopulationStore(get_store_path(self.vcf_path))), len(VCF_ROWS))
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['sites.vcf.gz', 'sites.vcf.gz.store'])
+
+    def test_multiallelic(self):
+        self.write_vcf([('1', 100, 'A', 'G,T', 'PASS', 'AC=1,2')])
+        self.assertRaises(ValueError, build_population_store, self.vcf_path, FIELDS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from position_filter import build_position_filter, get_filter_path, is_filter_up_to_date, make_position_filter, \
+    open_position_filter, pack_position_key, read_filter_meta
+
+
+class TestPositionFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.vcf_path = os.path.join(self.tmp_dir, 'sites.vcf.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_vcf(self, positions):
+        with gzip.open(self.vcf_path, 'wb') as vcf:
+            vcf.write('##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+            for chrom, pos in positions:
+                vcf.write('%s\t%d\t.\tA\tG\t100\tPASS\tAC=1\n' % (chrom, pos))
+
+    def test_position_keys(self):
+        self.assertEqual(pack_position_key('1', 100), pack_position_key('1', '100'))
+        keys = [pack_position_key(chrom, pos) for chrom in ('1', '2', 'X', 'MT', 'GL000192.1') for pos in (1, 2**28)]
+        self.assertEqual(len(set(keys)), len(keys))
+
+    def test_false_positive_rate(self):
+        position_filter = make_position_filter(10000, 0.01)
+        position_filter.add(np.arange(0, 20000, 2, dtype=np.int64))
+        self.assertEqual(position_filter.key_count, 10000)
+        self.assertAlmostEqual(position_filter.get_false_positive_rate(), 0.01, places=3)
+
+        # no false negatives, and about 1% false positives
+        self.assertTrue(position_filter.contains(np.arange(0, 20000, 2)).all())
+        false_positive_rate = position_filter.contains(np.arange(1, 200000, 2)).mean()
+        self.assertTrue(0.005 < false_positive_rate < 0.02, false_positive_rate)
+
+    def test_build(self):
+        positions = [('1', 100), ('1', 100), ('1', 150), ('2', 100), ('GL000192.1', 5)]
+        self.write_vcf(positions)
+        position_filter, meta = open_position_filter(self.vcf_path)
+        self.assertEqual(meta['positions'], 4)
+        self.assertTrue(position_filter.contains([pack_position_key(chrom, pos) for chrom, pos in positions]).all())
+        self.assertEqual(list(position_filter.contains([pack_position_key('1', 101), pack_position_key('3', 100)])),
+                         [False, False])
+
+    def test_empty_vcf(self):
+        self.write_vcf([])
+        position_filter, meta = open_position_filter(self.vcf_path)
+        self.assertEqual(meta['positions'], 0)
+        self.assertEqual(list(position_filter.contains([pack_position_key('1', 100)])), [False])
+
+    def test_rebuild(self):
+        filter_path = get_filter_path(self.vcf_path)
+        self.write_vcf([('1', 100)])
+        build_position_filter(self.vcf_path)
+        self.assertTrue(is_filter_up_to_date(self.vcf_path, filter_path))
+        self.assertFalse(is_filter_up_to_date(self.vcf_path, filter_path, 0.001))
+
+        # touching the VCF doesn't invalidate the filter, and its new mtime is saved
+        os.utime(self.vcf_path, (0, 0))
+        self.assertTrue(is_filter_up_to_date(self.vcf_path, filter_path))
+        self.assertEqual(read_filter_meta(filter_path)['mtime'], 0)
+
+        self.write_vcf([('1', 200)])
+        self.assertFalse(is_filter_up_to_date(self.vcf_path, filter_path))
+        position_filter, meta = open_position_filter(self.vcf_path)
+        self.assertEqual(list(position_filter.contains([pack_position_key('1', 200)])), [True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from bgzf import BgzfWriter
+from sites_vcf import SortedSitesVcfReader, TabixSitesVcfReader
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+VCF_ROWS = [
+    ('1', 100, 'A', 'G'),
+    ('1', 100, 'A', 'T'),
+    ('1', 150, 'ACGTACGT', 'A'),  # overlaps 151..157
+    ('1', 152, 'C', 'T'),
+    ('1', 5000, 'G', 'A'),
+    ('1', 900000, 'T', 'C'),
+    ('2', 10, 'C', 'CA'),
+    ('2', 20, 'G', 'A'),
+    ('X', 1, 'A', 'C'),
+]
+
+
+@unittest.skipIf(pysam is None, 'pysam is not installed')
+class TestSitesVcf(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(self.tmp_dir, 'sites.vcf.gz')
+        vcf = BgzfWriter(open(path, 'wb'))
+        vcf.write('##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+        for chrom, pos, ref, alt in VCF_ROWS:
+            vcf.write('%s\t%d\t.\t%s\t%s\t100\tPASS\tAC=1\n' % (chrom, pos, ref, alt))
+        vcf.close()
+        pysam.tabix_index(path, preset='vcf')
+        self.tabix_file = pysam.TabixFile(path)
+
+    def tearDown(self):
+        self.tabix_file.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def get_alleles(self, reader, positions):
+        return [[tuple(fields[i] for i in (0, 1, 3, 4)) for fields in reader.get_rows(chrom, pos)]
+                for chrom, pos in positions]
+
+    def test_readers(self):
+        positions = [('1', 99), ('1', 100), ('1', 100), ('1', 151), ('1', 152), ('1', 150), ('1', 900000),
+                     ('1', 900001), ('2', 20), ('X', 1), ('X', 1), ('2', 10)]
+        expected = self.get_alleles(TabixSitesVcfReader(self.tabix_file), positions)
+        self.assertEqual(expected[1], [('1', '100', 'A', 'G'), ('1', '100', 'A', 'T')])
+        self.assertEqual(expected[3], [])
+
+        for max_scan_distance in (0, 1000, 10**9):
+            reader = SortedSitesVcfReader(self.tabix_file, max_scan_distance)
+            self.assertEqual(self.get_alleles(reader, positions), expected)
+
+    def test_seeks(self):
+        positions = [('1', 100), ('1', 100), ('1', 152), ('1', 900000), ('2', 20)]
+        reader = SortedSitesVcfReader(self.tabix_file, 1000)
+        self.get_alleles(reader, positions)
+        # a seek for chromosome 1, one to skip the rows before 900000, and one for chromosome 2
+        self.assertEqual(reader.seeks, 3)
+        reader = SortedSitesVcfReader(self.tabix_file, 10**9)
+        self.get_alleles(reader, positions)
+        self.assertEqual(reader.seeks, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
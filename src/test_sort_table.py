@@ -0,0 +1,75 @@
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from bgzf import BgzfReader, BgzfWriter
+from sort_table import sort_table, get_chromosome_sort_key
+
+HEADER_LINE = 'chrom\tpos\tref\talt\tinfo\n'
+
+
+def make_table(n, seed=0):
+    """Return the lines of a table of n random variants, in random order"""
+
+    rng = random.Random(seed)
+    chroms = ['1', '2', '10', '22', 'X', 'Y', 'MT', 'GL000192.1']
+    lines = []
+    for i in range(n):
+        lines.append('%s\t%d\t%s\t%s\t%d\n' % (rng.choice(chroms), rng.randint(1, 300), rng.choice('ACGT'),
+                                               rng.choice(['A', 'C', 'GT', 'TTA']), rng.randint(0, 3)))
+    return lines
+
+
+def expected_sort(lines):
+    def get_key(line):
+        chrom, pos, ref, alt, info = line.split('\t')
+        return get_chromosome_sort_key(chrom), int(pos), ref, alt, line
+
+    return HEADER_LINE + ''.join(sorted(lines, key=get_key))
+
+
+class TestSortTable(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def sort(self, lines, **kwargs):
+        output_path = os.path.join(self.tmp_dir, 'sorted.tsv.gz')
+        output = BgzfWriter(open(output_path, 'wb'))
+        count = sort_table(StringIO(HEADER_LINE + ''.join(lines)), output, tmp_dir=self.tmp_dir, **kwargs)
+        output.close()
+        self.assertEqual(count, len(lines))
+        self.assertEqual(os.listdir(self.tmp_dir), ['sorted.tsv.gz'])  # the runs and parts were removed
+
+        # the output is a valid gzip and BGZF file
+        reader = BgzfReader(output_path)
+        self.assertEqual(reader.read(), gzip.open(output_path).read())
+        reader.close()
+        return gzip.open(output_path).read()
+
+    def test_chromosome_order(self):
+        chroms = ['MT', 'Y', 'X', '22', '10', '2', '1', 'GL000192.1', 'HLA-A']
+        self.assertEqual(sorted(chroms, key=get_chromosome_sort_key),
+                         ['1', '2', '10', '22', 'X', 'Y', 'MT', 'GL000192.1', 'HLA-A'])
+
+    def test_sort_table(self):
+        lines = make_table(5000)
+        self.assertEqual(self.sort(lines), expected_sort(lines))
+        self.assertEqual(self.sort(lines, workers=2), expected_sort(lines))
+        # a memory budget of 0 spills a run after every line
+        self.assertEqual(self.sort(lines[:300], memory_mb=0), expected_sort(lines[:300]))
+        self.assertEqual(self.sort(lines[:300], memory_mb=0, workers=2), expected_sort(lines[:300]))
+
+    def test_empty_table(self):
+        self.assertEqual(self.sort([]), HEADER_LINE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from bgzf import BgzfWriter
+from tabix_regions import get_balanced_regions, read_tabix_index
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+
+@unittest.skipIf(pysam is None, 'pysam is not installed')
+class TestTabixRegions(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'table.tsv.gz')
+        rng = random.Random(1)
+        self.lines = []
+        # chromosome 1 has most of the rows, and 2 only a few
+        for chrom, count, step in (('1', 20000, 50), ('2', 10, 100000), ('X', 2000, 50)):
+            pos = 1000000
+            for i in range(count):
+                pos += rng.randint(0, step)
+                self.lines.append('%s\t%d\t%x' % (chrom, pos, rng.getrandbits(256)))
+        table = BgzfWriter(open(self.path, 'wb'))
+        table.write('chrom\tpos\tvalue\n')
+        for line in self.lines:
+            table.write(line + '\n')
+        table.close()
+        pysam.tabix_index(self.path, seq_col=0, start_col=1, end_col=1, line_skip=1, force=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_tabix_index(self):
+        sequences = read_tabix_index(self.path + '.tbi')
+        self.assertEqual([name for name, linear_index, end in sequences], ['1', '2', 'X'])
+        for name, linear_index, end in sequences:
+            self.assertEqual(linear_index, sorted(linear_index))
+            self.assertTrue(linear_index[-1] < end)
+
+    def test_balanced_regions(self):
+        regions = get_balanced_regions(self.path + '.tbi', 8)
+        self.assertTrue(len(regions) > 3)
+        self.assertEqual([chrom for chrom, start, end in regions if end is None], ['1', '2', 'X'])
+        for (chrom, start, end), (next_chrom, next_start, next_end) in zip(regions, regions[1:]):
+            self.assertEqual(next_start, end if next_chrom == chrom else 0)
+
+        # each row is in exactly one region, in the order of the table
+        table = pysam.TabixFile(self.path)
+        self.assertEqual([line for chrom, start, end in regions for line in table.fetch(chrom, start, end)],
+                         self.lines)
+        table.close()
+
+    def test_not_an_index(self):
+        with gzip.open(os.path.join(self.tmp_dir, 'other.gz'), 'wb') as f:
+            f.write('chrom\tpos\n')
+        self.assertRaises(ValueError, read_tabix_index, os.path.join(self.tmp_dir, 'other.gz'))
+
+
+if __name__ == '__main__':
+    unittest.main()
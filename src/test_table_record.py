@@ -0,0 +1,54 @@
+import unittest
+from StringIO import StringIO
+
+from table_record import TableReader, TableWriter, make_record_class
+
+HEADER = ['chrom', 'pos', 'ref', 'alt', 'clinical_significance', 'class']
+Record = make_record_class(HEADER, 'Record')
+
+
+class TestTableRecord(unittest.TestCase):
+
+    def test_access(self):
+        record = Record(['1', '100', 'A', 'G', 'Pathogenic', 'x'])
+        self.assertEqual(record[3], 'G')
+        self.assertEqual(record['alt'], 'G')
+        self.assertEqual(record.alt, 'G')
+        self.assertEqual(record['class'], 'x')  # not an attribute, since it's a keyword
+        self.assertEqual(record.get('pos'), '100')
+        self.assertEqual(record.get('missing', '-'), '-')
+        self.assertRaises(KeyError, lambda: record['missing'])
+
+        record.pos = '101'
+        record['ref'] = 'C'
+        record[4] = 'Benign'
+        record.update({'alt': 'T', 'class': 'y'})
+        self.assertEqual(record.fields, ['1', '101', 'C', 'T', 'Benign', 'y'])
+        self.assertEqual(record.to_line(), '1\t101\tC\tT\tBenign\ty\n')
+        self.assertEqual(list(record.as_dict().items()), list(zip(HEADER, record.fields)))
+        self.assertEqual(record, Record.from_line(record.to_line()))
+
+        self.assertEqual(Record().fields, [''] * len(HEADER))
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertRaises(AttributeError, setattr, record, 'other', '')
+
+    def test_reader_and_writer(self):
+        lines = ['\t'.join(HEADER) + '\n', '1\t100\tA\tG\tPathogenic\t\n', 'X\t5\tAC\tA\tBenign\tx\n']
+        reader = TableReader(iter(lines))
+        self.assertEqual(reader.column_names, HEADER)
+        records = list(reader)
+        self.assertEqual([(record.chrom, record.pos, record['class']) for record in records],
+                         [('1', '100', ''), ('X', '5', 'x')])
+
+        output = StringIO()
+        writer = TableWriter(output, reader.column_names)
+        for record in records:
+            writer.write(record)
+        self.assertEqual(output.getvalue(), ''.join(lines))
+
+        self.assertEqual(list(TableReader(iter(lines), Record)), [Record.from_line(line) for line in lines[1:]])
+        self.assertRaises(ValueError, TableReader, iter(['chrom\tpos\n']), Record)
+
+
+if __name__ == '__main__':
+    unittest.main()
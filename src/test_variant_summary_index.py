@@ -0,0 +1,83 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from join_variant_summary_with_clinvar_alleles import read_variant_summary
+from variant_summary_index import VariantSummaryIndex, build_variant_summary_indexes, get_index_path, \
+    is_index_up_to_date, open_variant_summary_index, read_index_header
+
+VARIANT_SUMMARY_HEADER = ['#AlleleID', 'Type', 'ClinicalSignificance', 'LastEvaluated', 'Assembly', 'ReviewStatus']
+
+
+class TestVariantSummaryIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.variant_summary_path = os.path.join(self.tmp_dir, 'variant_summary.txt.gz')
+        self.write_variant_summary([
+            ('15041', 'GRCh37', 'Pathogenic', 'Jan 01, 2017', 'reviewed by expert panel'),
+            ('15041', 'GRCh38', 'Benign', 'Jan 01, 2016', 'practice guideline'),
+            ('15045', 'GRCh37', 'Likely benign', '-', 'no assertion criteria provided'),
+            ('15045', 'GRCh37', 'Uncertain significance', '-', 'criteria provided, single submitter'),
+            ('15045', 'GRCh37', 'Likely benign', '-', 'no assertion criteria provided'),
+            ('15043', 'GRCh37', 'Pathogenic', '-', 'criteria provided, single submitter'),
+            ('20000', 'GRCh38', 'Pathogenic', '-', 'practice guideline'),
+            ('15044', 'NCBI36', 'Pathogenic', '-', 'practice guideline'),
+        ])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_variant_summary(self, rows):
+        with gzip.open(self.variant_summary_path, 'wb') as variant_summary:
+            variant_summary.write('\t'.join(VARIANT_SUMMARY_HEADER) + '\n')
+            for allele_id, assembly, clinical_significance, last_evaluated, review_status in rows:
+                variant_summary.write('\t'.join([allele_id, 'single nucleotide variant', clinical_significance,
+                                                 last_evaluated, assembly, review_status]) + '\n')
+
+    def test_index(self):
+        build_variant_summary_indexes(self.variant_summary_path, ['GRCh37', 'GRCh38'])
+        for genome_build_id in ('GRCh37', 'GRCh38'):
+            index_path = get_index_path(self.variant_summary_path, genome_build_id)
+            self.assertTrue(is_index_up_to_date(self.variant_summary_path, index_path))
+
+            variant_summary = read_variant_summary(self.variant_summary_path, genome_build_id)
+            index = VariantSummaryIndex(index_path)
+            self.assertEqual(len(index), len(variant_summary))
+            for allele_id in ['15040', '15041', '15042', '15043', '15044', '15045', '20000', '20001', '', 'x']:
+                self.assertEqual(index.get(allele_id), variant_summary.get(allele_id))
+            index.close()
+
+    def test_empty_index(self):
+        self.write_variant_summary([])
+        index = open_variant_summary_index(self.variant_summary_path, 'GRCh37')
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.get('15041'), None)
+        index.close()
+
+    def test_rebuild(self):
+        index = open_variant_summary_index(self.variant_summary_path, 'GRCh38')
+        self.assertEqual(index.get('20000'), [('Pathogenic', 'practice guideline', '-')])
+        index.close()
+        index_path = get_index_path(self.variant_summary_path, 'GRCh38')
+
+        # touching the variant summary doesn't invalidate the index, and its new mtime is saved, so that its
+        # checksum isn't computed again
+        os.utime(self.variant_summary_path, (0, 0))
+        self.assertTrue(is_index_up_to_date(self.variant_summary_path, index_path))
+        self.assertEqual(read_index_header(index_path)[3], 0)
+        self.assertTrue(is_index_up_to_date(self.variant_summary_path, index_path))
+
+        # but changing it does
+        self.write_variant_summary([('20000', 'GRCh38', 'Benign', '-', 'practice guideline')])
+        self.assertFalse(is_index_up_to_date(self.variant_summary_path, index_path))
+        index = open_variant_summary_index(self.variant_summary_path, 'GRCh38')
+        self.assertEqual(index.get('20000'), [('Benign', 'practice guideline', '-')])
+        index.close()
+        self.assertTrue(is_index_up_to_date(self.variant_summary_path, index_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
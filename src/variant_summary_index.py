@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+"""Index the (clinical_significance, review_status, last_evaluated) of each allele of variant_summary.txt.gz, so
+that the joins of the single and multi tables of both genome builds don't have to re-read and re-parse the whole
+text file.
+
+The variant summary is read once, and an index file is written for each assembly. Each index file is:
+
+    header    magic, md5 checksum, size and mtime of the variant summary it was made from, the number of alleles,
+              the first allele id, and the counts below
+    value_offsets       uint32 index into values of the first value of each allele id from the first one to the
+                        last one, plus the end of the last one. Allele ids that aren't in the variant summary have no
+                        values. Since allele ids are dense, this is a direct-address table rather than a sorted
+                        array of allele ids, which would need a binary search for each lookup.
+    values              3 uint32 indices into the strings per (clinical_significance, review_status, last_evaluated)
+    string_offsets      uint32 offset into the heap of each distinct string, plus the end of the last one
+    heap                the distinct strings, concatenated
+
+The index files are memory-mapped by the join. An index is rebuilt when the checksum of the variant summary changes.
+The checksum is only computed when the size or mtime of the file changed, so opening an up-to-date index only takes a
+few milliseconds.
+
+    python variant_summary_index.py -i variant_summary.txt.gz -b GRCh37 -b GRCh38
+"""
+
+import argparse
+import mmap
+import os
+import struct
+
+from file_cache import check_file, from_bytes, get_file_checksum, make_temp_file, to_bytes
+from join_variant_summary_with_clinvar_alleles import read_variant_summary_by_build
+
+INDEX_MAGIC = 'CVSIDX02'
+# magic, md5, size, mtime, alleles, first allele id, allele id slots, values, strings, heap size
+INDEX_HEADER = struct.Struct('<8s32sQdQQQQQQ')
+INDEX_MTIME_OFFSET = struct.calcsize('<8s32sQ')
+MAX_SLOTS_PER_ALLELE = 16  # the allele ids must be dense enough for the direct-address table to stay small
+
+VALUE_RANGE = struct.Struct('<II')
+VALUE = struct.Struct('<III')
+
+
+def get_index_path(variant_summary_table, genome_build_id):
+    """Return the default path of the index of an assembly: next to the variant summary, so that it's reused by the
+    next runs"""
+
+    return '%s.%s.idx' % (variant_summary_table, genome_build_id)
+
+
+def write_variant_summary_index(variant_summary, index_path, checksum, source_size, source_mtime):
+    """Write the index file of the variant summary of one assembly.
+
+    Args:
+        variant_summary: dict that maps each allele_id to the list of its (clinical_significance, review_status,
+            last_evaluated) tuples, see join_variant_summary_with_clinvar_alleles.read_variant_summary
+        index_path: Path of the index file. It's written to a temp file that is renamed at the end, so that a join
+            never sees a partial index.
+        checksum, source_size, source_mtime: md5, size and mtime of the variant summary file
+    """
+
+    allele_ids = {int(allele_id): allele_id for allele_id in variant_summary}
+    first_allele_id = min(allele_ids) if allele_ids else 0
+    slot_count = max(allele_ids) - first_allele_id + 1 if allele_ids else 0
+    if slot_count > MAX_SLOTS_PER_ALLELE * len(allele_ids) + 2**20:
+        raise ValueError("The allele ids are too sparse to index: %d alleles from %d to %d" % (
+            len(allele_ids), first_allele_id, first_allele_id + slot_count - 1))
+
+    string_ids = {}
+    strings = []
+    value_offsets = [0]
+    values = []
+    for i in xrange(first_allele_id, first_allele_id + slot_count):
+        if i in allele_ids:
+            for value in variant_summary[allele_ids[i]]:
+                for string in value:
+                    string_id = string_ids.get(string)
+                    if string_id is None:
+                        string_id = string_ids[string] = len(strings)
+                        strings.append(string)
+                    values.append(string_id)
+        value_offsets.append(len(values) // 3)
+
+    string_offsets = [0]
+    for string in strings:
+        string_offsets.append(string_offsets[-1] + len(string))
+    heap = ''.join(strings)
+
+    fd, tmp_path = make_temp_file(index_path)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, checksum, source_size, source_mtime, len(allele_ids),
+                                      first_allele_id, slot_count, len(values) // 3, len(strings), len(heap)))
+            f.write(to_bytes(value_offsets))
+            f.write(to_bytes(values))
+            f.write(to_bytes(string_offsets))
+            f.write(heap)
+        os.rename(tmp_path, index_path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def build_variant_summary_indexes(variant_summary_table, genome_build_ids, index_paths=None):
+    """Read the variant summary once, and write the index of each assembly.
+
+    Args:
+        variant_summary_table: Path of variant_summary.txt.gz
+        genome_build_ids: The assemblies to index, e.g. ['GRCh37', 'GRCh38']
+        index_paths: The index path of each assembly. Default: see get_index_path
+    """
+
+    if index_paths is None:
+        index_paths = [get_index_path(variant_summary_table, genome_build_id) for genome_build_id in genome_build_ids]
+    stat = os.stat(variant_summary_table)
+    checksum = get_file_checksum(variant_summary_table)
+    variant_summaries = read_variant_summary_by_build(variant_summary_table, genome_build_ids)
+    for genome_build_id, index_path in zip(genome_build_ids, index_paths):
+        write_variant_summary_index(variant_summaries[genome_build_id], index_path, checksum, stat.st_size,
+                                    stat.st_mtime)
+
+
+def read_index_header(index_path):
+    """Return the (magic, checksum, size, mtime, alleles, first allele id, slots, values, strings, heap size) header
+    of an index file, or None if it doesn't exist or isn't an index of this version"""
+
+    if not os.path.isfile(index_path):
+        return None
+    with open(index_path, 'rb') as f:
+        data = f.read(INDEX_HEADER.size)
+    if len(data) < INDEX_HEADER.size:
+        return None
+    header = INDEX_HEADER.unpack(data)
+    return header if header[0] == INDEX_MAGIC else None
+
+
+def is_index_up_to_date(variant_summary_table, index_path):
+    header = read_index_header(index_path)
+    if header is None:
+        return False
+    magic, checksum, size, mtime = header[:4]
+    unchanged, new_mtime = check_file(variant_summary_table, size, mtime, checksum)
+    if new_mtime is not None:
+        save_index_mtime(index_path, new_mtime)
+    return unchanged
+
+
+def save_index_mtime(index_path, mtime):
+    """Save the new mtime of the variant summary of an index in its header, in place. The joins that have the index
+    open don't read it."""
+
+    try:
+        with open(index_path, 'r+b') as f:
+            f.seek(INDEX_MTIME_OFFSET)
+            f.write(struct.pack('<d', mtime))
+    except IOError:
+        pass  # e.g. a read-only index, which is still up to date: its checksum is computed again next time
+
+
+class VariantSummaryIndex(object):
+    """Read-only access to a memory-mapped index file. Like the dict of
+    join_variant_summary_with_clinvar_alleles.read_variant_summary, get(allele_id) returns the list of
+    (clinical_significance, review_status, last_evaluated) tuples of an allele_id string, or None.
+    """
+
+    def __init__(self, index_path):
+        header = read_index_header(index_path)
+        if header is None:
+            raise ValueError("Not a variant summary index: %s" % index_path)
+        (magic, self.checksum, size, mtime, self.allele_count, self.first_allele_id, self.slot_count, value_count,
+         string_count, heap_size) = header
+
+        self.handle = open(index_path, 'rb')
+        self.data = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ)
+        offset = INDEX_HEADER.size
+        self.value_offsets_offset = offset
+        offset += 4 * (self.slot_count + 1)
+        self.values_offset = offset
+        offset += 12 * value_count
+        string_offsets = from_bytes(self.data[offset:offset + 4 * (string_count + 1)])
+        offset += 4 * (string_count + 1)
+        self.strings = [self.data[offset + string_offsets[i]:offset + string_offsets[i + 1]]
+                        for i in range(string_count)]
+
+    def __len__(self):
+        return self.allele_count
+
+    def get(self, allele_id, default=None):
+        if not allele_id.isdigit():
+            return default
+        i = int(allele_id) - self.first_allele_id
+        if not 0 <= i < self.slot_count:
+            return default
+        start, end = VALUE_RANGE.unpack_from(self.data, self.value_offsets_offset + 4 * i)
+        if start == end:
+            return default
+
+        strings = self.strings
+        if end - start == 1:  # most alleles have one value
+            a, b, c = VALUE.unpack_from(self.data, self.values_offset + 12 * start)
+            return [(strings[a], strings[b], strings[c])]
+        string_ids = struct.unpack_from('<%dI' % (3 * (end - start)), self.data, self.values_offset + 12 * start)
+        return [(strings[string_ids[j]], strings[string_ids[j + 1]], strings[string_ids[j + 2]])
+                for j in range(0, len(string_ids), 3)]
+
+    def close(self):
+        self.data.close()
+        self.handle.close()
+
+
+def open_variant_summary_index(variant_summary_table, genome_build_id, index_path=None):
+    """Return the VariantSummaryIndex of an assembly, building it first if it doesn't exist or is out of date"""
+
+    if index_path is None:
+        index_path = get_index_path(variant_summary_table, genome_build_id)
+    if not is_index_up_to_date(variant_summary_table, index_path):
+        build_variant_summary_indexes(variant_summary_table, [genome_build_id], [index_path])
+    return VariantSummaryIndex(index_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Index the clinical significance, review status and last evaluated '
+                                                 'date of each allele of variant_summary.txt.gz, by assembly.')
+    parser.add_argument('-i', '--input', required=True, help='variant_summary.txt.gz')
+    parser.add_argument('-b', '--genome-build', dest='genome_build_ids', action='append',
+                        help='Assembly to index, e.g. GRCh37. Can be repeated. Default: GRCh37 and GRCh38')
+    parser.add_argument('-f', '--force', action='store_true', help='Rebuild the indexes even if they are up to date')
+    args = parser.parse_args()
+
+    genome_build_ids = args.genome_build_ids or ['GRCh37', 'GRCh38']
+    if not args.force:
+        genome_build_ids = [genome_build_id for genome_build_id in genome_build_ids
+                            if not is_index_up_to_date(args.input, get_index_path(args.input, genome_build_id))]
+    if genome_build_ids:
+        build_variant_summary_indexes(args.input, genome_build_ids)
+    print("Indexed %s" % (', '.join(genome_build_ids) if genome_build_ids else "nothing: the indexes are up to date"))